@@ -0,0 +1,231 @@
+"""全谱相似度的近似最近邻索引
+
+参考光谱先通过 PCA 降维，再按 k-means 聚类组织成倒排文件（IVF）结构，全部使用 NumPy 实现。
+查询时只扫描与未知光谱最近的 `n_probe` 个聚类，得到候选短名单后再用精确度量重排序。
+索引以 `.npz` 文件的形式保存在数据库文件旁边。
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from xcorr import masked_pearson, normalize_rows
+
+
+def index_path_for(database_path):
+    """返回与数据库对应的索引文件路径"""
+    database_path = Path(database_path)
+    return database_path.with_name(database_path.name + '.index.npz')
+
+
+def database_version(database_path):
+    """用数据库文件的大小和修改时间标识库的版本，库变动后索引需要重建"""
+    stat = Path(database_path).stat()
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+
+def index_version(library, database_path, n_components):
+    """索引的版本：数据库的版本加上建立索引时的波数网格和主成分数，任一改变后索引需要重建"""
+    grid = library.grid
+    grid_key = f'{grid[0]:g}:{grid[-1]:g}:{len(grid)}' if len(grid) else 'empty'
+    return f'{database_version(database_path)}-{grid_key}-{n_components}'
+
+
+def kmeans(data, n_clusters, n_iter=20, seed=0):
+    """简单的 Lloyd k-means，返回聚类中心"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = assign(data, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        # 空聚类重新随机初始化
+        if (~nonempty).any():
+            centroids[~nonempty] = data[rng.choice(len(data), (~nonempty).sum(), replace=False)]
+    return centroids
+
+
+def assign(data, centroids, chunk_size=4096):
+    """将每个向量分配给最近的聚类中心"""
+    labels = np.empty(len(data), dtype=np.int64)
+    c_norms = (centroids ** 2).sum(axis=1)
+    for start in range(0, len(data), chunk_size):
+        block = data[start:start + chunk_size]
+        distances = c_norms[None, :] - 2 * block @ centroids.T
+        labels[start:start + chunk_size] = distances.argmin(axis=1)
+    return labels
+
+
+class SpectralIndex:
+    """PCA + IVF 近似最近邻索引
+
+    - mean, components: PCA 的均值和主成分（n_components, n_points）
+    - centroids: IVF 聚类中心（n_lists, n_components）
+    - order, offsets: 按聚类排序的参考光谱索引，第 i 个聚类为 order[offsets[i]:offsets[i+1]]
+    - codes: 按 `order` 排列的降维向量
+    """
+
+    def __init__(self, mean, components, centroids, order, offsets, codes, filenames, version=''):
+        self.mean = mean
+        self.components = components
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.codes = codes
+        self.filenames = list(filenames)
+        self.version = version
+
+    @classmethod
+    def build(cls, library, n_components=32, n_lists=None, version='', seed=0):
+        """为光谱库建立索引"""
+        if not len(library):
+            raise ValueError('光谱库为空，无法建立索引')
+        vectors = normalize_rows(library.matrix)
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), 20000), replace=False)]
+        mean = sample.mean(axis=0)
+        n_components = min(n_components, *sample.shape)
+        _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+        components = vt[:n_components]
+
+        codes = (vectors - mean) @ components.T
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(codes))))
+        n_lists = min(n_lists, len(codes))
+        centroids = kmeans(codes[rng.choice(len(codes), min(len(codes), 50 * n_lists), replace=False)],
+                           n_lists, seed=seed)
+        labels = assign(codes, centroids)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))])
+        return cls(mean, components, centroids, order, offsets, codes[order], library.filenames, version)
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, components=self.components, centroids=self.centroids,
+                 order=self.order, offsets=self.offsets, codes=self.codes,
+                 filenames=np.array(self.filenames), version=np.array(self.version))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['mean'], data['components'], data['centroids'], data['order'],
+                       data['offsets'], data['codes'], data['filenames'].tolist(), str(data['version']))
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def _masked_similarity(self, u, finite, codes):
+        """降维向量所代表的光谱（mean + code·components）与 u 在有效点上的皮尔逊相关系数
+
+        有效点上的均值和范数都是降维向量的一次、二次函数，只需 (n_components + 1) 阶的 Gram 矩阵。
+        """
+        basis = np.vstack([self.mean[finite], self.components[:, finite]]).astype(float)
+        basis -= basis.mean(axis=1, keepdims=True)
+        dots = basis @ u[finite]
+        gram = basis @ basis.T
+        weights = np.column_stack([np.ones(len(codes)), codes])
+        norms = np.sqrt(np.maximum(np.einsum('ij,jk,ik->i', weights, gram, weights), 1e-12))
+        return weights @ dots / norms
+
+    def search(self, y, n_candidates=200, n_probe=8):
+        """返回候选参考光谱在库中的索引（按降维空间中的距离排序）
+
+        `n_probe` 是召回率与延迟之间的权衡参数：扫描的聚类越多，召回率越高、查询越慢。
+        y 中有 NaN（裁剪或测量范围较窄）时，聚类和候选按其在有效点上与 y 的相关系数排序，
+        不受 NaN 位置的影响。
+        """
+        finite = np.isfinite(y)
+        u = normalize_rows(y)[0]
+        query = (u - self.mean) @ self.components.T
+
+        def distance(codes):
+            if finite.all():
+                return ((codes - query) ** 2).sum(axis=1)
+            return -self._masked_similarity(u, finite, codes)
+
+        probe = np.argsort(distance(self.centroids))[:n_probe]
+        positions = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in probe])
+        distances = distance(self.codes[positions])
+        if len(positions) > n_candidates:
+            best = np.argpartition(distances, n_candidates)[:n_candidates]
+            positions = positions[best]
+            distances = distances[best]
+        return self.order[positions[np.argsort(distances)]]
+
+
+def exact_scores(library, y, candidates=None):
+    """精确度量：未知光谱与参考光谱在未知光谱的有效点上的皮尔逊相关系数（见 xcorr.masked_pearson）"""
+    matrix = library.matrix if candidates is None else library.matrix[candidates]
+    return masked_pearson(matrix, y)[0]
+
+
+def search_library(index, library, y, k=100, n_candidates=200, n_probe=8):
+    """先用索引得到候选短名单，再用精确度量重排序，返回 (库索引, 得分)，按得分降序"""
+    candidates = index.search(y, n_candidates=max(k, n_candidates), n_probe=n_probe)
+    scores = exact_scores(library, y, candidates)
+    order = np.argsort(scores)[::-1][:k]
+    return candidates[order], scores[order]
+
+
+def load_or_build_index(library, database_path, n_components=32):
+    """读取数据库旁的索引文件；若不存在或已过期，则重新建立并保存"""
+    path = index_path_for(database_path)
+    version = index_version(library, database_path, n_components)
+    if path.exists():
+        index = SpectralIndex.load(path)
+        if index.version == version and index.filenames == library.filenames and \
+                index.components.shape[1] == len(library.grid):
+            return index
+    index = SpectralIndex.build(library, n_components=n_components, version=version)
+    index.save(path)
+    return index
+
+
+def benchmark(index, library, n_queries=100, k=10, n_probes=(1, 2, 4, 8, 16, 32), noise=0.02, seed=0):
+    """以穷举搜索为基准，测量不同 n_probe 下的 recall@k 和平均查询延迟"""
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(library), min(n_queries, len(library)), replace=False)
+    queries = library.matrix[picks] + rng.normal(0, noise, (len(picks), library.matrix.shape[1]))
+
+    start = time.perf_counter()
+    truth = [set(np.argsort(exact_scores(library, q))[::-1][:k]) for q in queries]
+    exhaustive = (time.perf_counter() - start) / len(queries)
+    print(f'穷举搜索：{exhaustive * 1000:.2f} ms/次')
+
+    results = []
+    for n_probe in n_probes:
+        if n_probe > index.n_lists:
+            break
+        start = time.perf_counter()
+        found = [search_library(index, library, q, k=k, n_probe=n_probe)[0] for q in queries]
+        latency = (time.perf_counter() - start) / len(queries)
+        recall = np.mean([len(truth[i] & set(f)) / k for i, f in enumerate(found)])
+        results.append((n_probe, recall, latency))
+        print(f'n_probe={n_probe:3d}  recall@{k}={recall:.3f}  {latency * 1000:.2f} ms/次')
+    return results
+
+
+if __name__ == '__main__':
+    from library import SpectralLibrary, make_grid
+
+    parser = argparse.ArgumentParser(description='建立光谱库索引并测量 recall@k')
+    parser.add_argument('database', help='SQLite 光谱数据库路径')
+    parser.add_argument('--components', type=int, default=32)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    with open('config.json', 'r') as f:
+        config = json.load(f)
+    grid = make_grid(config['library grid start'], config['library grid end'], config['library grid step'])
+    library = SpectralLibrary.from_database(args.database, grid)
+    start = time.perf_counter()
+    index = load_or_build_index(library, args.database, n_components=args.components)
+    print(f'索引：{len(library)} 条光谱，{index.n_lists} 个聚类，用时 {time.perf_counter() - start:.2f} 秒')
+    benchmark(index, library, n_queries=args.queries, k=args.k)
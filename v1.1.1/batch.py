@@ -0,0 +1,155 @@
+"""批量光谱处理：一次处理共享同一 x 轴的 (n_spectra, n_points) 光谱矩阵
+
+平滑、基线估计和寻峰的批量版本，用于拉曼面扫描等成百上千条光谱的场景，
+将逐条调用的 Python 开销分摊到整个矩阵上。
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy.linalg import LinAlgError, solve_banded, solveh_banded
+from scipy.signal import find_peaks, savgol_filter
+
+from smoothing import difference_bands, smooth, valid_segments
+from utils import baseline_als, get_peaks
+
+
+def smooth_batch(x, y, method='savgol', window_length=11, polyorder=3, lam=100.0, valid=None):
+    """对所有光谱做平滑（见 smoothing.smooth），NaN 和排除区间（valid 为 False）保持原值，x 轴不变
+
+    Returns:
+    - x, y: x 轴和平滑后的光谱矩阵
+    """
+    return x, smooth(y, method, window_length, polyorder, lam, valid)
+
+
+def baseline_als_batch(y, lam=1e5, p=0.05, niter=1000, valid=None):
+    """批量非对称最小二乘基线估计；不含 NaN 的光谱结果与逐条调用 utils.baseline_als 相同
+
+    所有光谱共享同一个带状差分惩罚矩阵：每次迭代把尚未收敛的光谱拼接成一个块对角的
+    五对角方程组，只需一次带状求解。某条光谱的权重不再变化时其基线已收敛，之后不再参与求解。
+    所有光谱都为 NaN 的列被丢弃（与 baseline_als 一致）。valid（沿波数轴的布尔掩码）为 False 的点
+    权重为 0，基线在这些点上由惩罚项平滑地连接起来，结果为有限值。
+
+    只在个别光谱中为 NaN 的点（同一列在其他光谱中有值）与 baseline_als 的处理不同：baseline_als 删去 NaN 点，把两侧的点当作相邻的点求解；
+    这里 NaN 点留在原位置、权重为 0（与 valid 为 False 的点相同），差分惩罚按原来的下标间距跨过这些点，
+    因此 NaN 附近的基线与 baseline_als 的结果不同。结果中 NaN 点处为 NaN。
+    """
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    n_spectra = len(y)
+    nan = np.isnan(y)
+    columns = ~nan.all(axis=0)
+    y_valid = np.where(nan, 0, y)[:, columns]
+    finite = ~nan[:, columns]
+    observed = finite if valid is None else finite & valid[columns]
+    n_points = y_valid.shape[1]
+
+    bands = difference_bands(n_points, lam)
+    z_valid = np.zeros_like(y_valid)
+    w = observed.astype(float)
+    active = np.arange(n_spectra)
+    for _ in range(niter):
+        n_active = len(active)
+        ab = np.tile(bands, n_active)
+        ab[2] += w[active].ravel()
+        try:
+            z = solveh_banded(ab, (w[active] * y_valid[active]).ravel(), check_finite=False)
+        except LinAlgError:
+            # 有效点过少时矩阵不正定，退回一般带状求解
+            full = np.vstack([ab[:2], ab[2], np.roll(ab[1], -1), np.roll(ab[0], -2)])
+            z = solve_banded((2, 2), full, (w[active] * y_valid[active]).ravel())
+        z = z.reshape(n_active, n_points)
+        z_valid[active] = z
+        ya = y_valid[active]
+        w_new = (p * (ya > z) + (1 - p) * (ya < z)) * observed[active]
+        changed = (w_new != w[active]).any(axis=1)
+        w[active] = w_new
+        active = active[changed]
+        if not len(active):
+            break
+
+    baseline = np.full(y.shape, np.nan)
+    baseline[:, columns] = np.where(finite, z_valid, np.nan)
+    return baseline
+
+
+def find_segment_peaks(y, segments, **kwargs):
+    """在每个 (start, stop) 区间的视图上分别调用 find_peaks，返回整条光谱中的峰索引"""
+    peaks = [find_peaks(y[start:stop], **kwargs)[0] + start for start, stop in segments]
+    return np.concatenate(peaks) if peaks else np.empty(0, dtype=int)
+
+
+def get_peaks_batch(x, y, width=None, rel_height=0.5, height=None, prominence=None, valid=None):
+    """对每条光谱寻峰，返回 [(peaks_x, peaks_y), ...]
+
+    先用向量化的局部极大值、高度和峰峰值条件筛掉不可能有峰的光谱，
+    只对剩余的光谱调用 find_peaks。valid 不为 None 时只在连续的有效区间内寻峰。
+    """
+    y = np.atleast_2d(y)
+    empty = (x[:0], y[0, :0])
+    if valid is not None and not valid.any():
+        return [empty] * len(y)
+    with np.errstate(invalid='ignore'):
+        centre = y[:, 1:-1]
+        candidates = (centre > y[:, :-2]) & (centre >= y[:, 2:])
+        if np.isscalar(height):
+            candidates &= centre >= height
+        if valid is not None:
+            candidates &= valid[:-2] & valid[1:-1] & valid[2:]
+    possible = candidates.any(axis=1)
+    if np.isscalar(prominence):
+        visible = y if valid is None else y[:, valid]
+        possible &= (np.nanmax(visible, axis=1) - np.nanmin(visible, axis=1)) >= prominence
+
+    segments = None if valid is None else valid_segments(valid)
+    kwargs = {'width': width, 'rel_height': rel_height, 'height': height, 'prominence': prominence}
+    results = []
+    for row, has_peaks in zip(y, possible):
+        if not has_peaks:
+            results.append(empty)
+            continue
+        if segments is None:
+            peaks, _ = find_peaks(row, **kwargs)
+        else:
+            peaks = find_segment_peaks(row, segments, **kwargs)
+        results.append((x[peaks], row[peaks]))
+    return results
+
+
+def benchmark(n_spectra=500, n_points=1000, seed=0):
+    """与逐条处理的循环比较批量平滑、基线估计和寻峰的耗时"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(100, 1500, n_points)
+    centres = rng.uniform(200, 1400, size=(n_spectra, 5))
+    y = (np.exp(-((x[None, None, :] - centres[:, :, None]) / 6) ** 2).sum(axis=1) +
+         rng.uniform(0.5, 2, size=(n_spectra, 1)) * (x / 1500) ** 2 +
+         rng.normal(0, 0.02, size=(n_spectra, n_points)))
+    # 一半的像素只有噪声（例如面扫描中样品以外的区域）
+    y[n_spectra // 2:] = rng.normal(0, 0.02, size=(n_spectra - n_spectra // 2, n_points))
+
+    def timed(function):
+        start = time.perf_counter()
+        result = function()
+        return time.perf_counter() - start, result
+
+    t_loop, smooth_loop = timed(lambda: np.array([savgol_filter(row, 11, 3) for row in y]))
+    t_batch, (_, smooth) = timed(lambda: smooth_batch(x, y))
+    print(f'平滑：     逐条 {t_loop:7.3f} 秒  批量 {t_batch:7.3f} 秒  最大误差 {np.abs(smooth - smooth_loop).max():.2e}')
+
+    t_loop, baseline_loop = timed(lambda: np.array([baseline_als(row) for row in y]))
+    t_batch, baseline = timed(lambda: baseline_als_batch(y))
+    print(f'基线估计： 逐条 {t_loop:7.3f} 秒  批量 {t_batch:7.3f} 秒  最大误差 {np.abs(baseline - baseline_loop).max():.2e}')
+
+    t_loop, peaks_loop = timed(lambda: [get_peaks(x, row, None, 0.5, None, 0.5) for row in smooth])
+    t_batch, peaks = timed(lambda: get_peaks_batch(x, smooth, prominence=0.5))
+    same = all(np.array_equal(a[0], b[0]) for a, b in zip(peaks, peaks_loop))
+    print(f'寻峰：     逐条 {t_loop:7.3f} 秒  批量 {t_batch:7.3f} 秒  结果一致 {same}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='批量光谱处理与逐条处理的耗时比较')
+    parser.add_argument('--spectra', type=int, default=500)
+    parser.add_argument('--points', type=int, default=1000)
+    args = parser.parse_args()
+    benchmark(args.spectra, args.points)
@@ -0,0 +1,82 @@
+"""跨会话的相似度检索缓存：重复检索同一条处理后的光谱时直接返回上次的排序结果
+
+缓存保存在一个小型 SQLite 文件中，键由处理后光谱的哈希、参考光谱库的版本、相似度方法及其参数组成，
+总大小超过上限时按最近最少使用（LRU）的顺序淘汰。
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+
+import numpy as np
+
+
+def cache_key(x, y, library_version, method, params):
+    """由光谱数据、库版本、相似度方法和参数计算缓存键"""
+    h = hashlib.blake2b(digest_size=20)
+    for array in (x, y):
+        h.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    h.update(json.dumps([library_version, method, params], sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class SimilarityCache:
+    """LRU 淘汰的持久化检索结果缓存
+
+    每次访问都打开新的连接，因此可以在 GUI 的任意检索线程中使用。
+    """
+
+    def __init__(self, path, max_bytes=50_000_000):
+        self.path = path
+        self.max_bytes = max_bytes
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS Results (
+                    key TEXT PRIMARY KEY, results TEXT, size INTEGER, last_used REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON Results (last_used)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key):
+        """返回缓存的结果并更新其使用时间，未命中时返回 None"""
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute("SELECT results FROM Results WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                conn.execute("UPDATE Results SET last_used = ? WHERE key = ?", (time.time(), key))
+        finally:
+            conn.close()
+        return json.loads(row[0])
+
+    def put(self, key, results):
+        """保存结果，并淘汰最久未使用的条目直到总大小不超过 max_bytes"""
+        text = json.dumps(results, ensure_ascii=False)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO Results VALUES (?, ?, ?, ?)",
+                             (key, text, len(text.encode()), time.time()))
+                excess = conn.execute("SELECT SUM(size) FROM Results").fetchone()[0] - self.max_bytes
+                if excess > 0:
+                    evicted = []
+                    for old_key, size in conn.execute("SELECT key, size FROM Results ORDER BY last_used"):
+                        if excess <= 0:
+                            break
+                        evicted.append((old_key,))
+                        excess -= size
+                    conn.executemany("DELETE FROM Results WHERE key = ?", evicted)
+        finally:
+            conn.close()
+
+    def stats(self):
+        """(条目数, 总字节数)"""
+        conn = self._connect()
+        try:
+            count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM Results").fetchone()
+        finally:
+            conn.close()
+        return count, size
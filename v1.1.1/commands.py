@@ -1,15 +1,42 @@
 """此模块包含处理光谱操作的命令
 
-除 CommandSpectrum 和 CommandHistory 之外的每个类都继承自 Command 类。
+除 CompressedArray 和 CommandHistory 之外的每个类都继承自 Command 类。命令操作的光谱是 spectra.Spectrum，
+它是不可变的，因此命令只需保存数组的引用而不必拷贝。裁剪只改变光谱的排除区间（excluded），不改变数组。
 每个类都有一个 `undo` 和 `execute` 方法。命令存储在 GUI 的 `command_history` 列表中。此结构实现了 GUI 中的撤销/重做功能。
 """
+import weakref
+import zlib
+
 import numpy as np
-import pyqtgraph as pg
-from scipy.signal import savgol_filter
+
+from discretize import move_spot
+from pipeline import DespikeStage, SmoothStage
+from spectra import Spectrum
+
+
+class CompressedArray:
+    """以 zlib 压缩形式保存的数组，用于历史记录中较早的命令"""
+    def __init__(self, array):
+        self.dtype = array.dtype
+        self.shape = array.shape
+        self.data = zlib.compress(np.ascontiguousarray(array).tobytes(), 1)
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+    def restore(self):
+        """解压缩为可写数组"""
+        return np.frombuffer(zlib.decompress(self.data), dtype=self.dtype).reshape(self.shape).copy()
 
 
 class Command:
-    """命令的基类"""
+    """命令的基类
+
+    子类把撤销/重做所需的数组保存在 `_stored` 列出的属性中。这些数组只是引用（不拷贝），
+    因为 Spectrum 的数组是只读的；CommandHistory 据此统计内存占用并在超出预算时压缩。
+    """
+    _stored = ()
 
     def execute(self):
         raise NotImplementedError
@@ -17,29 +44,66 @@ class Command:
     def undo(self):
         raise NotImplementedError
 
+    def stored_arrays(self):
+        """返回命令持有的数组（或压缩数组）"""
+        return [value for value in (getattr(self, name) for name in self._stored) if value is not None]
 
+    def compress(self, cache=None):
+        """压缩命令持有的所有数组
 
-class CommandSpectrum:
-    """表示命令类的光谱"""
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
+        `cache` 以 id(数组) 为键，保存数组的弱引用和压缩结果，使多个命令共享的数组只压缩一次；
+        数组被释放时对应的条目随之删除，因此 cache 可以在多次调用之间保留。
+        """
+        cache = {} if cache is None else cache
+        for name in self._stored:
+            value = getattr(self, name)
+            if isinstance(value, np.ndarray) and value.nbytes:
+                key = id(value)
+                entry = cache.get(key)
+                if entry is None or entry[0]() is not value:
+                    entry = (weakref.ref(value, lambda _, key=key: cache.pop(key, None)), CompressedArray(value))
+                    cache[key] = entry
+                setattr(self, name, entry[1])
 
-    def copy(self):
-        """深度拷贝"""
-        return CommandSpectrum(self.x.copy(), self.y.copy())
+    def _load(self, name):
+        """读取保存的数组，必要时解压缩
 
-    def __iter__(self):
-        return [self.x, self.y].__iter__()
+        解压缩得到的数组只返回给调用者，命令仍保存压缩形式，撤销/重做不会使历史记录超出预算。
+        """
+        value = getattr(self, name)
+        if isinstance(value, CompressedArray):
+            return value.restore()
+        return value
 
 
 
 class CommandHistory:
-    """命令序列的容器类"""
+    """命令序列的容器类
+
+    `max_bytes` 为历史记录的内存预算：超出时先压缩最早的命令，仍超出则丢弃最早的命令。
+    """
 
-    def __init__(self):
+    def __init__(self, max_bytes=None):
         self.commands = []
         self.index = -1
+        self.max_bytes = max_bytes
+        self.compressed = {}  # 已压缩的数组，见 Command.compress
+
+    @staticmethod
+    def _buffer(value):
+        """视图按其底层数组计算"""
+        while isinstance(value, np.ndarray) and isinstance(value.base, np.ndarray):
+            value = value.base
+        return value
+
+    def _buffers(self):
+        """历史记录持有的每个数据缓冲区：id → [缓冲区, 引用它的数组个数]"""
+        buffers = {}
+        for command in self.commands:
+            for value in command.stored_arrays():
+                value = self._buffer(value)
+                buffers.setdefault(id(value), [value, 0])[1] += 1
+        return buffers
 
     def execute(self, command):
         """在执行后禁用进一步的重做"""
@@ -47,33 +111,91 @@ class CommandHistory:
         command.execute()
         self.commands.append(command)
         self.index += 1
-    
+        self.enforce_budget()
+
     def undo(self):
         """撤销最后执行的命令"""
         if self.index < 0:
             return
-     
+
         self.commands[self.index].undo()
         self.index -= 1
+        self.enforce_budget()
 
     def redo(self):
         """重做最后撤销的命令"""
         if self.index == len(self.commands) - 1:
             return
-      
+
         self.index += 1
         self.commands[self.index].execute()
+        self.enforce_budget()
+
+    def memory_usage(self):
+        """返回历史记录持有的数据字节数，多个命令共享的数组只计一次"""
+        return sum(value.nbytes for value, _ in self._buffers().values())
+
+    def memory_report(self):
+        """返回每条命令的 (名称, 字节数, 是否已压缩)，用于查看历史记录的内存占用"""
+        report = []
+        for command in self.commands:
+            values = command.stored_arrays()
+            compressed = any(isinstance(value, CompressedArray) for value in values)
+            report.append((type(command).__name__, sum(value.nbytes for value in values), compressed))
+        return report
+
+    def enforce_budget(self):
+        """超出内存预算时，从最早的命令开始压缩，必要时丢弃最早的已执行命令
+
+        总字节数只统计一次，之后随每次压缩或丢弃增减（按缓冲区的引用计数），不重新遍历整个历史记录。
+        """
+        if self.max_bytes is None:
+            return
+        buffers = self._buffers()
+        total = sum(value.nbytes for value, _ in buffers.values())
+
+        def hold(values):
+            nonlocal total
+            for value in values:
+                value = self._buffer(value)
+                entry = buffers.setdefault(id(value), [value, 0])
+                if not entry[1]:
+                    total += value.nbytes
+                entry[1] += 1
+
+        def release(values):
+            nonlocal total
+            for value in values:
+                key = id(self._buffer(value))
+                buffers[key][1] -= 1
+                if not buffers[key][1]:
+                    total -= buffers.pop(key)[0].nbytes
+
+        for command in self.commands:
+            if total <= self.max_bytes:
+                return
+            before = command.stored_arrays()
+            command.compress(self.compressed)
+            hold(command.stored_arrays())
+            release(before)
+        while self.index >= 0 and total > self.max_bytes:
+            release(self.commands.pop(0).stored_arrays())
+            self.index -= 1
 
 
 class LoadSpectrumCommand(Command):
     """加载光谱的命令"""
+    _stored = ('new_x', 'new_y', 'old_x', 'old_y')
+
     def __init__(self, app, xdata, ydata):
         self.app = app
-        self.new_spectrum = CommandSpectrum(xdata, ydata)
+        self.new_x, self.new_y = xdata, ydata
         if self.app.spectrum is not None:
-            self.old_spectrum = self.app.spectrum.copy()
+            self.old_x, self.old_y = self.app.spectrum
+            self.old_excluded = self.app.spectrum.excluded
         else:
-            self.old_spectrum = None
+            self.old_x, self.old_y = None, None
+            self.old_excluded = ()
 
         self.old_plot1_log = []
 
@@ -92,12 +214,9 @@ class LoadSpectrumCommand(Command):
         self.app.button_find_peaks.setText('显示峰值')
         self.app.crop_button.setText("裁剪")
 
-        self.app.spectrum = self.new_spectrum
-        if self.app.spectrum is not None:
-            self.app.plot1.clear()
-            pen=pg.mkPen(color='k',width=3)
-            self.app.plot1.plot(self.app.spectrum.x, self.app.spectrum.y,pen=pen)
-            self.app.plot1.autoRange()
+        self.app.spectrum = Spectrum(self._load('new_x'), self._load('new_y'))
+        self.app.baseline_mode = None
+        self.app.update_plot1(auto_range=True)
 
         # 添加加载信息到日志
         self.app.plot1_log.addItem(f"已加载文件： {str(self.app.unknown_spectrum_path)}")
@@ -120,14 +239,12 @@ class LoadSpectrumCommand(Command):
             self.app.plot1_log.scrollToItem(self.app.plot1_log.currentItem())
             self.app.plot1_log.clearSelection()
 
-        self.app.spectrum = self.old_spectrum
-        if self.app.spectrum is not None:
-            self.app.plot1.clear()
-            pen=pg.mkPen(color='k',width=3)        
-            self.app.plot1.plot(self.app.spectrum.x, self.app.spectrum.y,pen=pen)
-            self.app.plot1.autoRange()
+        if self.old_y is not None:
+            self.app.spectrum = Spectrum(self._load('old_x'), self._load('old_y'), self.old_excluded)
         else:
-            self.app.plot1.clear()
+            self.app.spectrum = None
+        self.app.baseline_mode = None
+        self.app.update_plot1(auto_range=True)
 
 
 
@@ -143,27 +260,23 @@ class PointDragCommand(Command):
 
     def execute(self):
         """执行拖动点命令"""
-        self.app.draggableScatter.data['x'][self.index] = self.endX
-        self.app.draggableScatter.data['y'][self.index] = self.endY
+        move_spot(self.app.draggableScatter, self.index, self.endX, self.endY)
         self.app.update_discretized_baseline()
     
     def undo(self):
         """撤销拖动点命令"""
-        self.app.draggableScatter.data['x'][self.index] = self.startX
-        self.app.draggableScatter.data['y'][self.index] = self.startY
+        move_spot(self.app.draggableScatter, self.index, self.startX, self.startY)
         self.app.update_discretized_baseline()
     
 
 
 class EstimateBaselineCommand(Command):
     """存储基线估计的计算结果并执行必要的GUI更新"""
+    _stored = ('new_baseline',)
+
     def __init__(self, app, estimated_baseline):
         self.app = app
         self.new_baseline = estimated_baseline
-        if self.app.baseline_data is not None:
-            self.old_baseline = self.app.baseline_data.copy()
-        else:
-            self.old_baseline = None
 
     def execute(self):
 
@@ -176,13 +289,11 @@ class EstimateBaselineCommand(Command):
         self.app.plot1_log.clearSelection()
 
         # 更新数据
-        self.app.baseline_data = self.new_baseline
+        self.app.baseline_data = self._load('new_baseline')
         
         # 更新绘图
-        if self.app.baseline_plot is not None:
-            self.app.plot1.removeItem(self.app.baseline_plot)
-        pen=pg.mkPen(color='r',width=3)
-        self.app.baseline_plot = self.app.plot1.plot(self.app.spectrum.x, self.app.baseline_data, pen=pen)
+        self.app.baseline_mode = 'estimated'
+        self.app.update_plot1()
         
     def undo(self):
         """撤销基线估计命令"""
@@ -191,16 +302,11 @@ class EstimateBaselineCommand(Command):
         self.app.button_find_peaks.setText('显示峰值')
         self.app.crop_button.setText("裁剪")
 
-        self.app.baseline_data = self.old_baseline
-        
+        self.app.baseline_data = None
+
         # 更新绘图
-        if self.app.baseline_plot is not None:
-            self.app.plot1.removeItem(self.app.baseline_plot)
-            self.app.baseline_data = None
-        
-        if self.app.baseline_data is not None:
-            pen=pg.mkPen(color='r',width=3)
-            self.app.baseline_plot = self.app.plot1.plot(self.app.spectrum.x, self.app.baseline_data, pen=pen)
+        self.app.baseline_mode = None
+        self.app.update_plot1()
         self.app.plot1_log.addItem("基线估计已撤销")
         # 选中最后一个项目并滚动到该项目
         self.app.plot1_log.setCurrentRow(self.app.plot1_log.count() - 1)
@@ -211,22 +317,12 @@ class EstimateBaselineCommand(Command):
 
 class CorrectBaselineCommand(Command):
     """校正基线的命令"""
+    _stored = ('baseline',)
+
     def __init__(self, app):
         self.app = app
-
-        # 存储旧的光谱
-        if self.app.spectrum is not None:
-            self.old_spectrum = self.app.spectrum.copy()
-        else:
-            self.old_spectrum = None
-
-        # 更新新的光谱
-        if self.app.baseline_data is not None:
-            self.new_spectrum = CommandSpectrum(self.app.spectrum.x, self.app.spectrum.y - self.app.baseline_data)
-            self.old_baseline_data = self.app.baseline_data.copy()
-        else:
-            self.new_spectrum = CommandSpectrum(self.app.spectrum.x, self.app.spectrum.y)
-            self.old_baseline_data = None
+        # 只保存一次基线：执行时减去，撤销时加回
+        self.baseline = self.app.baseline_data
         
     def execute(self):
         """执行基线校正命令"""
@@ -239,27 +335,26 @@ class CorrectBaselineCommand(Command):
         self.app.plot1_log.scrollToItem(self.app.plot1_log.currentItem())
         self.app.plot1_log.clearSelection()
         
-        self.app.spectrum = self.new_spectrum
-        self.app.plot1.clear()
-        pen=pg.mkPen(color='k',width=3)        
-        self.app.plot1.plot(self.app.spectrum.x, self.app.spectrum.y,pen=pen)
-        self.app.plot1.autoRange()
+        if self.baseline is not None:
+            self.app.spectrum = self.app.spectrum.subtract(self._load('baseline'))
+        self.app.button_show_peak_labels.setText('显示标签')
+        self.app.button_find_peaks.setText('显示峰值')
+        self.app.baseline_mode = None
+        self.app.update_plot1(auto_range=True)
 
     def undo(self):
         """撤销基线校正命令"""
         self.app.button_baseline.setText('应用基线校准')
         self.app.button_show_peak_labels.setText('显示标签')
         self.app.button_find_peaks.setText('显示峰值')
-        self.app.spectrum = self.old_spectrum
-        self.app.baseline_data = self.old_baseline_data # Resture baseline data from before subtraction
-        self.app.plot1.clear()
-        if self.app.spectrum is not None:
-            pen=pg.mkPen(color='k',width=3)        
-            self.app.plot1.plot(self.app.spectrum.x, self.app.spectrum.y,pen=pen)
-        if self.app.baseline_data is not None:
-            pen=pg.mkPen(color='r',width=3)
-            self.app.baseline_plot = self.app.plot1.plot(self.app.spectrum.x, self.app.baseline_data, pen=pen)
-        self.app.plot1.autoRange()
+        if self.baseline is not None:
+            baseline = self._load('baseline')
+            self.app.spectrum = self.app.spectrum.add(baseline)
+            self.app.baseline_data = baseline # Resture baseline data from before subtraction
+        else:
+            self.app.baseline_data = None
+        self.app.baseline_mode = 'estimated'
+        self.app.update_plot1(auto_range=True)
 
         # Message
         self.app.plot1_log.addItem("基线已恢复")
@@ -271,33 +366,19 @@ class CorrectBaselineCommand(Command):
 
 
 class CropCommand(Command):
-    """裁剪光谱的命令"""
+    """裁剪光谱的命令：把区间加入光谱的排除区间，数组本身不变，撤销时恢复原来的排除区间"""
+
     def __init__(self, app, crop_start_x, crop_end_x):
         self.app = app
         self.crop_start_x = crop_start_x
         self.crop_end_x = crop_end_x
-        
-        # 如果光谱不为空，备份旧光谱      
-        if self.app.spectrum is not None:
-            self.old_spectrum = self.app.spectrum.copy()
-        else:
-            self.old_spectrum = None
-        
-        self.new_spectrum = self._get_cropped_spectrum()
-
-    def _get_cropped_spectrum(self):
-        """获取裁剪后的光谱"""
-        indices_to_crop = np.where((self.old_spectrum.x >= self.crop_start_x) & (self.old_spectrum.x <= self.crop_end_x))
-        new_y = self.old_spectrum.y.copy()
-        new_y[indices_to_crop] = np.nan
-        return CommandSpectrum(self.old_spectrum.x, new_y)
+        self.old_excluded = self.app.spectrum.excluded
 
     def execute(self):
         """执行裁剪命令"""
-        self.app.spectrum = self.new_spectrum
-        self.app.plot1.clear()
-        pen=pg.mkPen(color='k',width=3)  
-        self.app.plot1.plot(*self.app.spectrum,pen=pen)
+        self.app.spectrum = self.app.spectrum.crop(self.crop_start_x, self.crop_end_x)
+        self.app.baseline_mode = None
+        self.app.update_plot1()
         self.app.plot1_log.addItem(f'已从{round(self.crop_start_x)}至{round(self.crop_end_x)}(cm^-1)进行光谱裁剪')
         # 选中最后一个项目并滚动到该项目
         self.app.plot1_log.setCurrentRow(self.app.plot1_log.count() - 1)
@@ -307,15 +388,13 @@ class CropCommand(Command):
 
     def undo(self):
         """撤销裁剪命令"""
-        self.app.spectrum = self.old_spectrum
+        self.app.spectrum = self.app.spectrum.with_excluded(self.old_excluded)
         self.app.button_baseline.setText('基线估计')
         self.app.button_show_peak_labels.setText('显示标签')
         self.app.button_find_peaks.setText('显示峰值')
         self.app.crop_button.setText("裁剪")
-        self.app.plot1.clear()
-        if self.app.spectrum is not None:
-            pen=pg.mkPen(color='k',width=3)  
-            self.app.plot1.plot(self.app.spectrum.x, self.app.spectrum.y,pen=pen)
+        self.app.baseline_mode = None
+        self.app.update_plot1()
         self.app.plot1_log.addItem(f'光谱裁剪已撤销')
         # 选中最后一个项目并滚动到该项目
         self.app.plot1_log.setCurrentRow(self.app.plot1_log.count() - 1)
@@ -324,23 +403,24 @@ class CropCommand(Command):
 
 class SmoothSpectrumCommand(Command):
     """光谱平滑处理的命令"""
-    def __init__(self, app):
+    _stored = ('old_x', 'old_y')
+
+    def __init__(self, app, method='savgol', window_length=11, polyorder=3, lam=100.0):
         self.app = app
+        # 重做时按参数重新计算平滑结果，只需引用旧光谱的数组用于撤销
+        self.stage = SmoothStage(method=method, window_length=window_length, polyorder=polyorder, lam=lam)
         if self.app.spectrum is not None:
-            self.old_spectrum = self.app.spectrum.copy()  # 备份旧光谱
+            self.old_x, self.old_y = self.app.spectrum
+            self.old_excluded = self.app.spectrum.excluded
         else:
-            self.old_spectrum = None
+            self.old_x, self.old_y = None, None
+            self.old_excluded = ()
         
 
     def execute(self):
         """执行光谱平滑处理"""
-        # 处理 NaN 数据
-        valid_indices = ~np.isnan(self.app.spectrum.y)
-        valid_x = self.app.spectrum.x[valid_indices]
-        valid_y = self.app.spectrum.y[valid_indices]
-
         # 如果有效数据不足以进行平滑处理，则跳过平滑处理
-        if len(valid_y) < 11:
+        if self.app.spectrum.n_valid() < 3:
             # 添加平滑处理信息到日志
             self.app.plot1_log.addItem('有效数据点不足，无法进行平滑处理')
             self.app.plot1_log.setCurrentRow(self.app.plot1_log.count() - 1)
@@ -348,23 +428,14 @@ class SmoothSpectrumCommand(Command):
             self.app.plot1_log.clearSelection()
             return
 
-        # 设置平滑窗口和多项式阶数
-        window_length = min(11, len(valid_y))  # 确保窗口长度不超过有效数据的长度
-        polyorder = min(3, window_length - 1)  # 多项式阶数应小于窗口长度
-        
-        smoothed_y = savgol_filter(valid_y, window_length, polyorder)
-        # 用平滑后的数据更新光谱数据
-        smoothed_spectrum = CommandSpectrum(valid_x, smoothed_y)
-        self.app.spectrum = smoothed_spectrum
+        # 用平滑后的数据更新光谱数据（在每个有效区间内分别平滑，排除区间内的数据不变）
+        self.app.spectrum = self.app.spectrum.apply(self.stage)
         self.app.button_baseline.setText('基线估计')
         self.app.button_show_peak_labels.setText('显示标签')
         self.app.button_find_peaks.setText('显示峰值')
-        # 更新光谱数据并重新绘制
-        self.app.spectrum.y = smoothed_y
-        self.app.plot1.clear()
-        pen = pg.mkPen(color='k', width=3)  
-        self.app.plot1.plot(self.app.spectrum.x, self.app.spectrum.y, pen=pen)
-        self.app.plot1.autoRange()
+        # 重新绘制
+        self.app.baseline_mode = None
+        self.app.update_plot1(auto_range=True)
 
         # 添加平滑处理信息到日志
         self.app.plot1_log.addItem('已为光谱添加平滑处理')
@@ -378,17 +449,58 @@ class SmoothSpectrumCommand(Command):
         self.app.button_show_peak_labels.setText('显示标签')
         self.app.button_find_peaks.setText('显示峰值')
 
-        self.app.spectrum = self.old_spectrum  # 恢复旧光谱
-        if self.app.spectrum is not None:
-            self.app.plot1.clear()
-            pen = pg.mkPen(color='k', width=3)  
-            self.app.plot1.plot(self.app.spectrum.x, self.app.spectrum.y, pen=pen)
-            self.app.plot1.autoRange()
+        # 恢复旧光谱
+        if self.old_y is not None:
+            self.app.spectrum = Spectrum(self._load('old_x'), self._load('old_y'), self.old_excluded)
         else:
-            self.app.plot1.clear()
+            self.app.spectrum = None
+        self.app.baseline_mode = None
+        self.app.update_plot1(auto_range=True)
 
         self.app.plot1_log.addItem(f'平滑处理已撤销')
         # 选中最后一个项目并滚动到该项目
         self.app.plot1_log.setCurrentRow(self.app.plot1_log.count() - 1)
         self.app.plot1_log.scrollToItem(self.app.plot1_log.currentItem())
-        self.app.plot1_log.clearSelection()
\ No newline at end of file
+        self.app.plot1_log.clearSelection()
+
+
+class DespikeCommand(Command):
+    """自动去除宇宙射线尖峰的命令"""
+    _stored = ('old_y',)
+
+    def __init__(self, app, threshold=6.0, window_length=11, max_width=2):
+        self.app = app
+        self.stage = DespikeStage(threshold=threshold, window_length=window_length, max_width=max_width)
+        # x 和排除区间不变，撤销时只需旧的 y
+        self.old_y = self.app.spectrum.y
+
+    def execute(self):
+        """执行去尖峰"""
+        spectrum = self.app.spectrum
+        state = self.stage.run({'x': spectrum.x, 'y': spectrum.y, 'valid': spectrum.valid})
+        n_spikes = np.count_nonzero(state['spikes'])
+        if n_spikes:
+            self.app.spectrum = spectrum.with_y(state['y'])
+            self.app.button_baseline.setText('基线估计')
+            self.app.button_show_peak_labels.setText('显示标签')
+            self.app.button_find_peaks.setText('显示峰值')
+            self.app.baseline_mode = None
+            self.app.update_plot1()
+        self.app.plot1_log.addItem(f'已去除 {n_spikes} 个尖峰数据点' if n_spikes else '未检测到尖峰')
+        self.app.plot1_log.setCurrentRow(self.app.plot1_log.count() - 1)
+        self.app.plot1_log.scrollToItem(self.app.plot1_log.currentItem())
+        self.app.plot1_log.clearSelection()
+
+    def undo(self):
+        """撤销去尖峰"""
+        self.app.spectrum = self.app.spectrum.with_y(self._load('old_y'))
+        self.app.button_baseline.setText('基线估计')
+        self.app.button_show_peak_labels.setText('显示标签')
+        self.app.button_find_peaks.setText('显示峰值')
+        self.app.baseline_mode = None
+        self.app.update_plot1()
+
+        self.app.plot1_log.addItem('去尖峰已撤销')
+        self.app.plot1_log.setCurrentRow(self.app.plot1_log.count() - 1)
+        self.app.plot1_log.scrollToItem(self.app.plot1_log.currentItem())
+        self.app.plot1_log.clearSelection()
@@ -1,4 +1,8 @@
-"""本模块实现了可拖动的散点图，用于离散化和编辑光谱基线"""
+"""本模块实现了可拖动的散点图，用于离散化和编辑光谱基线
+
+节点的位置只通过 pyqtgraph 的公开接口（getData / setData）读取和修改；
+拖动时基线只对被拖动节点与相邻节点之间的光谱点重新插值（reinterpolate）。
+"""
 
 import sys
 import numpy as np
@@ -6,9 +10,40 @@ from PyQt6.QtWidgets import QApplication, QMainWindow
 from PyQt6 import QtCore
 import pyqtgraph as pg
 
+
+def move_spot(scatter, index, x, y):
+    """把散点图中的第 index 个点移动到 (x, y)，其余点不变"""
+    xs, ys = (np.array(values, dtype=float) for values in scatter.getData())
+    xs[index], ys[index] = x, y
+    scatter.setData(x=xs, y=ys)
+
+
+def reinterpolate(baseline, x, order, sorted_x, nodes_x, nodes_y, index):
+    """第 index 个节点移动后，只对受影响的光谱点重新插值，结果与 np.interp(x, nodes_x, nodes_y) 相同
+
+    受影响的点位于两个相邻节点之间（首末节点还包括其外侧按端点值延伸的部分）。恰好位于右侧相邻节点上的点
+    不受被拖动节点的影响（np.interp 取不超过该点的最后一个节点），即使两个节点的横坐标相同也是如此。
+
+    Parameters:
+    - baseline: 光谱每个点上的基线，就地修改
+    - x: 光谱的横坐标；order 为其稳定排序下标，sorted_x = x[order]
+    - nodes_x, nodes_y: 节点坐标，nodes_x 非递减
+    - index: 被移动的节点
+
+    Returns:
+    - 重新插值的光谱点的下标
+    """
+    lo, hi = max(index - 1, 0), min(index + 1, len(nodes_x) - 1)
+    left = -np.inf if index == 0 else nodes_x[lo]
+    right = np.inf if index == len(nodes_x) - 1 else nodes_x[hi]
+    points = order[np.searchsorted(sorted_x, left, side='left'):np.searchsorted(sorted_x, right, side='left')]
+    baseline[points] = np.interp(x[points], nodes_x[lo:hi + 1], nodes_y[lo:hi + 1])
+    return points
+
+
 class DraggableScatter(pg.ScatterPlotItem):
-    # 定义拖动点和拖动完成的信号
-    pointDragged = QtCore.pyqtSignal()
+    # 定义拖动点（携带索引）和拖动完成的信号
+    pointDragged = QtCore.pyqtSignal(int)
     dragFinished = QtCore.pyqtSignal(int, float, float, float, float) # 信号携带索引和起始、结束坐标
 
     def __init__(self, *args, **kwargs):
@@ -25,7 +60,8 @@ class DraggableScatter(pg.ScatterPlotItem):
             if points :
                 # 如果存在点，保存该点的索引和位置
                 self.draggedPointIndex = points[0].index()
-                self.startPos = (self.data['x'][self.draggedPointIndex], self.data['y'][self.draggedPointIndex])
+                nodes_x, nodes_y = self.getData()
+                self.startPos = (nodes_x[self.draggedPointIndex], nodes_y[self.draggedPointIndex])
             else:
                 self.draggedPointIndex = None   # 重置被拖动的点索引
 
@@ -36,17 +72,24 @@ class DraggableScatter(pg.ScatterPlotItem):
         """处理鼠标拖动事件"""
         if self.draggedPointIndex is not None:  # 如果有被拖动的点
             pos = ev.pos()   # 获取鼠标当前位置
-            self.data['x'][self.draggedPointIndex] = pos.x()
-            self.data['y'][self.draggedPointIndex] = pos.y()
-            self.setData(x=self.data['x'], y=self.data['y'])  # 更新散点图数据
-            self.pointDragged.emit()  # 发送拖动点信号
+            index = self.draggedPointIndex
+            # 点不能越过相邻的点，节点始终按横坐标排列
+            nodes_x, _ = self.getData()
+            x = pos.x()
+            if index > 0:
+                x = max(x, nodes_x[index - 1])
+            if index < len(nodes_x) - 1:
+                x = min(x, nodes_x[index + 1])
+            move_spot(self, index, x, pos.y())
+            self.pointDragged.emit(index)  # 发送拖动点信号
 
         ev.accept()  # 接受事件
 
     def mouseReleaseEvent(self, ev):
         """处理鼠标释放事件"""
         if self.draggedPointIndex is not None:  # 如果有被拖动的点
-            endPos = (self.data['x'][self.draggedPointIndex], self.data['y'][self.draggedPointIndex])  # 获取结束位置
+            nodes_x, nodes_y = self.getData()
+            endPos = (nodes_x[self.draggedPointIndex], nodes_y[self.draggedPointIndex])  # 获取结束位置
             self.dragFinished.emit(self.draggedPointIndex, *self.startPos, *endPos)  # 发送拖动完成信号
         
         self.draggedPointIndex = None   # 重置被拖动的点索引
@@ -66,5 +109,16 @@ class DraggableGraph(pg.GraphItem):
             'pen': pg.mkPen('r')  # 设置连线颜色为红色
         }
         # 使用散点数据创建图形
-        self.setData(pos=np.array(list(zip(self.scatter_data['x'], self.scatter_data['y']))), adj=self.graph_data['adj'], pen=self.graph_data['pen'])
+        self.setData(pos=np.column_stack((self.scatter_data['x'], self.scatter_data['y'])).astype(float),
+                     adj=self.graph_data['adj'], pen=self.graph_data['pen'])
+
+    def set_nodes(self, x, y):
+        """更新所有节点的位置"""
+        self.setData(pos=np.column_stack((x, y)).astype(float))
+
+    def move_node(self, index, x, y):
+        """只移动第 index 个节点"""
+        pos = self.pos.copy()
+        pos[index] = (x, y)
+        self.setData(pos=pos)
 
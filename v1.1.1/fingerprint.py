@@ -0,0 +1,133 @@
+"""光谱指纹：将峰位列表压缩为分箱位集，用位运算快速筛选候选参考光谱
+
+每条光谱（参考或未知）的峰位被映射到固定宽度的波数箱中，并向相邻箱扩展以吸收峰位误差，
+得到一个按位打包的 uint8 位集。参考光谱的位集保存在以箱为键的哈希表中（位采样 LSH，
+每个置位的箱就是一个哈希键），查询时只需取出与未知光谱共享至少一个箱的参考光谱，
+再用按位与 + 位计数为它们打分，从而在访问完整峰值列表或光谱数据之前就把候选缩小到几百条。
+"""
+
+import sqlite3
+
+import numpy as np
+
+from library import parse_vector
+
+# 0-255 每个字节中置位的个数
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(bits):
+    """按行统计打包位集中置位的个数"""
+    return _POPCOUNT[bits].sum(axis=-1, dtype=np.int64)
+
+
+class FingerprintIndex:
+    """参考光谱峰值指纹的哈希表索引
+
+    - filenames, names, peaks, strongest: 参考光谱的文件名、矿物名、峰位数组和最强峰
+    - bits: 形状为 (n_spectra, n_bytes) 的打包位集
+    - tables: 箱号 -> 含有该箱的参考光谱索引数组
+    """
+
+    def __init__(self, filenames, names, peaks, strongest, start, end, bin_width, spread):
+        self.filenames = list(filenames)
+        self.names = list(names)
+        self.peaks = list(peaks)
+        self.strongest = np.asarray(strongest, dtype=float)
+        self.start = start
+        self.bin_width = bin_width
+        self.spread = spread
+        self.n_bins = int(np.ceil((end - start) / bin_width)) + 1
+
+        owners, bins = [], []
+        for i, p in enumerate(self.peaks):
+            b = self.bins_of(p, spread)
+            owners.append(np.full(len(b), i, dtype=int))
+            bins.append(b)
+        owners = np.concatenate(owners) if owners else np.array([], dtype=int)
+        bins = np.concatenate(bins) if bins else np.array([], dtype=int)
+        # 与 np.packbits 相同的位序（高位在前）
+        self.bits = np.zeros((len(self.peaks), (self.n_bins + 7) // 8), dtype=np.uint8)
+        np.bitwise_or.at(self.bits, (owners, bins // 8), (128 >> (bins % 8)).astype(np.uint8))
+
+        # 以箱为键的哈希表
+        order = np.argsort(bins, kind='stable')
+        bins, owners = bins[order], owners[order]
+        keys, first = np.unique(bins, return_index=True)
+        self.tables = dict(zip(keys.tolist(), np.split(owners, first[1:])))
+
+    def __len__(self):
+        return len(self.filenames)
+
+    @classmethod
+    def from_database(cls, database_path, start=0, end=4000, bin_width=4, spread=1):
+        """从数据库的 peaks 列建立索引，不读取完整光谱数据"""
+        conn = sqlite3.connect(database_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT filename, names, peaks, strongest_peak FROM Spectra")
+        filenames, names, peaks, strongest = [], [], [], []
+        for filename, name, peak_list, strongest_peak in cursor:
+            filenames.append(filename)
+            names.append(name)
+            peaks.append(parse_vector(peak_list) if peak_list else np.array([]))
+            strongest.append(strongest_peak if strongest_peak is not None else np.nan)
+        conn.close()
+        return cls(filenames, names, peaks, strongest, start, end, bin_width, spread)
+
+    def bins_of(self, peaks, spread):
+        """返回峰位所在的箱号，并向两侧各扩展 `spread` 个箱"""
+        peaks = np.asarray(peaks, dtype=float)
+        centers = np.floor((peaks - self.start) / self.bin_width).astype(int)
+        bins = (centers[:, None] + np.arange(-spread, spread + 1)[None, :]).ravel()
+        return np.unique(bins[(bins >= 0) & (bins < self.n_bins)])
+
+    def fingerprint(self, peaks, tol=0):
+        """计算未知光谱的打包位集，`tol`（cm^-1）会额外扩展相应数量的箱"""
+        spread = int(np.ceil(tol / self.bin_width))
+        dense = np.zeros(self.n_bins, dtype=bool)
+        dense[self.bins_of(peaks, spread)] = True
+        return np.packbits(dense), dense
+
+    def strongest_within(self, peaks, tol):
+        """与 fetch_filename_and_peaks_filtered 相同的条件：最强峰位于某个未知峰的容差范围内"""
+        peaks = np.sort(np.asarray(peaks, dtype=float))
+        if len(peaks) == 0:
+            return np.zeros(len(self), dtype=bool)
+        idx = np.searchsorted(peaks, self.strongest)
+        left = peaks[np.clip(idx - 1, 0, len(peaks) - 1)]
+        right = peaks[np.clip(idx, 0, len(peaks) - 1)]
+
+        def within(peak):
+            # 与 SQL 条件 strongest_peak >= peak - tol AND strongest_peak <= peak + tol 逐位相同
+            return (self.strongest >= peak - tol) & (self.strongest <= peak + tol)
+
+        return within(left) | within(right)
+
+    def shortlist(self, peaks, n_candidates=None, tol=0, allowed=None):
+        """返回与未知峰值指纹重叠的参考光谱索引，按重叠程度降序排列
+
+        得分为共享置位数除以参考位集的置位数的平方根，避免峰很多的参考光谱总是排在前面。
+        `allowed` 为可选的布尔掩码，只在其为 True 的参考光谱中筛选。
+        `n_candidates` 为 None 时返回全部候选；否则只保留得分最高的 n_candidates 个（会降低召回率，
+        只用于按相似度排序的短名单）。
+        """
+        if len(peaks) == 0:
+            return np.array([], dtype=int)
+        query_bits, dense = self.fingerprint(peaks, tol)
+        hits = [self.tables[b] for b in np.flatnonzero(dense).tolist() if b in self.tables]
+        if not hits:
+            return np.array([], dtype=int)
+        candidates = np.unique(np.concatenate(hits))
+        if allowed is not None:
+            candidates = candidates[allowed[candidates]]
+        bits = self.bits[candidates]
+        overlap = popcount(bits & query_bits)
+        scores = overlap / np.sqrt(np.maximum(popcount(bits), 1))
+        if n_candidates is not None and len(candidates) > n_candidates:
+            best = np.argpartition(scores, -n_candidates)[-n_candidates:]
+            candidates, scores = candidates[best], scores[best]
+        return candidates[np.argsort(scores, kind='stable')[::-1]]
+
+    def rows(self, indices):
+        """返回 find_spectrum_matches 使用的 (filename, peaks) 行"""
+        return [(self.filenames[i], self.peaks[i]) for i in indices]
@@ -8,23 +8,40 @@ from pathlib import Path
 import json
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QSizePolicy,
                             QLabel, QLineEdit, QPushButton, QTextEdit, QGridLayout, QDialog,QGraphicsDropShadowEffect,
-                            QFileDialog, QMessageBox, QListWidget, QListView)
+                            QFileDialog, QMessageBox, QListWidget, QListView, QSpinBox, QSlider)
 from PyQt6.QtGui import QColor, QShortcut, QKeySequence,QGuiApplication,QIcon
 import pyqtgraph as pg
-from PyQt6.QtCore import QTimer
+from PyQt6.QtCore import Qt, QTimer, pyqtSignal
 import numpy as np
 import sqlite3
 
 from utils import find_spectrum_matches, get_unique_mineral_combinations_optimized
-from utils import get_xy_from_file, deserialize, baseline_als, get_peaks
-
-from discretize import DraggableGraph, DraggableScatter
-from plots import CroppablePlotWidget
+from utils import get_xy_from_file, deserialize, fetch_spectra_by_filename
+from pipeline import BaselineStage, PeaksStage
+from peakcandidates import PeakCandidates, library_peak_count, tune
+from peakfit import fit_peaks
+from reader import iter_blocks, read_spectrum, sniff
+from library import SpectralLibrary, make_grid, resample_to_grid
+from resample import resample_many
+from unmix import unmix_spectrum
+from ramanmap import RamanMap
+from xcorr import xcorr_match
+from ann_index import database_version, load_or_build_index, search_library
+from fingerprint import FingerprintIndex
+from server import SIMILARITY_METHODS, ServerClient
+from cache import SimilarityCache, cache_key
+
+from discretize import DraggableGraph, DraggableScatter, reinterpolate
+from plots import CroppablePlotWidget, PeakLabelLayer, render_settings, set_curve
 from commands import (CommandHistory, LoadSpectrumCommand, PointDragCommand,
                         EstimateBaselineCommand, CorrectBaselineCommand,
-                        CropCommand,SmoothSpectrumCommand)
+                        CropCommand,SmoothSpectrumCommand, DespikeCommand)
 
 class MainApp(QMainWindow):
+    # 流式读取多光谱文件时，由读取线程发往主线程：(读取编号, SpectrumBlock) 和 (读取编号, 光谱数, 错误信息)
+    spectra_block_read = pyqtSignal(int, object)
+    spectra_stream_finished = pyqtSignal(int, int, str)
+
     def __init__(self):
         super().__init__()
         self.title = 'Raman Spectra Analyzer'
@@ -34,20 +51,38 @@ class MainApp(QMainWindow):
         #初始化
         self.peaks_x = np.array([])  #初始化峰值坐标
         self.peaks_y = np.array([])  
-        self.peak_texts=[]   #初始化峰值标签列表
+        self.peak_fit = None  # 精修后的峰位、峰高、半高宽和面积（peakfit.PeakFit）
+        self.peak_candidates = None  # 当前光谱的峰候选缓存（peakcandidates.PeakCandidates）
+        self.peak_candidates_spectrum = None
         self.database_path = None
         self.baseline_data = None
-        self.baseline_plot = None
+        self.baseline_mode = None  # 显示的基线：None、'estimated'（估计的基线）或 'discretized'（可拖动的离散化基线）
+        self.baseline_dragging = False  # 正在拖动离散化基线的节点
+        self.baseline_sorted_x = None  # (spectrum.x, 排序下标, 排序后的 x)，拖动时定位受影响的光谱点
         self.loaded_spectrum = None
         self.spectrum = None
         self.cropping = False
         self.crop_region = None
+        self.library = None
+        self.index = None
+        self.fingerprints = None
+        self.search_results = []  # 最近一次相似度检索的 [文件名, 相似度(, 偏移)]，用于相似度缓存
+        self.stream_id = 0  # 每次加载文件时递增，旧的读取线程据此停止
+        self.stream_layout = None
+        self.stream_offsets = []
 
         with open('config.json', 'r') as f:
             self.config = json.load(f)
+        self.init_plot_items()
         
 
-        self.command_history = CommandHistory()
+        self.command_history = CommandHistory(max_bytes=self.config['undo history max bytes'])
+        self.similarity_cache = None
+        if self.config['similarity cache path']:
+            # 相对路径相对于配置文件所在的目录，而不是当前工作目录
+            cache_path = Path('config.json').resolve().parent / self.config['similarity cache path']
+            self.similarity_cache = SimilarityCache(cache_path,
+                                                    max_bytes=self.config['similarity cache max bytes'])
 
     def init_UI(self):
         """初始化用户界面
@@ -239,6 +274,16 @@ class MainApp(QMainWindow):
         self.apply_shadow_effect(self.button_load_file)
         plot1_row1_buttons_layout.addWidget(self.button_load_file)
 
+        # 多光谱文件的光谱序号，加载多光谱文件时显示
+        self.spectrum_index_box = QSpinBox(self)
+        self.spectrum_index_box.setPrefix('光谱 ')
+        self.spectrum_index_box.setMinimum(1)
+        self.spectrum_index_box.setVisible(False)
+        self.spectrum_index_box.valueChanged.connect(self.load_streamed_spectrum)
+        plot1_row1_buttons_layout.addWidget(self.spectrum_index_box)
+        self.spectra_block_read.connect(self.on_spectra_block_read)
+        self.spectra_stream_finished.connect(self.on_spectra_stream_finished)
+
         # 基线估计按钮
         self.button_baseline = QPushButton('基线估计', self)
         self.button_baseline.clicked.connect(self.baseline_callback)
@@ -295,6 +340,13 @@ class MainApp(QMainWindow):
 
         self.apply_shadow_effect(self.button_reset)
         plot1_row3_buttons_layout.addWidget(self.button_reset)
+
+        # 去尖峰按钮
+        self.button_despike = QPushButton('去除尖峰', self)
+        self.button_despike.clicked.connect(self.despike_spectrum)
+
+        self.apply_shadow_effect(self.button_despike)
+        plot1_row3_buttons_layout.addWidget(self.button_despike)
         
         # 保存光谱按钮
         self.button_save_spectrum = QPushButton('保存光谱', self)
@@ -329,6 +381,27 @@ class MainApp(QMainWindow):
         self.textbox_prominence.setPlaceholderText(' 显著性')
         plot1_peak_params_layout.addWidget(self.textbox_prominence, 1, 1)
 
+        # 滑块：在缓存的峰候选中实时筛选（高度线性取值，显著性和宽度按对数取值，最左端表示不限制）
+        self.peak_sliders = {}
+        for row, (name, label, textbox) in enumerate((('height', '高度', self.textbox_height),
+                                                      ('prominence', '显著性', self.textbox_prominence),
+                                                      ('width', '宽度', self.textbox_width)), start=2):
+            slider = QSlider(Qt.Orientation.Horizontal, self)
+            slider.setRange(0, 1000)
+            slider.valueChanged.connect(lambda value, name=name, textbox=textbox:
+                                        self.on_peak_slider_moved(name, textbox, value))
+            slider.sliderReleased.connect(self.on_peak_slider_released)
+            plot1_peak_params_layout.addWidget(QLabel(label, self), row, 0)
+            plot1_peak_params_layout.addWidget(slider, row, 1)
+            self.peak_sliders[name] = slider
+
+        # 自动寻峰参数按钮
+        self.button_auto_peaks = QPushButton('自动参数', self)
+        self.button_auto_peaks.clicked.connect(self.auto_tune_peaks)
+
+        self.apply_shadow_effect(self.button_auto_peaks)
+        plot1_peak_params_layout.addWidget(self.button_auto_peaks, 5, 0, 1, 2)
+
         # Plot 1日志记录列表
         self.plot1_log = QListWidget()
         plot1_buttons_layout.addWidget(self.plot1_log)
@@ -396,6 +469,23 @@ class MainApp(QMainWindow):
         self.apply_shadow_effect(self.reset_button)
         plot2_row2_buttons_layout.addWidget(self.reset_button)
 
+        plot2_row3_buttons_layout = QHBoxLayout()
+        plot2_row3_buttons_widget = QWidget()
+        plot2_row3_buttons_widget.setLayout(plot2_row3_buttons_layout)
+        plot2_buttons_layout.addWidget(plot2_row3_buttons_widget)
+
+        # 全谱解混按钮：将光谱拟合为参考光谱的非负组合
+        self.unmix_button = QPushButton('光谱解混', self)
+        self.unmix_button.clicked.connect(self.unmix_database)
+        self.apply_shadow_effect(self.unmix_button)
+        plot2_row3_buttons_layout.addWidget(self.unmix_button)
+
+        # 面扫描鉴定按钮：将面扫描的每个像素与参考光谱库比较
+        self.map_button = QPushButton('面扫描鉴定', self)
+        self.map_button.clicked.connect(self.identify_map)
+        self.apply_shadow_effect(self.map_button)
+        plot2_row3_buttons_layout.addWidget(self.map_button)
+
         # 数据库搜索结果的列表组件，允许多选
         self.results_list = QListWidget(self)
         self.results_list.setSelectionMode(QListView.SelectionMode.ExtendedSelection)
@@ -414,7 +504,31 @@ class MainApp(QMainWindow):
             QMessageBox.critical(self, '错误', '请先加载光谱数据！')
             return
 
-        command = SmoothSpectrumCommand(self)
+        try:
+            command = SmoothSpectrumCommand(self,
+                                            method=self.config['smoothing method'],
+                                            window_length=self.config['smoothing window length'],
+                                            polyorder=self.config['smoothing polyorder'],
+                                            lam=self.config['smoothing lambda'])
+        except ValueError as e:
+            QMessageBox.critical(self, '错误', f'平滑参数无效：{e}')
+            return
+        self.command_history.execute(command)
+
+    def despike_spectrum(self):
+        """自动去除宇宙射线尖峰"""
+        if self.spectrum is None:
+            QMessageBox.critical(self, '错误', '请先加载光谱数据！')
+            return
+
+        try:
+            command = DespikeCommand(self,
+                                     threshold=self.config['despike threshold'],
+                                     window_length=self.config['despike window length'],
+                                     max_width=self.config['despike max width'])
+        except ValueError as e:
+            QMessageBox.critical(self, '错误', f'去尖峰参数无效：{e}')
+            return
         self.command_history.execute(command)
 
     def apply_shadow_effect(self,widget):
@@ -430,16 +544,21 @@ class MainApp(QMainWindow):
         # 清除加载的数据库、光谱等数据
         self.database_path = None
         self.baseline_data = None
-        self.baseline_plot = None
+        self.baseline_mode = None
         self.loaded_spectrum = None
         self.spectrum = None
         self.cropping = False
         self.crop_region = None
+        self.library = None
+        self.index = None
+        self.fingerprints = None
+        self.stop_streaming()
      
         # 清空 peaks_x 和 peaks_y
         self.peaks_x = np.array([])  
         self.peaks_y = np.array([])  
-        self.peak_texts.clear()
+        self.peak_fit = None
+        self.peak_candidates = None
 
 
         # 重置UI组件到初始状态
@@ -452,9 +571,13 @@ class MainApp(QMainWindow):
         self.result_double.clear()
         self.result_triple.clear()
         
-        # 清除图形绘制区域
-        self.plot1.clear()
+        # 清除图形绘制区域：plot1 的常驻图形项只清空数据，基线节点和峰值标签由 refresh_plot1 移除
+        if self.plot1.crop_region is not None:
+            self.plot1.removeItem(self.plot1.crop_region)
+            self.plot1.crop_region = None
+        self.plot1.cropping = False
         self.plot2.clear()
+        self.update_plot1()
         
         # 清除峰值查找参数输入框
         self.textbox_width.clear()
@@ -564,12 +687,10 @@ class MainApp(QMainWindow):
         
     def undo(self):
         """"撤销"""
-        print('Undo activated')
         self.command_history.undo()
     
     def redo(self):
         """"重做"""
-        print('Redo activated')
         self.command_history.redo()
 
     def toggle_crop_mode(self):
@@ -613,21 +734,128 @@ class MainApp(QMainWindow):
 
         if fname:  # 检查用户是否没有取消对话框
             with open(fname, 'w') as f:
-                for x, y in zip(self.spectrum.x, self.spectrum.y):
+                for x, y in zip(self.spectrum.x, self.spectrum.masked_y()):
                     f.write(f"{x} {y}\n")
             
             self.plot1_log.addItem(f'已保存修改后的光谱： {fname}')
             self.to_end()
 
-    def update_discretized_baseline(self):
+    def init_plot_items(self):
+        """创建 plot1 的常驻图形项：光谱、估计的基线、插值的离散化基线、峰值标记和峰值标签
+
+        图形项一直保留，数据改变时只调用 setData；所有重绘都经由 update_plot1 合并为一次。
+        曲线按配置的绘制设置（降采样、裁剪到视图、细画笔，见 plots.py）绘制。
+        """
+        self.render_settings = render_settings(self.config)
+        self.spectrum_plot = pg.PlotDataItem()
+        self.baseline_plot = pg.PlotDataItem()
+        self.interpolated_baseline = pg.PlotDataItem()
+        self.curve_colors = {self.spectrum_plot: 'k', self.baseline_plot: 'r', self.interpolated_baseline: 'g'}
+        self.peak_plot = pg.PlotDataItem(pen=None, symbol='o', symbolSize=7, symbolBrush=(255, 0, 0))
+        # 所有峰值标签由一个图形项绘制，只显示当前缩放下互不重叠的标签
+        self.peak_labels = PeakLabelLayer(color=(255, 0, 0))
+        self.plot1_items = (self.spectrum_plot, self.baseline_plot, self.interpolated_baseline, self.peak_plot,
+                            self.peak_labels)
+        # 每个图形项当前显示的数据（数组对象），数据未变时跳过 setData
+        self.plot1_shown = dict.fromkeys(self.plot1_items)
+        self.plot1_update_pending = False
+        self.plot1_auto_range = False
+        self.masked_spectrum = None  # masked_y 按光谱对象缓存，以便识别未改变的数据
+        self.masked_spectrum_y = None
+        for item in self.plot1_items:
+            self.plot1.addItem(item)
+
+    def update_plot1(self, auto_range=False):
+        """请求按当前状态重绘 plot1；同一轮事件循环中的多次请求（如连续撤销）合并为一次重绘"""
+        self.plot1_auto_range |= auto_range
+        if not self.plot1_update_pending:
+            self.plot1_update_pending = True
+            QTimer.singleShot(0, self.refresh_plot1)
+
+    def _show_plot_item(self, item, x, y):
+        """数据改变时更新图形项；x 为 None 时清空"""
+        if item not in self.plot1.plotItem.items:
+            # 被 plot1.clear() 移除后重新添加
+            self.plot1.addItem(item)
+            self.plot1_shown[item] = None
+        if self.plot1_shown[item] is y and y is not None:
+            return
+        if item in self.curve_colors:
+            set_curve(item, x, y, self.curve_colors[item], self.render_settings)
+        elif x is None:
+            item.setData([], [])
+        else:
+            item.setData(x, y)
+        self.plot1_shown[item] = y
+
+    def _show_draggable_baseline(self, show):
+        for item in (getattr(self, 'draggableScatter', None), getattr(self, 'draggableGraph', None)):
+            if item is None:
+                continue
+            if show and item not in self.plot1.plotItem.items:
+                self.plot1.addItem(item)
+            elif not show and item in self.plot1.plotItem.items:
+                self.plot1.removeItem(item)
+
+    def refresh_plot1(self):
+        """把光谱、基线和峰值的当前状态同步到常驻图形项"""
+        self.plot1_update_pending = False
+        spectrum = self.spectrum
+        if spectrum is None:
+            self._show_plot_item(self.spectrum_plot, None, None)
+        else:
+            if self.masked_spectrum is not spectrum:
+                self.masked_spectrum, self.masked_spectrum_y = spectrum, spectrum.masked_y()
+            self._show_plot_item(self.spectrum_plot, spectrum.x, self.masked_spectrum_y)
+
+        baseline = self.baseline_data if spectrum is not None else None
+        estimated = baseline is not None and self.baseline_mode == 'estimated'
+        discretized = baseline is not None and self.baseline_mode == 'discretized'
+        self._show_plot_item(self.baseline_plot, spectrum.x if estimated else None, baseline if estimated else None)
+        self._show_plot_item(self.interpolated_baseline, spectrum.x if discretized else None,
+                             baseline if discretized else None)
+        self._show_draggable_baseline(self.baseline_mode == 'discretized' and spectrum is not None)
+
+        show_peaks = spectrum is not None and self.button_find_peaks.text() == '隐藏峰值'
+        self._show_plot_item(self.peak_plot, self.peaks_x if show_peaks else None, self.peaks_y if show_peaks else None)
+        show_labels = show_peaks and self.button_show_peak_labels.text().strip() == '隐藏标签'
+        if not show_labels and self.button_show_peak_labels.text().strip() == '隐藏标签':
+            self.button_show_peak_labels.setText('显示标签')
+        self._show_plot_item(self.peak_labels, self.peaks_x if show_labels else None,
+                             self.peaks_y if show_labels else None)
+
+        if self.plot1_auto_range:
+            self.plot1_auto_range = False
+            self.plot1.autoRange()
+
+    def update_discretized_baseline(self, index=None):
 
-        """每当用户在离散化后移动一个点时，都会更新已加载频谱的基线数据"""
-        self.draggableGraph.setData(pos=np.array(list(zip(self.draggableScatter.data['x'], self.draggableScatter.data['y']))))
-        self.baseline_data = np.interp(self.spectrum.x, self.draggableScatter.data['x'], self.draggableScatter.data['y'])
-        if hasattr(self, 'interpolated_baseline'):
-            self.plot1.removeItem(self.interpolated_baseline)
-        pen=pg.mkPen(color='g',width=3)  
-        self.interpolated_baseline = self.plot1.plot(self.spectrum.x, self.baseline_data, pen=pen)
+        """每当用户在离散化后移动一个点时，都会更新已加载频谱的基线数据
+
+        拖动过程中（index 为被拖动的节点）只移动这个节点，并只对它与两个相邻节点之间的光谱点重新插值；
+        拖动开始时和撤销/重做（index 为 None）时按所有节点计算整条基线。
+        """
+        nodes_x, nodes_y = self.draggableScatter.getData()
+        if index is None or not self.baseline_dragging:
+            if index is None:
+                # 撤销/重做移动了散点图中的节点
+                self.draggableGraph.set_nodes(nodes_x, nodes_y)
+            else:
+                self.draggableGraph.move_node(index, nodes_x[index], nodes_y[index])
+                self.baseline_dragging = True
+            # 新的数组：历史记录中的命令可能引用旧的基线数组（节点始终按横坐标排列）
+            self.baseline_data = np.interp(self.spectrum.x, nodes_x, nodes_y)
+        else:
+            self.draggableGraph.move_node(index, nodes_x[index], nodes_y[index])
+            if self.baseline_sorted_x is None or self.baseline_sorted_x[0] is not self.spectrum.x:
+                order = np.argsort(self.spectrum.x, kind='stable')
+                self.baseline_sorted_x = (self.spectrum.x, order, self.spectrum.x[order])
+            _, order, sorted_x = self.baseline_sorted_x
+            reinterpolate(self.baseline_data, self.spectrum.x, order, sorted_x, nodes_x, nodes_y, index)
+            # 数组就地修改，强制重绘插值的基线
+            self.plot1_shown[self.interpolated_baseline] = None
+        self.baseline_mode = 'discretized'
+        self.update_plot1()
 
     def discretize_baseline(self):
         if self.spectrum == None:
@@ -637,13 +865,10 @@ class MainApp(QMainWindow):
             QMessageBox.critical(self, '错误', '请先进行基线估计！')
             return
         
-        # 将 self.spectrum.x 和 baseline_data 排序为升序
-        sorted_indices = np.argsort(self.spectrum.x)
-        sorted_x = self.spectrum.x[sorted_indices]
-        sorted_baseline = self.baseline_data[sorted_indices]
-        # 将基线离散化
-        x_vals = np.arange(sorted_x[0], sorted_x[-1], self.config['discrete baseline step size'])
-        y_vals = np.interp(x_vals, self.spectrum.x, sorted_baseline)
+        # 将基线离散化（np.interp 要求 x 为升序）
+        x_vals = np.arange(self.spectrum.x.min(), self.spectrum.x.max(), self.config['discrete baseline step size'])
+        order = np.argsort(self.spectrum.x)
+        y_vals = np.interp(x_vals, self.spectrum.x[order], self.baseline_data[order])
        
         # 如果存在上一条离散化基线，则清除它
         if hasattr(self, 'draggableScatter'):
@@ -661,15 +886,13 @@ class MainApp(QMainWindow):
         self.draggableScatter.dragFinished.connect(self.handle_drag_finished)
 
         self.draggableGraph = DraggableGraph(scatter_data={'x': x_vals, 'y': y_vals})
-        
-        self.plot1.addItem(self.draggableScatter)
-        self.plot1.addItem(self.draggableGraph)
 
        # 用离散化基线替换平滑基线
-        self.plot1.removeItem(self.baseline_plot)
+        self.baseline_mode = 'discretized'
+        self.update_plot1()
 
     def handle_drag_finished(self, index, startX, startY, endX, endY):
-        print('handle_drag_finished was called')
+        self.baseline_dragging = False
         command = PointDragCommand(self, index, startX, startY, endX, endY)
         self.command_history.execute(command)
 
@@ -699,21 +922,93 @@ class MainApp(QMainWindow):
         if fname[0]:
             self.database_path = Path(fname[0])
             self.database_label.setText(f"数据库： {self.database_path.name}")
+            self.library = None
+            self.index = None
+            self.fingerprints = None
 
 
     def load_unknown_spectrum(self):
         fname = QFileDialog.getOpenFileName(self, '选择拉曼光谱', '..',"Text Files (*.txt)")
         if fname[0]:
             self.unknown_spectrum_path = Path(fname[0])
+            self.stop_streaming()
+            try:
+                layout = sniff(self.unknown_spectrum_path)
+            except ValueError:
+                layout = None
+            if layout is not None and layout.is_multi:
+                self.stream_spectra(layout)
+                return
             command = LoadSpectrumCommand(self, *get_xy_from_file(self.unknown_spectrum_path))
             self.command_history.execute(command)
 
+    def stop_streaming(self):
+        """停止正在进行的多光谱文件读取并隐藏光谱序号"""
+        self.stream_id += 1
+        self.stream_layout = None
+        self.stream_offsets = []
+        self.spectrum_index_box.setVisible(False)
+
+    def stream_spectra(self, layout):
+        """在后台线程中逐块读取多光谱文件，读到第一条光谱时立即显示"""
+        self.stream_layout = layout
+        self.spectrum_index_box.blockSignals(True)
+        self.spectrum_index_box.setMaximum(1)
+        self.spectrum_index_box.setValue(1)
+        self.spectrum_index_box.blockSignals(False)
+        self.spectrum_index_box.setVisible(True)
+        reader_thread = threading.Thread(target=self._stream_spectra_thread,
+                                         args=(self.stream_id, self.unknown_spectrum_path, layout), daemon=True)
+        reader_thread.start()
+
+    def _stream_spectra_thread(self, stream_id, path, layout):
+        count = 0
+        try:
+            for block in iter_blocks(path, self.config['stream block size'], layout):
+                if stream_id != self.stream_id:
+                    return
+                count += len(block.offsets)
+                self.spectra_block_read.emit(stream_id, block)
+        except ValueError as e:
+            self.spectra_stream_finished.emit(stream_id, count, str(e))
+            return
+        self.spectra_stream_finished.emit(stream_id, count, '')
+
+    def on_spectra_block_read(self, stream_id, block):
+        if stream_id != self.stream_id:
+            return
+        first = not self.stream_offsets
+        # 只保留每条光谱在文件中的位置，切换光谱时再读取
+        self.stream_offsets.extend(block.offsets.tolist())
+        self.spectrum_index_box.setMaximum(len(self.stream_offsets))
+        if first:
+            command = LoadSpectrumCommand(self, block.x, block.y[0])
+            self.command_history.execute(command)
+            self.plot1_log.addItem('正在读取其余光谱……')
+            self.to_end()
+
+    def on_spectra_stream_finished(self, stream_id, count, error):
+        if stream_id != self.stream_id:
+            return
+        if error:
+            QMessageBox.critical(self, '错误', f'读取文件失败：{error}')
+        self.plot1_log.addItem(f'已读取 {count} 条光谱')
+        self.to_end()
+
+    def load_streamed_spectrum(self, value):
+        """加载多光谱文件中的第 value 条光谱"""
+        if not 1 <= value <= len(self.stream_offsets):
+            return
+        x, y = read_spectrum(self.unknown_spectrum_path, self.stream_offsets[value - 1], self.stream_layout)
+        command = LoadSpectrumCommand(self, x, y)
+        self.command_history.execute(command)
+
     def baseline_callback(self):
         if self.spectrum == None:
             QMessageBox.critical(self, '错误', '请先导入光谱数据！')
             return
         if self.button_baseline.text().strip() == "基线估计":
-            command = EstimateBaselineCommand(self, baseline_als(self.spectrum.y))
+            command = EstimateBaselineCommand(self, BaselineStage(subtract=False).baseline(self.spectrum.y, self.spectrum.valid))
             self.command_history.execute(command)
         else:
             command = CorrectBaselineCommand(self)
@@ -743,8 +1038,25 @@ class MainApp(QMainWindow):
         self.wavelength = self.wavelength_input.text()
         if not self.mineral_name or not self.wavelength:
             QMessageBox.information(self, '提示', '矿物名称或波长未输入，将自动进行相似度匹配！')
-            # 创建一个新的线程来运行搜索操作
-            search_thread = threading.Thread(target=self._search_database_thread)
+            # 根据配置选择相似度匹配方式，配置了鉴定服务且服务支持该方法时由服务完成检索，
+            # 服务不支持的方法（hausdorff、two-stage）仍在本地检索
+            use_server = bool(self.config['identification server']) and \
+                self.config['similarity method'] in SIMILARITY_METHODS
+            if use_server:
+                target = self._server_search_thread
+            elif self.config['similarity method'] == 'xcorr':
+                target = self._xcorr_search_thread
+            elif self.config['similarity method'] == 'index':
+                target = self._index_search_thread
+            elif self.config['similarity method'] == 'two-stage':
+                target = self._two_stage_search_thread
+            else:
+                target = self._search_database_thread
+            # 创建一个新的线程来运行搜索操作，本地检索的结果会被缓存
+            if use_server:
+                search_thread = threading.Thread(target=target)
+            else:
+                search_thread = threading.Thread(target=self._cached_search, args=(target,))
             search_thread.daemon = True  # 设置为守护线程
             search_thread.start()
         else:
@@ -754,6 +1066,53 @@ class MainApp(QMainWindow):
             _search_thread.start()
             
 
+    def _cached_search(self, search):
+        """先查询跨会话的相似度缓存，未命中时运行 search 并缓存其结果（search_results）"""
+        key = None
+        method = self.config['similarity method']
+        if self.similarity_cache is not None:
+            # 影响检索结果的配置项
+            params = {name: self.config[name] for name in (
+                'library grid start', 'library grid end', 'library grid step', 'similarity max results',
+                'xcorr max shift', 'index components', 'index candidates', 'index probes',
+                'fingerprint bin width', 'fingerprint spread', 'fingerprint tolerance', 'fingerprint candidates',
+                'two stage candidates', 'two stage fallback similarity')}
+            # 峰值只影响用指纹筛选短名单的方法
+            if method == 'two-stage' or (method == 'xcorr' and self.config['fingerprint candidates']):
+                params['peaks'] = np.asarray(self.peaks_x).tolist()
+            key = cache_key(self.spectrum.x, self.spectrum.masked_y(), database_version(self.database_path),
+                            method, params)
+            results = self.similarity_cache.get(key)
+            if results is not None:
+                self._show_cached_results(results)
+                return
+        self.search_results = []
+        search()
+        if key is not None and self.search_results:
+            self.similarity_cache.put(key, self.search_results)
+
+    @staticmethod
+    def _result_label(filename, similarity, offset=None):
+        """相似度检索结果在结果列表中的条目（similarity 为百分数，offset 为互相关的波数偏移）"""
+        if offset is None:
+            return f"相似度{similarity:.2f}%：{filename}"
+        return f"相似度{similarity:.2f}%（偏移{offset:+.1f}）：{filename}"
+
+    def _show_cached_results(self, results):
+        """显示缓存的检索结果 [文件名, 相似度(, 偏移)]，只从数据库读取结果中的参考光谱用于绘图"""
+        filenames = [result[0] for result in results]
+        self.data_to_plot = {filename: (data_x, data_y) for filename, data_x, data_y
+                             in fetch_spectra_by_filename(self.database_path, filenames)}
+        self.results_list.clear()
+        for result in results:
+            self.results_list.addItem(self._result_label(*result))
+        self.plot1_log.addItem("已从缓存中读取相同光谱的检索结果")
+        self.to_end()
+
+        self.reset_button.setEnabled(True)
+        self.search_button.setEnabled(True)
+        self.button_search.setEnabled(True)
+
     def _search_database(self):
         connection = sqlite3.connect(self.database_path)
         cursor = connection.cursor()
@@ -786,47 +1145,92 @@ class MainApp(QMainWindow):
         
         connection = sqlite3.connect(self.database_path)
         cursor = connection.cursor()
-        # 从数据库中获取所有光谱数据
+        total = cursor.execute("SELECT COUNT(*) FROM Spectra").fetchone()[0]
+        # 逐块读取光谱数据，不把整个数据库一次性读入内存
         cursor.execute("SELECT filename, data_x, data_y FROM Spectra")
-        results = cursor.fetchall()
-        connection.close()
+        blocks = iter(lambda: cursor.fetchmany(512), [])
+        # 初始化结果列表
+        self.results_list.clear()
+        self.data_to_plot = {}
+
+        try:
+            similarity_results = self._score_spectra(blocks, total)
+        finally:
+            connection.close()
+        self._show_similarity_results(similarity_results)
+
+    def _two_stage_search_thread(self):
+        """两阶段检索：先用已检测到的峰值筛选候选，只为短名单加载完整光谱并计算相似度
+
+        若没有检测到峰值、候选为空，或最佳相似度低于配置的回退阈值，则回退为全库扫描。
+        """
+        self.results_list.clear()
+        self.data_to_plot = {}
+        similarity_results = []
+        reason = None
+        if not len(self.peaks_x):
+            reason = "未检测到峰值"
+        else:
+            fingerprints = self.get_fingerprints()
+            shortlist = fingerprints.shortlist(self.peaks_x, self.config['two stage candidates'],
+                                               tol=self.config['fingerprint tolerance'])
+            filenames = [fingerprints.filenames[i] for i in shortlist]
+            rows = fetch_spectra_by_filename(self.database_path, filenames)
+            similarity_results = self._score_spectra((rows[i:i + 512] for i in range(0, len(rows), 512)), len(rows))
+            best = max((similarity for _, similarity in similarity_results), default=0)
+            if not filenames:
+                reason = "峰值筛选没有找到候选光谱"
+            elif best < self.config['two stage fallback similarity']:
+                reason = "候选光谱的相似度过低"
+
+        if reason is not None:
+            self.plot1_log.addItem(f"{reason}，回退为全库搜索")
+            self.to_end()
+            self._search_database_thread()
+            return
+        self._show_similarity_results(similarity_results)
+
+    def _score_spectra(self, blocks, total):
+        """计算当前光谱与 (filename, data_x, data_y) 行的相似度，返回相似度不低于1%的结果
+
+        blocks 逐块给出数据库行（共 total 行），每次只解析和插值一块；
+        data_to_plot 仍保存所有相似度不低于1%的参考光谱，供点击结果时绘图。
+        """
         #初始化
         index = 1
-        total = len(results)
         # 使用当前处理后的光谱数据
         processed_x = self.spectrum.x
-        processed_y = self.spectrum.y
+        processed_y = self.spectrum.masked_y()
         #unknown_x, unknown_y = get_xy_from_file(self.unknown_spectrum_path)
         # 存储相似度计算结果
         similarity_results = []
-        # 初始化结果列表
-        self.results_list.clear()
-        self.data_to_plot = {}
 
-        for result in results:
-            filename, data_x, data_y = result
-            
+        for block in blocks:
             # 将数据库光谱的x轴和未知光谱的x轴对齐，以确保y值可以比较
-            data_x = np.array(eval(data_x))
-            data_y = np.array(eval(data_y))
-            
-            # 对x轴插值，确保x轴一致
-            interpolated_y = np.interp(processed_x, data_x, data_y)
-            
-           # 计算相似度
-            similarity = self.similarity(processed_y, interpolated_y)*100
-            
-            if similarity >= 1 :  # 只保留相似度大于等于1%的结果
-                similarity_results.append((filename, similarity))
-                self.data_to_plot[filename] = (data_x, data_y)  # 仅存储文件名和对应的光谱数据
-            
-            # 更新搜索进度
-            progress_percent = index / total * 100
-            index +=1
-            self.results_list.clear()
-            self.results_list.addItem(f"正在搜索中: {progress_percent:.2f}%")
-            
-
+            parsed = [(np.array(eval(data_x)), np.array(eval(data_y))) for _, data_x, data_y in block]
+            # 对x轴插值，确保x轴一致；波数网格相同的参考光谱共享插值权重，按组批量计算
+            interpolated = resample_many([data_x for data_x, _ in parsed], [data_y for _, data_y in parsed],
+                                         processed_x, left=None, right=None,
+                                         keys=[data_x for _, data_x, _ in block])
+
+            for (filename, _, _), (data_x, data_y), interpolated_y in zip(block, parsed, interpolated):
+               # 计算相似度
+                similarity = self.similarity(processed_y, interpolated_y)*100
+
+                if similarity >= 1 :  # 只保留相似度大于等于1%的结果
+                    similarity_results.append((filename, similarity))
+                    self.data_to_plot[filename] = (data_x, data_y)  # 仅存储文件名和对应的光谱数据
+
+                # 更新搜索进度
+                progress_percent = index / total * 100
+                index +=1
+                self.results_list.clear()
+                self.results_list.addItem(f"正在搜索中: {progress_percent:.2f}%")
+
+        return similarity_results
+
+    def _show_similarity_results(self, similarity_results):
+        """显示相似度搜索结果并恢复UI组件"""
         time.sleep(0.5)  # 增加延迟，放慢加载速度
         self.results_list.clear()
         self.results_list.addItem(f"已搜索完成！以下是搜索结果：")
@@ -837,7 +1241,8 @@ class MainApp(QMainWindow):
             # 填充结果列表
             self.results_list.clear()
             for filename, similarity in similarity_results:
-                self.results_list.addItem(f"相似度{similarity:.2f}%：{filename}")
+                self.results_list.addItem(self._result_label(filename, similarity))
+            self.search_results = [[filename, float(similarity)] for filename, similarity in similarity_results]
         
         else:
             self.results_list.addItem(f"未找到相似度大于等于1%的光谱数据")
@@ -847,6 +1252,255 @@ class MainApp(QMainWindow):
         self.button_search.setEnabled(True)
         
 
+    def get_library(self):
+        """返回重采样到公共网格上的参考光谱库，首次调用时从数据库加载并缓存"""
+        if self.library is None:
+            grid = make_grid(self.config['library grid start'],
+                             self.config['library grid end'],
+                             self.config['library grid step'])
+            self.library = SpectralLibrary.from_database(self.database_path, grid)
+        return self.library
+
+    def get_index(self):
+        """返回参考光谱库的近似最近邻索引，优先读取数据库旁保存的索引文件"""
+        if self.index is None:
+            self.index = load_or_build_index(self.get_library(), self.database_path,
+                                             n_components=self.config['index components'])
+        return self.index
+
+    def get_fingerprints(self):
+        """返回参考光谱峰值指纹的哈希表索引，首次调用时从数据库的 peaks 列建立"""
+        if self.fingerprints is None:
+            self.fingerprints = FingerprintIndex.from_database(
+                self.database_path,
+                bin_width=self.config['fingerprint bin width'],
+                spread=self.config['fingerprint spread'])
+        return self.fingerprints
+
+    def unmix_database(self):
+        if self.database_label.text().strip() == "数据库：未选择":
+            QMessageBox.critical(self, '错误', '请先导入数据库！')
+            return
+        if self.spectrum == None:
+            QMessageBox.critical(self, '错误', '请先导入光谱数据！')
+            return
+        # 禁用UI组件，防止在解混进行时操作
+        self.reset_button.setEnabled(False)
+        self.search_button.setEnabled(False)
+        self.button_search.setEnabled(False)
+        self.unmix_button.setEnabled(False)
+
+        unmix_thread = threading.Thread(target=self._unmix_database_thread)
+        unmix_thread.daemon = True  # 设置为守护线程
+        unmix_thread.start()
+
+    def _unmix_database_thread(self):
+        self.results_list.clear()
+        self.results_list.addItem("正在加载参考光谱库...")
+        library = self.get_library()
+
+        start = time.perf_counter()
+        y = resample_to_grid(self.spectrum.x, self.spectrum.masked_y(), library.grid)
+        peaks_x = self.peaks_x if len(self.peaks_x) else None
+        components, residual = unmix_spectrum(
+            library, y, peaks_x=peaks_x,
+            n_candidates=self.config['unmixing candidates'],
+            max_components=self.config['unmixing max components'])
+        elapsed = time.perf_counter() - start
+
+        self.results_list.clear()
+        self.data_to_plot = {}
+        if components:
+            self.plot1_log.addItem(f"光谱解混完成（{elapsed:.2f}秒），相对残差：{residual:.3f}")
+            self.to_end()
+            for filename, name, abundance in components:
+                self.results_list.addItem(f"{name} 丰度{abundance:.1f}%：{filename}")
+                self.data_to_plot[filename] = (library.grid, library.matrix[library.filenames.index(filename)])
+        else:
+            self.results_list.addItem("未找到可解释该光谱的参考光谱组合")
+
+        self.reset_button.setEnabled(True)
+        self.search_button.setEnabled(True)
+        self.button_search.setEnabled(True)
+        self.unmix_button.setEnabled(True)
+
+    def identify_map(self):
+        """选择面扫描文本文件（或已导入面扫描目录中的 meta.json），逐像素鉴定"""
+        if self.database_label.text().strip() == "数据库：未选择":
+            QMessageBox.critical(self, '错误', '请先导入数据库！')
+            return
+        fname, _ = QFileDialog.getOpenFileName(self, '选择面扫描', '..',
+                                               "Map Files (*.txt *.csv meta.json)")
+        if not fname:
+            return
+        self.reset_button.setEnabled(False)
+        self.search_button.setEnabled(False)
+        self.button_search.setEnabled(False)
+        self.map_button.setEnabled(False)
+
+        map_thread = threading.Thread(target=self._identify_map_thread, args=(Path(fname),))
+        map_thread.daemon = True  # 设置为守护线程
+        map_thread.start()
+
+    def _identify_map_thread(self, path):
+        """导入面扫描（文本文件导入到同名的 .map 目录），鉴定结果图保存在面扫描目录的 images 中"""
+        self.results_list.clear()
+        try:
+            if path.name == 'meta.json':
+                raman_map = RamanMap(path.parent)
+            else:
+                self.results_list.addItem("正在导入面扫描...")
+                raman_map = RamanMap.from_text(path, path.with_name(path.name + '.map'))
+            self.results_list.clear()
+            self.results_list.addItem("正在加载参考光谱库...")
+            library = self.get_library()
+            self.results_list.clear()
+            self.results_list.addItem("正在鉴定中...")
+            start = time.perf_counter()
+            best, _ = raman_map.identify(library)
+            elapsed = time.perf_counter() - start
+        except (OSError, ValueError) as e:
+            self.results_list.clear()
+            self.results_list.addItem(f"面扫描鉴定失败：{e}")
+        else:
+            self.results_list.clear()
+            self.data_to_plot = {}
+            indices, counts = np.unique(best, return_counts=True)
+            measured = counts[indices >= 0].sum()
+            for i, count in sorted(zip(indices, counts), key=lambda item: -item[1]):
+                if i < 0:
+                    continue
+                filename = library.filenames[i]
+                self.results_list.addItem(f"{library.names[i]} {count}像素（{count / measured * 100:.1f}%）：{filename}")
+                self.data_to_plot[filename] = (library.grid, library.matrix[i])
+            # 未测量的像素只记录在日志中（结果列表的条目都可以选中绘制）
+            self.plot1_log.addItem(f"面扫描鉴定完成（{raman_map.shape[0]} × {raman_map.shape[1]} 像素，"
+                                   f"其中{best.size - measured}个未测量），用时{elapsed:.2f}秒")
+            self.to_end()
+
+        self.reset_button.setEnabled(True)
+        self.search_button.setEnabled(True)
+        self.button_search.setEnabled(True)
+        self.map_button.setEnabled(True)
+
+    def _xcorr_search_thread(self):
+        """在频域中一次性计算与所有参考光谱的归一化互相关，容忍配置范围内的波数偏移"""
+        self.results_list.clear()
+        self.results_list.addItem("正在加载参考光谱库...")
+        library = self.get_library()
+
+        self.results_list.clear()
+        self.results_list.addItem("正在搜索中...")
+        start = time.perf_counter()
+        if self.config['fingerprint candidates'] and len(self.peaks_x):
+            # 先用峰值指纹把参考光谱缩小到短名单
+            fingerprints = self.get_fingerprints()
+            shortlist = fingerprints.shortlist(self.peaks_x, self.config['fingerprint candidates'],
+                                               tol=self.config['fingerprint tolerance'])
+            library = library.subset(library.indices_of([fingerprints.filenames[i] for i in shortlist]))
+        y = resample_to_grid(self.spectrum.x, self.spectrum.masked_y(), library.grid)
+        scores, offsets = xcorr_match(library, y, self.config['xcorr max shift'])
+        elapsed = time.perf_counter() - start
+
+        order = np.argsort(scores)[::-1][:self.config['similarity max results']]
+        self.results_list.clear()
+        self.data_to_plot = {}
+        self.search_results = []
+        for i in order:
+            similarity = scores[i] * 100
+            if similarity < 1:  # 只保留相似度大于等于1%的结果
+                break
+            filename = library.filenames[i]
+            self.results_list.addItem(self._result_label(filename, similarity, offsets[i]))
+            self.data_to_plot[filename] = (library.grid, library.matrix[i])
+            self.search_results.append([filename, float(similarity), float(offsets[i])])
+        if not self.data_to_plot:
+            self.results_list.addItem(f"未找到相似度大于等于1%的光谱数据")
+        self.plot1_log.addItem(f"互相关匹配完成，用时{elapsed:.2f}秒")
+        self.to_end()
+
+        self.reset_button.setEnabled(True)
+        self.search_button.setEnabled(True)
+        self.button_search.setEnabled(True)
+
+    def _index_search_thread(self):
+        """用近似最近邻索引得到候选短名单，再用精确的相关系数重排序"""
+        self.results_list.clear()
+        self.results_list.addItem("正在加载参考光谱库和索引...")
+        library = self.get_library()
+        if not len(library):
+            self.results_list.clear()
+            self.results_list.addItem("数据库中没有可用的参考光谱")
+            self.reset_button.setEnabled(True)
+            self.search_button.setEnabled(True)
+            self.button_search.setEnabled(True)
+            return
+        index = self.get_index()
+
+        start = time.perf_counter()
+        y = resample_to_grid(self.spectrum.x, self.spectrum.masked_y(), library.grid)
+        matches, scores = search_library(index, library, y,
+                                         k=self.config['similarity max results'],
+                                         n_candidates=self.config['index candidates'],
+                                         n_probe=self.config['index probes'])
+        elapsed = time.perf_counter() - start
+
+        self.results_list.clear()
+        self.data_to_plot = {}
+        self.search_results = []
+        for i, score in zip(matches, scores):
+            similarity = score * 100
+            if similarity < 1:  # 只保留相似度大于等于1%的结果
+                break
+            filename = library.filenames[i]
+            self.results_list.addItem(self._result_label(filename, similarity))
+            self.data_to_plot[filename] = (library.grid, library.matrix[i])
+            self.search_results.append([filename, float(similarity)])
+        if not self.data_to_plot:
+            self.results_list.addItem(f"未找到相似度大于等于1%的光谱数据")
+        self.plot1_log.addItem(f"索引检索完成，用时{elapsed:.3f}秒")
+        self.to_end()
+
+        self.reset_button.setEnabled(True)
+        self.search_button.setEnabled(True)
+        self.button_search.setEnabled(True)
+
+    def _server_search_thread(self):
+        """由本地鉴定服务（server.py）完成相似度检索，服务中的参考光谱库和索引常驻内存"""
+        self.results_list.clear()
+        self.results_list.addItem("正在搜索中...")
+        # 只在方法属于 SIMILARITY_METHODS 时调用，见 search_database
+        method = self.config['similarity method']
+        client = ServerClient(self.config['identification server'])
+        start = time.perf_counter()
+        try:
+            grid = make_grid(*client.health()['grid'])
+            matches = client.similarity(self.spectrum.x, self.spectrum.masked_y(), k=self.config['similarity max results'],
+                                        method=method, include_spectra=True)
+        except (OSError, ValueError) as e:
+            matches = None
+            self.results_list.clear()
+            self.results_list.addItem(f"鉴定服务请求失败：{e}")
+        elapsed = time.perf_counter() - start
+
+        if matches is not None:
+            self.results_list.clear()
+            self.data_to_plot = {}
+            for match in matches:
+                similarity = match['score'] * 100
+                if similarity < 1:  # 只保留相似度大于等于1%的结果
+                    break
+                self.results_list.addItem(self._result_label(match['filename'], similarity))
+                self.data_to_plot[match['filename']] = (grid, np.array(match['y']))
+            if not self.data_to_plot:
+                self.results_list.addItem(f"未找到相似度大于等于1%的光谱数据")
+            self.plot1_log.addItem(f"鉴定服务检索完成，用时{elapsed:.3f}秒")
+            self.to_end()
+
+        self.reset_button.setEnabled(True)
+        self.search_button.setEnabled(True)
+        self.button_search.setEnabled(True)
+
     def plot_selected_spectra(self):
         if self.spectrum == None:
             QMessageBox.critical(self,'错误','请先导入数据库！')
@@ -863,6 +1517,7 @@ class MainApp(QMainWindow):
         # 清除之前的绘图
         self.plot2.clear()
 
+        curves = []
         for file in selected_files:
             # 提取条目中的文件名部分
             filename = file.split("：")[-1].strip()
@@ -877,9 +1532,15 @@ class MainApp(QMainWindow):
                 y = deserialize(data_y)
             else:
                 y = data_y  # 如果已经是数组，则直接使用
-            pen=pg.mkPen(color='k',width=3)
-            self.plot2.plot(x, y,pen=pen)
-        
+            curves.append((x, y))
+
+        # 叠加的曲线按总点数决定画笔宽度
+        n_points = sum(len(x) for x, _ in curves)
+        for x, y in curves:
+            item = pg.PlotDataItem()
+            self.plot2.addItem(item)
+            set_curve(item, x, y, 'k', self.render_settings, n_points)
+
         self.plot2.autoRange()
 
     def toggle_labels_callback(self):
@@ -892,79 +1553,151 @@ class MainApp(QMainWindow):
             QMessageBox.critical(self, '错误', '请先显示峰值！')
             return
         
-        if show:
-            # 创建文本项并将其添加到绘图中
-            for x, y in zip(self.peaks_x, self.peaks_y):
-                text_item = pg.TextItem(str(round(x, 1)), anchor=(0, 0), color=(255, 0, 0), angle=90)
-                text_item.setPos(x, y)  # 调整 Y 位置，使其略高于峰值
-                self.plot1.addItem(text_item)
-                if not hasattr(self, 'peak_texts'):
-                    self.peak_texts = []
-                self.peak_texts.append(text_item)
-            self.button_show_peak_labels.setText('隐藏标签')
-        else:
-            # 删除之前的文本项目
-            if hasattr(self, 'peak_texts') and self.peak_texts:
-                for text_item in self.peak_texts:
-                    self.plot1.removeItem(text_item)
-                self.peak_texts = []
-            self.button_show_peak_labels.setText('显示标签')
+        # 标签由 refresh_plot1 按按钮状态创建或移除
+        self.button_show_peak_labels.setText('隐藏标签' if show else '显示标签')
+        self.update_plot1()
         
     def find_peaks(self):
         if self.spectrum is None:
             QMessageBox.critical(self, '错误', '请先导入光谱数据！')
             return
         if self.button_find_peaks.text() =='显示峰值':
-            # 获取输入参数
-            width = self.textbox_width.text().strip()
-            rel_height = self.textbox_rel_height.text().strip()
-            height = self.textbox_height.text().strip()
-            prominence = self.textbox_prominence.text().strip()
-            # 将参数转换为适当的类型
-            width = eval(width) if width else None
-            rel_height = float(rel_height) if rel_height else None
-            height = float(height) if height else None
-            prominence = float(prominence) if prominence else None
-            # 获取峰值数据
-            self.peaks_x, self.peaks_y = get_peaks(
-                self.spectrum.x, 
-                self.spectrum.y, 
-                width=width, 
-                rel_height=rel_height, 
-                height=height, 
-                prominence=prominence)
-            # 如果已有峰值图形，移除它
-            if hasattr(self, 'peak_plot') and self.peak_plot:
-                self.plot1.removeItem(self.peak_plot)
-                self.peak_plot = None
-
-            # 绘制新的峰值点
-            self.peak_plot = self.plot1.plot(self.peaks_x, self.peaks_y, pen=None, symbol='o', symbolSize=7, symbolBrush=(255, 0, 0))
-            # 显示峰值信息到日志和文本框
-            if len(self.peaks_x) < 15:
-                self.plot1_log.addItem(f'峰值：{", ".join([str(x) for x in sorted(self.peaks_x)])}')
-                self.to_end()
-                self.textbox_peaks.setText(','.join([str(round(x,1)) for x in sorted(self.peaks_x)]))
-            else:
-                first_15_peaks = self.peaks_x[:15]
-                self.plot1_log.addItem(f'峰值：{", ".join([str(x) for x in sorted(first_15_peaks)])}...')
-                self.to_end()
-                self.textbox_peaks.setText(','.join([str(round(x,1)) for x in sorted(first_15_peaks)]))
+            if not self.update_peak_markers():
+                return
             self.button_find_peaks.setText('隐藏峰值')
         else:
-             # 移除显示的峰值点
-            if hasattr(self, 'peak_plot') and self.peak_plot:
-                self.plot1.removeItem(self.peak_plot)
-                self.peak_plot = None
-            
-            # 移除标签
-            if hasattr(self, 'peak_texts') and self.peak_texts:
-                for text_item in self.peak_texts:
-                    self.plot1.removeItem(text_item)
-                self.peak_texts = []
-
+            # 隐藏峰值点和标签（保留图形项，下次显示时只需 setData）
             self.button_show_peak_labels.setText('显示标签')
             self.button_find_peaks.setText('显示峰值')
+            self.update_plot1()
+
+    def get_peak_candidates(self):
+        """当前光谱的峰候选，光谱改变（光谱对象不可变，以对象本身判断）时重新计算"""
+        if self.peak_candidates is None or self.peak_candidates_spectrum is not self.spectrum:
+            self.peak_candidates = PeakCandidates(self.spectrum.x, self.spectrum.y, self.spectrum.valid)
+            self.peak_candidates_spectrum = self.spectrum
+        return self.peak_candidates
+
+    def get_peak_params(self):
+        """解析四个寻峰参数输入框并校验，返回 PeaksStage"""
+        width = self.textbox_width.text().strip()
+        rel_height = self.textbox_rel_height.text().strip()
+        height = self.textbox_height.text().strip()
+        prominence = self.textbox_prominence.text().strip()
+        # 将参数转换为适当的类型
+        width = eval(width) if width else None
+        rel_height = float(rel_height) if rel_height else None
+        height = float(height) if height else None
+        prominence = float(prominence) if prominence else None
+        return PeaksStage(width=width, rel_height=rel_height, height=height, prominence=prominence,
+                          refine=self.config['peak refinement'] or None)
+
+    def update_peak_markers(self, refine=True):
+        """按输入框中的参数从缓存的候选中筛选峰值并更新标记，成功时返回 True
+
+        refine 为 False 时（拖动滑块的过程中）使用缓存的抛物线插值结果，不做联合拟合，
+        也不更新日志和峰值输入框。
+        """
+        try:
+            stage = self.get_peak_params()
+        except (ValueError, SyntaxError, NameError) as e:
+            QMessageBox.critical(self, '错误', f'寻峰参数无效：{e}')
+            return False
+        params = stage.params
+        candidates = self.get_peak_candidates()
+        conditions = (params['width'], params['rel_height'] or 0.5, params['height'], params['prominence'])
+        if params['refine'] is None:
+            indices = candidates.select(*conditions)
+            self.peak_fit = None
+            self.peaks_x, self.peaks_y = self.spectrum.x[indices], self.spectrum.y[indices]
+        elif not refine:
+            # 峰值与精修结果保持一致，松开滑块后再联合拟合
+            self.peak_fit = candidates.select_refined(*conditions)
+            self.peaks_x, self.peaks_y = self.peak_fit.position, self.peak_fit.height
+        else:
+            # 获取峰值数据（亚像素精修后的峰位直接用于检索）
+            self.peak_fit = fit_peaks(self.spectrum.x, self.spectrum.y, candidates.select(*conditions),
+                                      params['refine'], self.spectrum.valid)
+            self.peaks_x, self.peaks_y = self.peak_fit.position, self.peak_fit.height
+        self.update_plot1()
+        if not refine:
+            return True
+
+        # 显示峰值信息到日志和文本框
+        if len(self.peaks_x) < 15:
+            self.plot1_log.addItem(f'峰值：{", ".join([str(x) for x in sorted(self.peaks_x)])}')
+            self.to_end()
+            self.textbox_peaks.setText(','.join([str(round(x,1)) for x in sorted(self.peaks_x)]))
+        else:
+            first_15_peaks = self.peaks_x[:15]
+            self.plot1_log.addItem(f'峰值：{", ".join([str(x) for x in sorted(first_15_peaks)])}...')
+            self.to_end()
+            self.textbox_peaks.setText(','.join([str(round(x,1)) for x in sorted(first_15_peaks)]))
+        return True
+
+    def on_peak_slider_moved(self, name, textbox, value):
+        """滑块位置换算为候选属性范围内的取值写入输入框，峰值已显示时实时更新标记"""
+        if self.spectrum is None:
+            return
+        candidates = self.get_peak_candidates()
+        if value == 0 or not len(candidates):
+            textbox.clear()
+        else:
+            if name == 'width':
+                rel_height = self.textbox_rel_height.text().strip()
+                values = candidates.widths(float(rel_height) if rel_height else 0.5)
+            else:
+                values = candidates.heights if name == 'height' else candidates.prominences
+            fraction = value / 1000
+            if name == 'height':
+                threshold = values.min() + (values.max() - values.min()) * fraction
+            else:
+                # 大部分候选是噪声中的微小极大值，对数刻度才能在较大的值之间细调
+                positive = values[values > 0]
+                low, high = (positive.min(), positive.max()) if len(positive) else (1.0, 1.0)
+                threshold = low * (high / low) ** fraction
+            textbox.setText(f'{threshold:.4g}')
+        if self.button_find_peaks.text() == '隐藏峰值' and not self.peak_sliders[name].isSliderDown():
+            # 键盘或点击改变滑块时没有释放事件，直接做完整的更新
+            self.update_peak_markers()
+        elif self.button_find_peaks.text() == '隐藏峰值':
+            self.update_peak_markers(refine=False)
+
+    def on_peak_slider_released(self):
+        """松开滑块后对当前的峰做完整的精修"""
+        if self.spectrum is not None and self.button_find_peaks.text() == '隐藏峰值':
+            self.update_peak_markers()
+
+    def auto_tune_peaks(self):
+        """在缓存的峰候选上评估参数网格，按配置的目标函数选出寻峰参数并填入输入框"""
+        if self.spectrum is None:
+            QMessageBox.critical(self, '错误', '请先导入光谱数据！')
+            return
+        objective = self.config['auto peak objective']
+        target = None
+        if objective == 'count':
+            target = self.config['auto peak target count']
+        elif objective == 'density':
+            if self.database_label.text().strip() == "数据库：未选择":
+                QMessageBox.critical(self, '错误', '请先导入数据库！')
+                return
+            x = self.spectrum.valid_points()[0]
+            target = library_peak_count(self.get_fingerprints().peaks, x.min(), x.max())
+        try:
+            result = tune(self.get_peak_candidates(), objective, target, self.config['auto peak noise factor'],
+                          steps=self.config['auto peak grid steps'])
+        except ValueError as e:
+            QMessageBox.critical(self, '错误', str(e))
+            return
+        for key, textbox in (('width', self.textbox_width), ('rel_height', self.textbox_rel_height),
+                             ('height', self.textbox_height), ('prominence', self.textbox_prominence)):
+            value = result.params[key]
+            textbox.setText('' if value is None else f'{value:g}')
+        self.plot1_log.addItem(f'自动寻峰参数（{objective}）：评估 {result.n_evaluated} 组参数，'
+                               f'用时 {result.elapsed * 1e3:.1f} 毫秒，选出 {result.count} 个峰')
+        self.to_end()
+        if self.button_find_peaks.text() == '隐藏峰值':
+            self.update_peak_markers()
 
     def on_search(self):
         if self.database_label.text().strip()== "数据库：未选择":
@@ -992,7 +1725,31 @@ class MainApp(QMainWindow):
         tolerance = float(self.textbox_tolerance.text().strip())
 
         # 调用搜索功能
-        result = find_spectrum_matches(self.database_path, peaks, tolerance)  
+        if self.config['identification server']:
+            # 由鉴定服务完成峰值检索
+            try:
+                result = ServerClient(self.config['identification server']).peak_search(peaks, tolerance)
+            except (OSError, ValueError) as e:
+                result = {'singletons': [], 'pairs': [], 'triples': []}
+                self.plot1_log.addItem(f"鉴定服务请求失败：{e}")
+                self.to_end()
+            self.unique_singletons = [tuple(names) for names in result['singletons']]
+            self.unique_pairs = [tuple(names) for names in result['pairs']]
+            self.unique_triples = [tuple(names) for names in result['triples']]
+            self.msg_singletons = f'找到{len(self.unique_singletons)}种含有峰值的矿物：\n'
+            self.msg_pairs = f'找到{len(self.unique_pairs)}与峰值相匹配的2种矿物组合：\n'
+            self.msg_triples = f'找到{len(self.unique_triples)}与峰值相匹配的3种矿物组合：\n'
+            QTimer.singleShot(0, self.update_ui_after_search)
+            return
+        rows = None
+        if self.config['fingerprint candidates']:
+            # 用峰值指纹的位运算筛选候选，不再逐条查询数据库；不截断候选，
+            # 最强峰位于容差范围内的参考光谱全部保留，结果与查询数据库相同
+            fingerprints = self.get_fingerprints()
+            shortlist = fingerprints.shortlist(peaks, tol=tolerance,
+                                               allowed=fingerprints.strongest_within(peaks, tolerance))
+            rows = fingerprints.rows(shortlist)
+        result = find_spectrum_matches(self.database_path, peaks, tolerance, rows=rows)
         self.unique_singletons = sorted(get_unique_mineral_combinations_optimized(self.database_path, result[1]))
         self.unique_pairs = sorted(get_unique_mineral_combinations_optimized(self.database_path, result[2]))
         self.unique_triples = sorted(get_unique_mineral_combinations_optimized(self.database_path, result[3]))
@@ -0,0 +1,89 @@
+"""参考光谱库：从 SQLite 数据库一次性读取光谱，并重采样到公共波数网格上"""
+
+import sqlite3
+
+import numpy as np
+
+from resample import resample_many
+
+
+def parse_vector(vec):
+    """将数据库中以字符串形式存储的列表（如 '[1.0, 2.0]'）解析为数组，比 eval 快得多"""
+    text = vec.strip().strip('[]()')
+    if not text:
+        return np.array([])
+    return np.array(text.split(','), dtype=float)
+
+
+def make_grid(start, end, step):
+    """生成公共波数网格（包含两端）"""
+    return np.arange(start, end + step / 2, step)
+
+
+def resample_to_grid(x, y, grid):
+    """将单条光谱插值到网格上，超出光谱测量范围的位置和被裁剪的点都为 NaN
+
+    与被裁剪点相邻的网格点也为 NaN。NaN 表示没有数据，不参与后续比较（见 xcorr.masked_pearson），
+    因此测量范围比网格窄的光谱不会因为填充的值而降低相似度。
+    单条光谱直接用 np.interp，计算网格指纹查缓存并不比插值本身快（批量重采样见 resample.py）。
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    order = np.argsort(x, kind='stable')
+    x, y = x[order], y[order]
+    return np.interp(grid, x, y, left=np.nan, right=np.nan)
+
+
+class SpectralLibrary:
+    """内存中的参考光谱库
+
+    所有参考光谱都被重采样到同一个网格 `grid` 上，并按最大值归一化，
+    存放在形状为 (n_spectra, n_points) 的矩阵 `matrix` 中。
+    """
+
+    def __init__(self, filenames, names, grid, matrix):
+        self.filenames = list(filenames)
+        self.names = list(names)
+        self.grid = grid
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def indices_of(self, filenames):
+        """返回文件名在库中的索引，库中不存在的文件名被忽略"""
+        if not hasattr(self, '_positions'):
+            self._positions = {filename: i for i, filename in enumerate(self.filenames)}
+        return np.array([self._positions[f] for f in filenames if f in self._positions], dtype=int)
+
+    def subset(self, indices):
+        """返回只包含 `indices` 中参考光谱的子库"""
+        return SpectralLibrary([self.filenames[i] for i in indices],
+                               [self.names[i] for i in indices],
+                               self.grid, self.matrix[indices])
+
+    @classmethod
+    def from_database(cls, database_path, grid):
+        """从数据库读取所有参考光谱并重采样到 `grid`"""
+        conn = sqlite3.connect(database_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT filename, names, data_x, data_y FROM Spectra")
+        filenames, names, xs, ys, keys = [], [], [], [], []
+        for filename, name, data_x, data_y in cursor:
+            x = parse_vector(data_x)
+            y = parse_vector(data_y)
+            if len(x) < 2 or len(x) != len(y):
+                continue
+            filenames.append(filename)
+            names.append(name)
+            xs.append(x)
+            ys.append(y)
+            # 同一台仪器导出的光谱波数网格相同，数据库中的原始文本也相同，可直接作为分组的键
+            keys.append(data_x)
+        conn.close()
+
+        matrix = resample_many(xs, ys, grid, keys=keys)
+        peaks = matrix.max(axis=1) if len(matrix) else np.empty(0)
+        keep = np.flatnonzero(peaks > 0)
+        return cls([filenames[i] for i in keep], [names[i] for i in keep], grid,
+                   matrix[keep] / peaks[keep, None])
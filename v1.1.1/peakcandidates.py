@@ -0,0 +1,250 @@
+"""峰候选的缓存：每条光谱只计算一次所有局部极大值及其显著性和宽度，之后按参数向量化筛选
+
+scipy.signal.find_peaks 的 height、prominence、width 条件彼此独立（显著性和宽度只取决于峰本身），
+因此先不加任何条件找出全部局部极大值，再对缓存的属性做布尔筛选，结果与带条件调用 find_peaks 相同。
+调整寻峰参数时只需筛选，不必重新寻峰。
+
+tune 在一次向量化计算中评估整个参数网格（每个候选对每个阈值的布尔矩阵经 einsum 合并为各参数组合的峰数），
+按目标函数选出参数：
+- 'count': 峰数最接近给定的目标
+- 'noise': 选出的峰与显著性超过噪声水平若干倍的候选最一致（F1）
+- 'density': 峰数最接近参考库光谱在同一波数范围内的峰数中位数
+"""
+
+import argparse
+import time
+from collections import namedtuple
+
+import numpy as np
+from scipy.signal import find_peaks, peak_prominences, peak_widths
+
+from peakfit import PeakFit, parabolic
+from smoothing import valid_segments
+
+
+OBJECTIVES = ('count', 'noise', 'density')
+
+# params 为可直接用于 find_peaks 的 width、rel_height、height、prominence（None 表示不限制）
+TuneResult = namedtuple('TuneResult', ['params', 'count', 'score', 'n_evaluated', 'elapsed'])
+
+
+def _bounds(condition):
+    """find_peaks 风格的条件（数值或 (最小值, 最大值)）转为 (最小值, 最大值)"""
+    if condition is None:
+        return None, None
+    if isinstance(condition, (tuple, list)):
+        return condition[0], condition[1]
+    return condition, None
+
+
+class PeakCandidates:
+    """一条光谱的全部局部极大值及其属性
+
+    Attributes:
+    - index: 局部极大值的下标
+    - heights, prominences: 对应的高度和显著性
+    - widths(rel_height): 按相对高度计算的宽度（采样点数），按 rel_height 缓存
+    - refined: 所有候选的抛物线插值精修结果（PeakFit）
+    """
+
+    def __init__(self, x, y, valid=None):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.valid = valid
+        segments = [(0, len(self.y))] if valid is None else valid_segments(valid)
+        index, prominences, left_bases, right_bases, starts = [], [], [], [], []
+        # 每个有效区间分别寻找局部极大值，区间的视图不拷贝数据
+        for start, stop in segments:
+            segment = self.y[start:stop]
+            peaks, _ = find_peaks(segment)
+            prominence, left, right = peak_prominences(segment, peaks)
+            index.append(peaks + start)
+            prominences.append(prominence)
+            left_bases.append(left + start)
+            right_bases.append(right + start)
+            starts.append(np.full(len(peaks), start))
+        self.index = np.concatenate(index) if index else np.empty(0, dtype=int)
+        self.prominences = np.concatenate(prominences) if prominences else np.empty(0)
+        self._left_bases = np.concatenate(left_bases) if left_bases else np.empty(0, dtype=int)
+        self._right_bases = np.concatenate(right_bases) if right_bases else np.empty(0, dtype=int)
+        self.heights = self.y[self.index]
+        self._segments = segments
+        self._widths = {}
+        self._refined = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def widths(self, rel_height=0.5):
+        """所有候选在 rel_height 处的宽度（采样点数）"""
+        if rel_height not in self._widths:
+            widths = np.empty(len(self.index))
+            for start, stop in self._segments:
+                inside = (self.index >= start) & (self.index < stop)
+                if inside.any():
+                    prominence_data = (self.prominences[inside], self._left_bases[inside] - start,
+                                       self._right_bases[inside] - start)
+                    widths[inside] = peak_widths(self.y[start:stop], self.index[inside] - start,
+                                                 rel_height, prominence_data)[0]
+            self._widths[rel_height] = widths
+        return self._widths[rel_height]
+
+    @property
+    def refined(self):
+        if self._refined is None:
+            self._refined = parabolic(self.x, self.y, self.index, self.valid)
+        return self._refined
+
+    def mask(self, width=None, rel_height=0.5, height=None, prominence=None):
+        """满足 find_peaks 条件的候选的布尔掩码"""
+        keep = np.ones(len(self.index), dtype=bool)
+        for condition, values in ((height, lambda: self.heights), (prominence, lambda: self.prominences),
+                                  (width, lambda: self.widths(rel_height))):
+            low, high = _bounds(condition)
+            if low is not None:
+                keep &= values() >= low
+            if high is not None:
+                keep &= values() <= high
+        return keep
+
+    def select(self, width=None, rel_height=0.5, height=None, prominence=None):
+        """满足条件的峰下标，与带相同条件调用 find_peaks 的结果一致"""
+        return self.index[self.mask(width, rel_height, height, prominence)]
+
+    def select_refined(self, width=None, rel_height=0.5, height=None, prominence=None):
+        """满足条件的峰的抛物线插值精修结果（PeakFit），不重新计算"""
+        keep = self.mask(width, rel_height, height, prominence)
+        return PeakFit(*(field[keep] for field in self.refined))
+
+
+def noise_level(y, valid=None):
+    """噪声标准差的稳健估计：一阶差分的 MAD（逐个有效区间计算差分，不跨越排除的区间）"""
+    y = np.asarray(y, dtype=float)
+    segments = [(0, len(y))] if valid is None else valid_segments(valid)
+    diffs = np.concatenate([np.diff(y[start:stop]) for start, stop in segments] or [np.empty(0)])
+    diffs = diffs[np.isfinite(diffs)]
+    if not len(diffs):
+        return 0.0
+    # 相邻两点噪声之差的标准差为单点的 sqrt(2) 倍
+    return float(np.median(np.abs(diffs - np.median(diffs))) / 0.6745 / np.sqrt(2))
+
+
+def library_peak_count(peaks, low, high):
+    """参考光谱（每条为峰位数组）落在 [low, high] 内的峰数的中位数"""
+    if not len(peaks):
+        return 0
+    positions = np.concatenate([np.asarray(p, dtype=float) for p in peaks])
+    owners = np.repeat(np.arange(len(peaks)), [len(p) for p in peaks])
+    inside = (positions >= low) & (positions <= high)
+    return int(round(np.median(np.bincount(owners[inside], minlength=len(peaks)))))
+
+
+def _thresholds(values, steps, log):
+    """网格的一条轴：-inf（不限制）加上 values（取对数时只看正值）范围内高于最小值的 steps - 1 个阈值"""
+    values = values[np.isfinite(values)]
+    if log:
+        values = values[values > 0]
+    if len(values) < 2 or steps < 2:
+        return np.array([-np.inf])
+    low, high = values.min(), values.max()
+    if low == high:
+        return np.array([-np.inf])
+    grid = np.geomspace(low, high, steps) if log else np.linspace(low, high, steps)
+    # 保留 4 位有效数字，填入输入框的文本与评估时的阈值完全相同
+    grid = np.unique([float(f'{value:.4g}') for value in grid[1:]])
+    return np.concatenate([[-np.inf], grid])
+
+
+def tune(candidates, objective='count', target=None, noise_factor=5.0,
+         rel_heights=(0.5, 0.75, 1.0), steps=16):
+    """在参数网格上选出最符合目标的寻峰参数，返回 TuneResult
+
+    objective 为 'count' 或 'density' 时 target 为目标峰数（'density' 的目标由 library_peak_count 给出）；
+    为 'noise' 时 target 为噪声标准差（默认由 noise_level 估计），显著性超过 noise_factor 倍的候选视为真实的峰。
+    得分相同的参数组合中选出的峰的显著性之和最大者（优先保留较强的峰）。
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f'未知的目标函数：{objective}')
+    if objective != 'noise' and target is None:
+        raise ValueError(f'目标函数 {objective} 需要目标峰数')
+    start = time.perf_counter()
+    heights = _thresholds(candidates.heights, steps, log=False)
+    prominences = _thresholds(candidates.prominences, steps, log=True)
+    above_height = (candidates.heights[None, :] >= heights[:, None]).astype(float)
+    above_prominence = (candidates.prominences[None, :] >= prominences[:, None]).astype(float)
+    weighted = above_prominence * candidates.prominences[None, :]
+    if objective == 'noise':
+        sigma = noise_level(candidates.y, candidates.valid) if target is None else target
+        significant = (candidates.prominences >= noise_factor * sigma).astype(float)
+        n_significant = significant.sum()
+
+    best = None
+    n_evaluated = 0
+    for rel_height in rel_heights:
+        widths = candidates.widths(rel_height)
+        thresholds = _thresholds(widths, steps, log=True)
+        above_width = (widths[None, :] >= thresholds[:, None]).astype(float)
+        # 每个 (高度, 显著性, 宽度) 组合选出的峰数和显著性之和，形状为 (n_height, n_prominence, n_width)
+        count = np.einsum('hc,pc,wc->hpw', above_height, above_prominence, above_width, optimize=True)
+        strength = np.einsum('hc,pc,wc->hpw', above_height, weighted, above_width, optimize=True)
+        if objective == 'noise':
+            hits = np.einsum('hc,pc,wc,c->hpw', above_height, above_prominence, above_width, significant,
+                             optimize=True)
+            with np.errstate(invalid='ignore'):
+                score = np.nan_to_num(2 * hits / (count + n_significant), nan=1.0)
+        else:
+            score = -np.abs(count - target)
+        n_evaluated += count.size
+        # 先比较得分，再比较显著性之和
+        flat = np.lexsort((strength.ravel(), score.ravel()))[-1]
+        key = (score.ravel()[flat], strength.ravel()[flat])
+        if best is None or key > best[0]:
+            h, p, w = np.unravel_index(flat, count.shape)
+            best = (key, rel_height, heights[h], prominences[p], thresholds[w], int(count.ravel()[flat]))
+
+    (score, _), rel_height, height, prominence, width, count = best
+
+    def condition(value):
+        return None if np.isneginf(value) else float(value)
+
+    params = {'width': condition(width), 'rel_height': rel_height if np.isfinite(width) else None,
+              'height': condition(height), 'prominence': condition(prominence)}
+    return TuneResult(params, count, float(score), n_evaluated, time.perf_counter() - start)
+
+
+def benchmark(n_points=5000, steps=16, seed=0):
+    """比较逐个参数组合调用 find_peaks 与向量化网格评估的耗时"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(100, 1500, n_points)
+    centres = rng.uniform(150, 1450, 20)
+    y = (rng.uniform(1, 10, 20) * np.exp(-((x[:, None] - centres) / 5) ** 2)).sum(axis=1) + \
+        rng.normal(0, 0.05, n_points)
+
+    start = time.perf_counter()
+    candidates = PeakCandidates(x, y)
+    result = tune(candidates, 'count', target=20, steps=steps)
+    t_grid = time.perf_counter() - start
+
+    grid_height = _thresholds(candidates.heights, steps, log=False)
+    grid_prominence = _thresholds(candidates.prominences, steps, log=True)
+    start = time.perf_counter()
+    n_loop = 0
+    for rel_height in (0.5, 0.75, 1.0):
+        grid_width = _thresholds(candidates.widths(rel_height), steps, log=True)
+        for h in grid_height:
+            for p in grid_prominence:
+                for w in grid_width:
+                    find_peaks(y, height=None if np.isneginf(h) else h, prominence=None if np.isneginf(p) else p,
+                               width=None if np.isneginf(w) else w, rel_height=rel_height)
+                    n_loop += 1
+    t_loop = time.perf_counter() - start
+    print(f'{n_loop} 组参数：逐个 find_peaks {t_loop:.3f} 秒  网格评估 {t_grid:.3f} 秒  '
+          f'选出 {result.count} 个峰，参数 {result.params}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='寻峰参数网格评估与逐个调用 find_peaks 的耗时比较')
+    parser.add_argument('--points', type=int, default=5000)
+    parser.add_argument('--steps', type=int, default=16)
+    args = parser.parse_args()
+    benchmark(args.points, args.steps)
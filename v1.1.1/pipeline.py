@@ -0,0 +1,307 @@
+"""声明式光谱处理流水线：裁剪、去尖峰、平滑、基线校正和寻峰阶段
+
+每个阶段都是纯 NumPy 计算，不依赖 GUI。流水线可以序列化为 JSON，参数在构造时校验，
+重复运行时会跳过输入和参数都未改变的阶段。y 可以是单条光谱 (n_points,) 或批量光谱
+(n_spectra, n_points)，批量光谱共享同一个 x 轴。
+
+裁剪不修改 y：状态中的 'valid' 是沿 x 轴的布尔掩码（None 表示全部有效），后续阶段只在
+连续的有效区间内计算。需要 NaN 表示的使用者（绘图、导出、检索）调用 masked_y(state)。
+"""
+
+import argparse
+import hashlib
+import json
+from numbers import Real
+
+import numpy as np
+from batch import baseline_als_batch, find_segment_peaks, get_peaks_batch, smooth_batch
+from despike import remove_spikes
+from peakfit import PROFILES, fit_peaks
+from smoothing import SMOOTHING_METHODS, valid_segments
+from utils import baseline_als, get_peaks
+
+
+def _is_number(value):
+    return isinstance(value, Real) and not isinstance(value, bool)
+
+
+def masked_y(state):
+    """状态中的 y，裁剪排除的点为 NaN（没有排除的点时直接返回 y）"""
+    valid = state.get('valid')
+    if valid is None:
+        return state['y']
+    return np.where(valid, state['y'], np.nan)
+
+
+class Stage:
+    """处理阶段的基类
+
+    子类定义 `name`、参数默认值 `defaults`，并实现 `validate` 和 `run`。
+    `run` 接收并返回状态字典（包含 'x'、'y'、可选的 'valid'，以及后续阶段添加的
+    'spikes'、'baseline'、'peaks'），不修改输入的数组。
+    """
+    name = ''
+    defaults = {}
+
+    def __init__(self, **params):
+        unknown = set(params) - set(self.defaults)
+        if unknown:
+            raise ValueError(f'{self.name}: 未知参数 {sorted(unknown)}')
+        self.params = {**self.defaults, **params}
+        self.validate()
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.params})'
+
+    def validate(self):
+        pass
+
+    def run(self, state):
+        raise NotImplementedError
+
+    def to_dict(self):
+        return {'stage': self.name, **self.params}
+
+
+class CropStage(Stage):
+    """排除 start <= x <= end 区间：只更新 'valid' 掩码，y 不变，多次裁剪的结果为各区间的并集"""
+    name = 'crop'
+    defaults = {'start': None, 'end': None}
+
+    def validate(self):
+        if not (_is_number(self.params['start']) and _is_number(self.params['end'])):
+            raise ValueError('crop: start 和 end 必须是数值')
+        if self.params['start'] > self.params['end']:
+            self.params['start'], self.params['end'] = self.params['end'], self.params['start']
+
+    def mask(self, x):
+        return (x >= self.params['start']) & (x <= self.params['end'])
+
+    def run(self, state):
+        mask = self.mask(state['x'])
+        if not mask.any():
+            return state
+        valid = state.get('valid')
+        return {**state, 'valid': ~mask if valid is None else valid & ~mask}
+
+
+class DespikeStage(Stage):
+    """检测并去除宇宙射线尖峰（见 despike.py），'spikes' 为与 y 形状相同的尖峰掩码"""
+    name = 'despike'
+    defaults = {'threshold': 6.0, 'window_length': 11, 'max_width': 2}
+
+    def validate(self):
+        if not _is_number(self.params['threshold']) or self.params['threshold'] <= 0:
+            raise ValueError('despike: threshold 必须是正数')
+        max_width, window_length = self.params['max_width'], self.params['window_length']
+        if not isinstance(max_width, int) or max_width < 1:
+            raise ValueError('despike: max_width 必须是正整数')
+        if not isinstance(window_length, int) or window_length <= 2 * max_width + 1:
+            raise ValueError('despike: window_length 必须是大于 2 × max_width + 1 的整数')
+
+    def run(self, state):
+        y, spikes = remove_spikes(state['y'], valid=state.get('valid'), **self.params)
+        return {**state, 'y': y, 'spikes': spikes}
+
+
+class SmoothStage(Stage):
+    """在每个连续的有效区间内平滑（见 smoothing.py），数组长度、NaN 位置和排除区间内的值保持不变"""
+    name = 'smooth'
+    defaults = {'method': 'savgol', 'window_length': 11, 'polyorder': 3, 'lam': 100.0}
+
+    def validate(self):
+        if self.params['method'] not in SMOOTHING_METHODS:
+            raise ValueError(f'smooth: method 必须是 {", ".join(SMOOTHING_METHODS)} 之一')
+        window_length, polyorder = self.params['window_length'], self.params['polyorder']
+        if not isinstance(window_length, int) or window_length < 1:
+            raise ValueError('smooth: window_length 必须是正整数')
+        if not isinstance(polyorder, int) or not 0 <= polyorder < window_length:
+            raise ValueError('smooth: polyorder 必须是小于 window_length 的非负整数')
+        if not _is_number(self.params['lam']) or self.params['lam'] <= 0:
+            raise ValueError('smooth: lam 必须是正数')
+
+    def run(self, state):
+        x, y = smooth_batch(state['x'], state['y'], valid=state.get('valid'), **self.params)
+        return {**state, 'x': x, 'y': y}
+
+
+class BaselineStage(Stage):
+    """非对称最小二乘（ALS）基线估计，`subtract` 为 True 时同时从 y 中减去基线"""
+    name = 'baseline'
+    defaults = {'lam': 1e5, 'p': 0.05, 'niter': 1000, 'subtract': True}
+
+    def validate(self):
+        if not _is_number(self.params['lam']) or self.params['lam'] <= 0:
+            raise ValueError('baseline: lam 必须是正数')
+        if not _is_number(self.params['p']) or not 0 < self.params['p'] < 1:
+            raise ValueError('baseline: p 必须在 (0, 1) 之间')
+        if not isinstance(self.params['niter'], int) or self.params['niter'] < 1:
+            raise ValueError('baseline: niter 必须是正整数')
+
+    def baseline(self, y, valid=None):
+        """估计单条或批量光谱的基线；排除的点权重为 0，基线在排除区间内连续"""
+        lam, p, niter = self.params['lam'], self.params['p'], self.params['niter']
+        if y.ndim == 1 and valid is None:
+            return baseline_als(y, lam=lam, p=p, niter=niter)
+        return baseline_als_batch(y, lam=lam, p=p, niter=niter, valid=valid).reshape(y.shape)
+
+    def run(self, state):
+        baseline = self.baseline(state['y'], state.get('valid'))
+        y = state['y'] - baseline if self.params['subtract'] else state['y']
+        return {**state, 'y': y, 'baseline': baseline}
+
+
+class PeaksStage(Stage):
+    """scipy.signal.find_peaks 寻峰；批量时 'peaks' 为每条光谱的 (peaks_x, peaks_y) 列表
+
+    `refine` 为 'parabolic'、'lorentzian' 或 'voigt' 时对峰做亚像素精修（见 peakfit.py），
+    'peaks' 中为精修后的峰位和峰高，'peak_fits' 为对应的 PeakFit（批量时为列表）。
+    """
+    name = 'peaks'
+    defaults = {'width': None, 'rel_height': None, 'height': None, 'prominence': None, 'refine': None}
+
+    def validate(self):
+        width = self.params['width']
+        if isinstance(width, list):
+            width = self.params['width'] = tuple(width)
+        if not (width is None or _is_number(width) or
+                (isinstance(width, tuple) and len(width) == 2 and all(w is None or _is_number(w) for w in width))):
+            raise ValueError('peaks: width 必须是数值或 (最小值, 最大值)')
+        rel_height = self.params['rel_height']
+        if rel_height is not None and (not _is_number(rel_height) or rel_height < 0):
+            raise ValueError('peaks: rel_height 必须是非负数')
+        for key in ('height', 'prominence'):
+            if self.params[key] is not None and not _is_number(self.params[key]):
+                raise ValueError(f'peaks: {key} 必须是数值')
+        if self.params['refine'] is not None and self.params['refine'] not in PROFILES:
+            raise ValueError(f'peaks: refine 必须是 {", ".join(PROFILES)} 之一')
+
+    def _params(self):
+        # rel_height 为 None 时使用 find_peaks 的默认值
+        params = {**self.params, 'rel_height': 0.5 if self.params['rel_height'] is None else self.params['rel_height']}
+        del params['refine']
+        return params
+
+    def indices(self, y, valid=None):
+        """单条光谱的峰下标，valid 不为 None 时只在每个连续的有效区间内寻峰"""
+        if valid is None:
+            return find_segment_peaks(y, [(0, len(y))], **self._params())
+        return find_segment_peaks(y, valid_segments(valid), **self._params())
+
+    def fit(self, x, y, valid=None):
+        """寻峰并精修，返回 PeakFit（refine 为 None 时按 'parabolic' 精修）"""
+        return fit_peaks(x, y, self.indices(y, valid), self.params['refine'] or 'parabolic', valid)
+
+    def find(self, x, y, valid=None):
+        """单条光谱寻峰，返回 (peaks_x, peaks_y)"""
+        if self.params['refine'] is not None:
+            fit = self.fit(x, y, valid)
+            return fit.position, fit.height
+        if valid is None:
+            return get_peaks(x, y, **self._params())
+        peaks = self.indices(y, valid)
+        return x[peaks], y[peaks]
+
+    def run(self, state):
+        x, y, valid = state['x'], state['y'], state.get('valid')
+        if self.params['refine'] is not None:
+            if y.ndim == 1:
+                fits = self.fit(x, y, valid)
+                return {**state, 'peaks': (fits.position, fits.height), 'peak_fits': fits}
+            fits = [self.fit(x, row, valid) for row in y]
+            return {**state, 'peaks': [(fit.position, fit.height) for fit in fits], 'peak_fits': fits}
+        if y.ndim == 1:
+            peaks = self.find(x, y, valid)
+        else:
+            peaks = get_peaks_batch(x, y, valid=valid, **self._params())
+        return {**state, 'peaks': peaks}
+
+
+STAGES = {stage.name: stage for stage in (CropStage, DespikeStage, SmoothStage, BaselineStage, PeaksStage)}
+
+
+def _digest(*parts):
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(np.ascontiguousarray(part).tobytes() if isinstance(part, np.ndarray) else repr(part).encode())
+    return h.hexdigest()
+
+
+class Pipeline:
+    """按顺序执行的处理阶段
+
+    每个阶段的输出都按 (输入摘要, 阶段参数) 缓存：再次运行时，输入和参数都未改变的阶段
+    直接复用上次的结果，因此只修改最后的寻峰参数时不会重新计算基线。
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self._cache = [None] * len(self.stages)
+
+    @classmethod
+    def from_list(cls, specs):
+        """由 [{'stage': 'smooth', 'window_length': 11, ...}, ...] 构造，并校验所有参数"""
+        stages = []
+        for spec in specs:
+            spec = dict(spec)
+            name = spec.pop('stage', None)
+            if name not in STAGES:
+                raise ValueError(f'未知的处理阶段：{name}')
+            stages.append(STAGES[name](**spec))
+        return cls(stages)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_list(json.loads(text))
+
+    def to_list(self):
+        return [stage.to_dict() for stage in self.stages]
+
+    def to_json(self, indent=4):
+        return json.dumps(self.to_list(), indent=indent)
+
+    def run(self, x, y, valid=None):
+        """对单条或批量光谱运行流水线，返回最终的状态字典
+
+        valid 为沿 x 轴的布尔掩码，False 表示已排除的点（如 Spectrum.valid）。
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        key = _digest(x, y, valid)
+        state = {'x': x, 'y': y, 'valid': valid}
+        for i, stage in enumerate(self.stages):
+            key = _digest(key, stage.to_dict())
+            cached = self._cache[i]
+            if cached is not None and cached[0] == key:
+                state = cached[1]
+                continue
+            state = stage.run(state)
+            self._cache[i] = (key, state)
+        return state
+
+
+if __name__ == '__main__':
+    from pathlib import Path
+
+    from reader import iter_blocks, sniff
+    from utils import get_xy_from_file
+
+    parser = argparse.ArgumentParser(description='对光谱文件运行 JSON 格式的处理流水线')
+    parser.add_argument('pipeline', help='流水线 JSON 文件')
+    parser.add_argument('spectrum', help='光谱文件（.txt 或 .csv），可以是包含多条光谱的导出文件')
+    parser.add_argument('--block-size', type=int, default=256, help='多光谱文件每次读取和处理的光谱数')
+    args = parser.parse_args()
+
+    with open(args.pipeline, 'r') as f:
+        pipeline = Pipeline.from_json(f.read())
+    layout = sniff(args.spectrum)
+    if not layout.is_multi:
+        result = pipeline.run(*get_xy_from_file(Path(args.spectrum)))
+        if 'peaks' in result:
+            print(', '.join(f'{x:.1f}' for x in result['peaks'][0]))
+    else:
+        # 多光谱文件逐块流式读取，每块作为一个批量运行流水线
+        for block in iter_blocks(args.spectrum, args.block_size, layout):
+            result = pipeline.run(block.x, block.y)
+            for coords, peaks in zip(block.coords, result.get('peaks', [])):
+                print(' '.join(f'{c:g}' for c in coords), ':', ', '.join(f'{x:.1f}' for x in peaks[0]))
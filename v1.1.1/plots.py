@@ -1,14 +1,154 @@
-"""该模块包含一个 PlotWidget 的子类，可以进行裁剪"""
+"""该模块包含一个 PlotWidget 的子类，可以进行裁剪，以及长光谱的绘制设置
+
+长光谱（几十万点以上）和多条叠加光谱的重绘主要耗费在绘制线条上，粗的画笔是 pyqtgraph 中最慢的路径之一。
+set_curve 按配置为曲线启用：
+- 保留峰值的自动降采样（每个像素宽度内只画最小值和最大值）
+- 只绘制视图范围内的数据（clip-to-view，要求 x 升序，降序的数据先排序）
+- 点数超过阈值时使用 1 像素宽的画笔
+
+PeakLabelLayer 把所有峰值标签作为一个图形项绘制，只显示在当前缩放下互不重叠的标签（较高的峰优先），
+视图范围改变时只重新计算布局，不重建任何图形项。
+"""
+
+import argparse
+import time
+
+import numpy as np
 
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                             QLabel, QLineEdit, QPushButton, QTextEdit, QGridLayout,QGraphicsRectItem,
                             QFileDialog, QMessageBox, QListWidget, QAbstractItemView, QListView)
 from PyQt6 import QtCore
 from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QFont
+from PyQt6.QtGui import QColor, QFont, QFontMetricsF, QPen, QStaticText, QTransform
 from PyQt6.QtCore import pyqtSignal
 import pyqtgraph as pg
 
+
+def render_settings(config):
+    """从配置中取出绘制设置"""
+    return {name: config[name] for name in
+            ('plot downsampling', 'plot clip to view', 'plot pen width', 'plot thin pen points')}
+
+
+def curve_pen(color, n_points, settings):
+    """n_points 个点的曲线的画笔：点数超过 'plot thin pen points'（为 0 时不限制）时宽度为 1"""
+    thin = settings['plot thin pen points']
+    return pg.mkPen(color=color, width=1 if thin and n_points > thin else settings['plot pen width'])
+
+
+def set_curve(item, x, y, color, settings, n_points=None):
+    """按绘制设置更新曲线；x 为 None 时清空。n_points 为决定画笔宽度的点数（叠加多条曲线时取总点数）"""
+    item.setDownsampling(auto=settings['plot downsampling'], method='peak')
+    item.setClipToView(settings['plot clip to view'])
+    if x is None:
+        item.setData([], [])
+        return
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if settings['plot clip to view'] and len(x) > 1:
+        steps = np.diff(x)
+        if (steps <= 0).all():
+            # 降序的光谱（常见的导出格式）只需反转视图
+            x, y = x[::-1], y[::-1]
+        elif (steps < 0).any():
+            order = np.argsort(x, kind='stable')
+            x, y = x[order], y[order]
+    item.setPen(curve_pen(color, len(x) if n_points is None else n_points, settings))
+    item.setData(x, y)
+
+
+class PeakLabelLayer(pg.GraphicsObject):
+    """竖排的峰值标签层：一个图形项绘制全部标签，按当前缩放做细节层次筛选
+
+    标签的左上角位于峰顶，文字自下而上（与 angle=90 的 TextItem 相同）。每次视图改变后按峰高从高到低
+    依次放置屏幕上可见的标签，与已放置的标签重叠的跳过；布局按设备坐标变换缓存。
+    """
+
+    def __init__(self, color=(255, 0, 0), font=None):
+        super().__init__()
+        self.pen = QPen(QColor(*color))
+        self.font = QFont() if font is None else font
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+        self.texts = []
+        self.sizes = np.empty((0, 2))  # 每个标签文字的 (宽, 高)，单位为像素
+        self.layout_key = None
+        self.shown = np.empty(0, dtype=int)
+        self.positions = (np.empty(0), np.empty(0))
+
+    def setData(self, x, y, texts=None):
+        """设置标签的位置和文字（默认为保留一位小数的 x）"""
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        texts = [str(round(value, 1)) for value in self.x] if texts is None else list(texts)
+        self.texts = [QStaticText(text) for text in texts]
+        metrics = QFontMetricsF(self.font)
+        self.sizes = np.array([(metrics.horizontalAdvance(text), metrics.height()) for text in texts]).reshape(-1, 2)
+        for text in self.texts:
+            text.prepare(QTransform(), self.font)
+        self.layout_key = None
+        self.prepareGeometryChange()
+        self.update()
+
+    def __len__(self):
+        return len(self.x)
+
+    def dataBounds(self, axis, frac=1.0, orthoRange=None):
+        # 标签不参与自动缩放
+        return None, None
+
+    def boundingRect(self):
+        # 标签按像素尺寸绘制，覆盖整个可见区域
+        rect = self.viewRect()
+        return QtCore.QRectF() if rect is None else rect
+
+    def viewRangeChanged(self):
+        self.prepareGeometryChange()
+        self.update()
+
+    def layout(self, transform, width, height):
+        """可见且互不重叠的标签的下标，按设备坐标变换缓存"""
+        key = (transform.m11(), transform.m12(), transform.m21(), transform.m22(), transform.dx(), transform.dy(),
+               width, height)
+        if key == self.layout_key:
+            return self.shown
+        px = transform.m11() * self.x + transform.m21() * self.y + transform.dx()
+        py = transform.m12() * self.x + transform.m22() * self.y + transform.dy()
+        # 竖排标签在屏幕上占据 [px, px + 文字高度] × [py - 文字宽度, py]
+        left, right = px, px + self.sizes[:, 1]
+        top, bottom = py - self.sizes[:, 0], py
+        visible = np.flatnonzero((right >= 0) & (left <= width) & (bottom >= 0) & (top <= height) &
+                                 np.isfinite(px) & np.isfinite(py))
+        shown = []
+        boxes = np.empty((len(visible), 4))
+        for i in visible[np.argsort(-self.y[visible], kind='stable')]:
+            placed = boxes[:len(shown)]
+            if not ((left[i] < placed[:, 1]) & (right[i] > placed[:, 0]) &
+                    (top[i] < placed[:, 3]) & (bottom[i] > placed[:, 2])).any():
+                boxes[len(shown)] = (left[i], right[i], top[i], bottom[i])
+                shown.append(i)
+        self.layout_key = key
+        self.shown = np.array(shown, dtype=int)
+        self.positions = (px, py)
+        return self.shown
+
+    def paint(self, painter, option, widget=None):
+        if not len(self.x) or widget is None:
+            return
+        # 画笔当前的变换把数据坐标映射到设备像素
+        transform = painter.deviceTransform()
+        shown = self.layout(transform, widget.width(), widget.height())
+        px, py = self.positions
+        painter.save()
+        painter.setPen(self.pen)
+        painter.setFont(self.font)
+        for i in shown:
+            painter.setTransform(QTransform().translate(px[i], py[i]).rotate(-90))
+            painter.drawStaticText(QtCore.QPointF(0, 0), self.texts[i])
+        painter.restore()
+
+
 class CroppablePlotWidget(pg.PlotWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -66,3 +206,87 @@ class CroppablePlotWidget(pg.PlotWidget):
                 event.ignore()
         else:
             super().mouseMoveEvent(event)
+
+
+def benchmark(n_points=1_000_000, n_overlays=10, frames=5):
+    """无界面（offscreen）绘制的帧耗时：宽画笔逐点绘制与降采样、裁剪到视图、细画笔的比较"""
+    app = QApplication.instance() or QApplication([])
+    rng = np.random.default_rng(0)
+    x = np.linspace(100, 1500, n_points)
+    spectra = [np.sin(x / (5 + i)) + rng.normal(0, 0.05, n_points) for i in range(n_overlays)]
+    legacy = {'plot downsampling': False, 'plot clip to view': False, 'plot pen width': 3, 'plot thin pen points': 0}
+    fast = {'plot downsampling': True, 'plot clip to view': True, 'plot pen width': 3, 'plot thin pen points': 20000}
+    for name, settings in (('逐点绘制，3 像素画笔', legacy), ('降采样 + 裁剪 + 细画笔', fast)):
+        for label, curves in (('单条光谱', spectra[:1]), (f'{n_overlays} 条叠加', spectra)):
+            widget = CroppablePlotWidget()
+            widget.resize(1200, 600)
+            widget.show()
+            for y in curves:
+                item = pg.PlotDataItem()
+                widget.addItem(item)
+                set_curve(item, x, y, 'k', settings)
+            app.processEvents()
+            widget.grab()
+            start = time.perf_counter()
+            for _ in range(frames):
+                widget.getPlotItem().vb.update()
+                widget.grab()
+            full = (time.perf_counter() - start) / frames
+            # 放大到 1/20 的范围（模拟缩放和平移）
+            widget.setXRange(700, 770, padding=0)
+            app.processEvents()
+            start = time.perf_counter()
+            for i in range(frames):
+                widget.setXRange(700 + i, 770 + i, padding=0)
+                widget.grab()
+            zoomed = (time.perf_counter() - start) / frames
+            widget.close()
+            print(f'{name:16s} {label:8s} 全范围 {full * 1e3:8.1f} 毫秒/帧  放大 {zoomed * 1e3:8.1f} 毫秒/帧')
+
+
+def benchmark_labels(n_labels=500, frames=5):
+    """峰值标签：每个峰一个 TextItem 与 PeakLabelLayer 的显示耗时和帧耗时"""
+    app = QApplication.instance() or QApplication([])
+    rng = np.random.default_rng(0)
+    x = np.sort(rng.uniform(100, 1500, n_labels))
+    y = rng.uniform(0, 10, n_labels)
+    for name in ('TextItem', 'PeakLabelLayer'):
+        widget = CroppablePlotWidget()
+        widget.resize(1200, 600)
+        widget.show()
+        widget.addItem(pg.PlotDataItem(x, y, pen=None, symbol='o'))
+        app.processEvents()
+        start = time.perf_counter()
+        if name == 'TextItem':
+            for px, py in zip(x, y):
+                text_item = pg.TextItem(str(round(px, 1)), anchor=(0, 0), color=(255, 0, 0), angle=90)
+                text_item.setPos(px, py)
+                widget.addItem(text_item)
+        else:
+            layer = PeakLabelLayer()
+            widget.addItem(layer)
+            layer.setData(x, y)
+        widget.grab()
+        toggle = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(frames):
+            # 平移和缩放
+            widget.setXRange(100 + 20 * i, 1500 - 40 * i, padding=0)
+            widget.grab()
+        frame = (time.perf_counter() - start) / frames
+        shown = f'，显示 {len(layer.shown)} 个' if name == 'PeakLabelLayer' else ''
+        print(f'{n_labels} 个标签 {name:14s} 显示 {toggle * 1e3:8.1f} 毫秒  缩放/平移 {frame * 1e3:8.1f} 毫秒/帧{shown}')
+        widget.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='长光谱绘制的帧耗时（可在 QT_QPA_PLATFORM=offscreen 下运行）')
+    parser.add_argument('--points', type=int, default=1_000_000)
+    parser.add_argument('--overlays', type=int, default=10)
+    parser.add_argument('--frames', type=int, default=5)
+    parser.add_argument('--labels', type=int, default=0, help='改为比较 LABELS 个峰值标签的绘制耗时')
+    args = parser.parse_args()
+    if args.labels:
+        benchmark_labels(args.labels, args.frames)
+    else:
+        benchmark(args.points, args.overlays, args.frames)
@@ -0,0 +1,306 @@
+"""拉曼面扫描（高光谱图像）：基于分块内存映射的数据立方体，支持超出内存的大型面扫描
+
+面扫描保存在一个目录中：
+- cube.npy：形状为 (n_pixels, n_points) 的 float32 数组，按行优先顺序存放每个像素的光谱，以内存映射方式读写
+- x.npy：所有像素共享的波数轴
+- meta.json：面扫描的行列数 shape 等信息
+- images/：处理和鉴定得到的二维图像（峰强度图、鉴定结果图等）
+
+所有操作都按像素块进行，峰值内存只取决于块大小和并行进程数，与面扫描的大小无关。
+未测量的像素（导入时文件中没有的坐标）的光谱全为 NaN，处理和鉴定时跳过，对应的图像值为 NaN。
+"""
+
+import argparse
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from pipeline import Pipeline, masked_y
+from reader import iter_blocks, sniff
+from resample import Resampler
+from xcorr import masked_pearson
+
+
+def _band_name(centre):
+    return f'band {centre:g}'
+
+
+def _band_intensities(x, y, bands):
+    """每个波段 (中心, 半宽) 内的最大强度"""
+    images = {}
+    for centre, half_width in bands:
+        window = (x >= centre - half_width) & (x <= centre + half_width)
+        if window.any():
+            images[_band_name(centre)] = np.nanmax(np.where(np.isnan(y[:, window]), -np.inf, y[:, window]), axis=1)
+        else:
+            images[_band_name(centre)] = np.full(len(y), np.nan)
+    return images
+
+
+def _measured(y):
+    """已测量的像素（光谱不全为 NaN）的掩码"""
+    return ~np.isnan(y).all(axis=1)
+
+
+def _process_chunk(source, target, start, stop, columns, specs, bands):
+    """在子进程中处理一个像素块：读取源立方体，运行流水线并写入目标立方体
+
+    未测量的像素不送入流水线，它们在目标立方体中保持为 NaN，图像值也为 NaN。
+    """
+    cube = np.load(Path(source) / 'cube.npy', mmap_mode='r')
+    x = np.load(Path(source) / 'x.npy')[columns]
+    y = np.asarray(cube[start:stop][:, columns], dtype=float)
+    measured = _measured(y)
+    if not measured.any():
+        return start, stop, {}
+    state = Pipeline.from_list(specs).run(x, y[measured])
+    y = masked_y(state)
+    out = np.load(Path(target) / 'cube.npy', mmap_mode='r+')
+    if out.shape[1] != y.shape[1]:
+        raise ValueError('流水线在不同像素块上输出的波数轴不一致')
+    out[start + np.flatnonzero(measured)] = y
+    out.flush()
+    images = _band_intensities(state['x'], y, bands)
+    if 'spikes' in state:
+        images['spike count'] = np.count_nonzero(state['spikes'], axis=1).astype(float)
+    if 'peaks' in state:
+        images['peak count'] = np.array([len(peaks_x) for peaks_x, _ in state['peaks']], dtype=float)
+    for name, values in images.items():
+        images[name] = np.full(stop - start, np.nan)
+        images[name][measured] = values
+    return start, stop, images
+
+
+class RamanMap:
+    """磁盘上的拉曼面扫描
+
+    Attributes:
+    - path: 面扫描目录
+    - shape: (行数, 列数)
+    - x: 共享的波数轴
+    - cube: 形状为 (行数 × 列数, len(x)) 的内存映射数组
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = Path(path)
+        with open(self.path / 'meta.json', 'r') as f:
+            self.meta = json.load(f)
+        self.shape = tuple(self.meta['shape'])
+        self.x = np.load(self.path / 'x.npy')
+        self.cube = np.load(self.path / 'cube.npy', mmap_mode=mode)
+
+    def __len__(self):
+        return self.shape[0] * self.shape[1]
+
+    @classmethod
+    def create(cls, path, x, shape, **meta):
+        """新建一个空的面扫描，立方体初始化为 NaN"""
+        path = Path(path)
+        (path / 'images').mkdir(parents=True, exist_ok=True)
+        with open(path / 'meta.json', 'w') as f:
+            json.dump({'shape': list(shape), **meta}, f, indent=4, ensure_ascii=False)
+        np.save(path / 'x.npy', np.asarray(x, dtype=float))
+        cube = np.lib.format.open_memmap(path / 'cube.npy', mode='w+', dtype=np.float32,
+                                         shape=(shape[0] * shape[1], len(x)))
+        cube[:] = np.nan
+        cube.flush()
+        del cube
+        return cls(path, mode='r+')
+
+    @classmethod
+    def from_text(cls, file, path, block_size=1024):
+        """导入面扫描文本文件（reader 支持的宽格式或长格式，坐标列为 X、Y）
+
+        文件被流式读取两遍：第一遍只收集 X、Y 坐标以确定网格，第二遍把强度逐块写入内存映射，
+        因此导入时的内存占用与文件大小无关。
+        """
+        layout = sniff(file)
+        if layout.n_coords != 2:
+            raise ValueError(f'{file}：面扫描文件的每条光谱前应有 X、Y 两列坐标')
+        xs, ys = set(), set()
+        x = None
+        for block in iter_blocks(file, block_size, layout):
+            x = block.x
+            xs.update(block.coords[:, 0].tolist())
+            ys.update(block.coords[:, 1].tolist())
+        if x is None:
+            raise ValueError(f'{file} 中没有光谱')
+        xs, ys = np.array(sorted(xs)), np.array(sorted(ys))
+        raman_map = cls.create(path, x, (len(ys), len(xs)), source=str(file))
+
+        for block in iter_blocks(file, block_size, layout):
+            pixels = np.searchsorted(ys, block.coords[:, 1]) * len(xs) + np.searchsorted(xs, block.coords[:, 0])
+            raman_map.cube[pixels] = block.y
+        raman_map.cube.flush()
+        return raman_map
+
+    def chunks(self, chunk_size):
+        """按像素块依次返回 (start, stop)"""
+        for start in range(0, len(self), chunk_size):
+            yield start, min(start + chunk_size, len(self))
+
+    def spectrum(self, row, column):
+        """返回某个像素的 (x, y)"""
+        return self.x, np.asarray(self.cube[row * self.shape[1] + column], dtype=float)
+
+    def first_measured(self, chunk_size=4096):
+        """第一个已测量的像素，没有时返回 None"""
+        for start, stop in self.chunks(chunk_size):
+            measured = np.flatnonzero(_measured(self.cube[start:stop]))
+            if len(measured):
+                return start + measured[0]
+        return None
+
+    def valid_columns(self, chunk_size=4096):
+        """在任一像素中不为 NaN 的波数点，逐块统计"""
+        valid = np.zeros(len(self.x), dtype=bool)
+        for start, stop in self.chunks(chunk_size):
+            valid |= ~np.isnan(self.cube[start:stop]).all(axis=0)
+        return valid
+
+    def save_image(self, name, values):
+        np.save(self.path / 'images' / f'{name}.npy', np.asarray(values).reshape(self.shape))
+
+    def image(self, name):
+        return np.load(self.path / 'images' / f'{name}.npy')
+
+    def images(self):
+        """所有已保存的图像，{名称: 二维数组}"""
+        return {file.stem: np.load(file) for file in sorted((self.path / 'images').glob('*.npy'))}
+
+    def process(self, pipeline, path, bands=(), chunk_size=1024, workers=None):
+        """用处理流水线并行处理每个像素块，结果写入新的面扫描 `path`
+
+        Parameters:
+        - pipeline: Pipeline 或其 to_list() 形式
+        - bands: [(中心, 半宽), ...]，为每个波段保存处理后光谱的峰强度图
+        - chunk_size: 每块的像素数
+        - workers: 并行进程数，默认为 CPU 核数
+
+        同时在执行中的块数不超过 2 × workers，因此内存占用有上限。
+        流水线含寻峰阶段时还会保存每个像素的峰数图 'peak count'，含去尖峰阶段时保存尖峰点数图 'spike count'。
+        """
+        specs = pipeline.to_list() if isinstance(pipeline, Pipeline) else list(pipeline)
+        first = self.first_measured()
+        if first is None:
+            raise ValueError(f'{self.path}：面扫描中没有已测量的像素')
+        columns = self.valid_columns()
+        # 先处理一个像素确定输出的波数轴
+        probe = Pipeline.from_list(specs).run(self.x[columns], np.asarray(self.cube[first], dtype=float)[columns])
+        target = RamanMap.create(path, probe['x'], self.shape, source=str(self.path), pipeline=specs)
+
+        images = {}
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+
+            def collect(future):
+                start, stop, chunk_images = future.result()
+                for name, values in chunk_images.items():
+                    images.setdefault(name, np.full(len(self), np.nan))[start:stop] = values
+
+            for start, stop in self.chunks(chunk_size):
+                if len(pending) >= 2 * workers:
+                    collect(pending.popleft())
+                pending.append(executor.submit(_process_chunk, str(self.path), str(target.path),
+                                               start, stop, columns, specs, list(bands)))
+            while pending:
+                collect(pending.popleft())
+
+        for name, values in images.items():
+            target.save_image(name, values)
+        return RamanMap(target.path)
+
+    def identify(self, library, chunk_size=1024, workers=None):
+        """将每个像素与参考光谱库比较（在像素的有效点上的皮尔逊相关系数），保存最佳匹配图和相关系数图
+
+        使用线程而不是进程：主要开销是 BLAS 矩阵乘法（释放 GIL），且参考库矩阵无需复制到子进程。
+
+        Returns:
+        - best: 每个像素最佳匹配的参考光谱在 library 中的索引（行数 × 列数），未测量的像素为 -1
+        - score: 对应的相关系数，未测量的像素为 NaN
+        """
+        # 所有像素共享 x 轴，插值权重只需计算一次；超出测量范围的网格点为 NaN，不参与比较
+        resampler = Resampler(self.x, library.grid)
+        # 有效点相同的像素共用归一化后的参考矩阵（通常所有像素都相同，只计算一次）
+        references = {}
+
+        best = np.zeros(len(self), dtype=int)
+        score = np.zeros(len(self), dtype=np.float32)
+
+        def identify_chunk(start, stop):
+            y = np.asarray(self.cube[start:stop], dtype=float)
+            scores = masked_pearson(library.matrix, resampler.apply(y, left=np.nan, right=np.nan), references)
+            best[start:stop] = scores.argmax(axis=1)
+            score[start:stop] = scores[np.arange(stop - start), best[start:stop]]
+            missing = start + np.flatnonzero(~_measured(y))
+            best[missing] = -1
+            score[missing] = np.nan
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            for future in [executor.submit(identify_chunk, start, stop) for start, stop in self.chunks(chunk_size)]:
+                future.result()
+
+        self.save_image('identity', best)
+        self.save_image('identity score', score)
+        self.meta['identity filenames'] = library.filenames
+        self.meta['identity names'] = library.names
+        with open(self.path / 'meta.json', 'w') as f:
+            json.dump(self.meta, f, indent=4, ensure_ascii=False)
+        return best.reshape(self.shape), score.reshape(self.shape)
+
+
+def _parse_band(text):
+    centre, _, half_width = text.partition(':')
+    return float(centre), float(half_width or 5)
+
+
+if __name__ == '__main__':
+    import time
+
+    from library import SpectralLibrary, make_grid
+
+    parser = argparse.ArgumentParser(description='拉曼面扫描的导入、批量处理和逐像素鉴定')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help='导入面扫描文本文件')
+    import_parser.add_argument('file')
+    import_parser.add_argument('path', help='面扫描目录')
+    process_parser = subparsers.add_parser('process', help='用 JSON 流水线处理面扫描')
+    process_parser.add_argument('path')
+    process_parser.add_argument('pipeline', help='流水线 JSON 文件')
+    process_parser.add_argument('output', help='输出面扫描目录')
+    process_parser.add_argument('--band', action='append', default=[], type=_parse_band,
+                                help='峰强度图波段，格式为 中心:半宽，可重复')
+    process_parser.add_argument('--chunk-size', type=int, default=1024)
+    process_parser.add_argument('--workers', type=int, default=None)
+    identify_parser = subparsers.add_parser('identify', help='逐像素与光谱库比较')
+    identify_parser.add_argument('path')
+    identify_parser.add_argument('database')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'import':
+        raman_map = RamanMap.from_text(args.file, args.path)
+        print(f'导入 {raman_map.shape[0]} × {raman_map.shape[1]} 像素，{len(raman_map.x)} 个波数点')
+    elif args.command == 'process':
+        with open(args.pipeline, 'r') as f:
+            pipeline = Pipeline.from_json(f.read())
+        raman_map = RamanMap(args.path).process(pipeline, args.output, bands=args.band,
+                                                chunk_size=args.chunk_size, workers=args.workers)
+        print(f'已保存图像：{", ".join(raman_map.images())}')
+    else:
+        with open('config.json', 'r') as f:
+            config = json.load(f)
+        grid = make_grid(config['library grid start'], config['library grid end'], config['library grid step'])
+        library = SpectralLibrary.from_database(args.database, grid)
+        best, score = RamanMap(args.path, mode='r').identify(library)
+        for index, count in zip(*np.unique(best, return_counts=True)):
+            if index < 0:
+                print(f'未测量：{count} 像素')
+            else:
+                print(f'{library.names[index]}（{library.filenames[index]}）：{count} 像素')
+    print(f'用时 {time.perf_counter() - start:.2f} 秒')
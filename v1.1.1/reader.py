@@ -0,0 +1,206 @@
+"""多光谱文本文件的流式读取：时间序列、面扫描等仪器导出的大文件
+
+支持两种常见的导出格式（以 # 开头的行视为注释）：
+- 宽格式：第一行为波数轴，之后每行为一条光谱 `[坐标...] 强度...`
+- 长格式：每行为 `[坐标...] 波数 强度`，坐标相同的连续行组成一条光谱
+  （只有坐标在连续行中重复、或第一列不单调时才按长格式读取，带额外列的单光谱文件仍是单光谱）
+
+文件按固定大小的块读取并用 NumPy 批量解析，内存占用只取决于块大小，与文件大小无关。
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+# x：共享的波数轴（升序）；coords：(n, n_coords) 坐标；y：(n, len(x)) 强度；offsets：每条光谱在文件中的字节偏移
+SpectrumBlock = namedtuple('SpectrumBlock', ['x', 'coords', 'y', 'offsets'])
+
+
+def _is_number(text):
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+
+def _split(line, delimiter):
+    return [field.strip() for field in line.split(delimiter)] if delimiter else line.split()
+
+
+class Layout:
+    """sniff 得到的文件格式
+
+    Attributes:
+    - kind: 'wide' 或 'long'
+    - x: 宽格式的波数轴（文件中的顺序），长格式为 None
+    - n_coords: 每条光谱前面的坐标列数（如时间或 X、Y）
+    - delimiter: ',' 或 None（空白分隔）
+    - data_start: 第一行数据的字节偏移
+    """
+
+    def __init__(self, kind, x, n_coords, delimiter, data_start):
+        self.kind = kind
+        self.x = x
+        self.n_coords = n_coords
+        self.delimiter = delimiter
+        self.data_start = data_start
+
+    @property
+    def is_multi(self):
+        """文件是否可能包含多条光谱（普通的两列单光谱文件返回 False）"""
+        return self.kind == 'wide' or self.n_coords > 0
+
+
+def _repeats_coords(lines, delimiter, n_coords):
+    """样本行是否像长格式：坐标列在连续行中重复，或第一列不单调（单光谱的第一列是单调的波数轴）"""
+    try:
+        data = np.array([[float(field) for field in _split(text, delimiter)] for _, text in lines])
+    except ValueError:
+        return False
+    if data.ndim != 2 or len(data) < 2 or data.shape[1] != n_coords + 2:
+        return False
+    repeated = (np.diff(data[:, :n_coords], axis=0) == 0).all(axis=1).any()
+    steps = np.diff(data[:, 0])
+    monotonic = (steps > 0).all() or (steps < 0).all()
+    return bool(repeated or not monotonic)
+
+
+def sniff(file, max_lines=64):
+    """读取文件开头的几行，判断导出格式
+
+    多于两列、但坐标列从不重复且第一列单调的文件（如带有额外列的单光谱）视为单光谱（n_coords 为 0）。
+    """
+    lines = []
+    offset = 0
+    with open(file, 'rb') as f:
+        for line in f:
+            text = line.decode('latin-1').strip()
+            if text and not text.startswith('#'):
+                lines.append((offset, text))
+                if len(lines) == max_lines:
+                    break
+            offset += len(line)
+    if not lines:
+        raise ValueError(f'{file} 中没有数据')
+
+    delimiter = ',' if ',' in lines[0][1] else None
+    header = [field for field in _split(lines[0][1], delimiter) if _is_number(field)]
+    if len(lines) > 1 and len(header) > 4:
+        n_coords = len(_split(lines[1][1], delimiter)) - len(header)
+        if 0 <= n_coords <= 3:
+            return Layout('wide', np.array(header, dtype=float), n_coords, delimiter, lines[1][0])
+    if not header and len(lines) > 1:
+        # 长格式的列名行（如 X Y Wave Intensity）
+        lines = lines[1:]
+    n_fields = len(_split(lines[0][1], delimiter))
+    if n_fields < 2:
+        raise ValueError(f'无法识别 {file} 的格式')
+    n_coords = n_fields - 2
+    if n_coords and not _repeats_coords(lines, delimiter, n_coords):
+        n_coords = 0
+    return Layout('long', None, n_coords, delimiter, lines[0][0])
+
+
+def _read_lines(f, n_lines, offset):
+    """读取最多 n_lines 行数据，返回 (文本行, 每行的字节偏移, 新的偏移)"""
+    texts, offsets = [], []
+    while len(texts) < n_lines:
+        line = f.readline()
+        if not line:
+            break
+        text = line.decode('latin-1').strip()
+        if text and not text.startswith('#'):
+            texts.append(text)
+            offsets.append(offset)
+        offset += len(line)
+    return texts, offsets, offset
+
+
+def _parse(texts, delimiter):
+    return np.loadtxt(texts, delimiter=delimiter, ndmin=2)
+
+
+def _iter_wide(f, layout, block_size, offset):
+    order = np.argsort(layout.x)
+    x = layout.x[order]
+    k = layout.n_coords
+    while True:
+        texts, offsets, offset = _read_lines(f, block_size, offset)
+        if not texts:
+            return
+        data = _parse(texts, layout.delimiter)
+        if data.shape[1] != k + len(x):
+            raise ValueError('每行的强度个数与波数轴长度不一致')
+        yield SpectrumBlock(x, data[:, :k], data[:, k:][:, order], np.array(offsets))
+
+
+def _iter_long(f, layout, block_size, offset):
+    k = layout.n_coords
+    n_points = None
+    order = None
+    x = None
+    carry = np.empty((0, k + 2))
+    carry_offsets = np.empty(0, dtype=int)
+    done = False
+    while not done:
+        # 已知每条光谱的点数后，每次正好读取约 block_size 条光谱
+        texts, offsets, offset = _read_lines(f, block_size * n_points if n_points else 4096, offset)
+        done = not texts
+        data = np.vstack([carry, _parse(texts, layout.delimiter)]) if texts else carry
+        line_offsets = np.concatenate([carry_offsets, offsets])
+        if not len(data):
+            return
+
+        if k:
+            starts = np.concatenate([[0], np.flatnonzero((np.diff(data[:, :k], axis=0) != 0).any(axis=1)) + 1])
+        else:
+            starts = np.array([0])
+        # 最后一组可能跨越块边界，留到下一块（文件结束时除外）
+        ends = np.append(starts[1:], len(data))
+        if not done:
+            starts, ends = starts[:-1], ends[:-1]
+        if not len(starts):
+            carry, carry_offsets = data, line_offsets
+            continue
+        carry, carry_offsets = data[ends[-1]:], line_offsets[ends[-1]:]
+
+        lengths = ends - starts
+        if n_points is None:
+            n_points = lengths[0]
+            order = np.argsort(data[:n_points, k])
+            x = data[:n_points, k][order]
+        if (lengths != n_points).any():
+            raise ValueError('各条光谱的数据点数不一致')
+        spectra = data[starts[0]:ends[-1]].reshape(len(starts), n_points, k + 2)
+        yield SpectrumBlock(x, spectra[:, 0, :k], spectra[:, :, k + 1][:, order], line_offsets[starts])
+
+
+def iter_blocks(file, block_size=256, layout=None, start=None):
+    """逐块读取光谱，每次返回一个 SpectrumBlock（宽格式每块正好 block_size 条光谱，最后一块除外）
+
+    Parameters:
+    - layout: sniff(file) 的结果，为 None 时自动判断
+    - start: 从该字节偏移（某条光谱的 offsets 值）开始读取
+    """
+    layout = layout or sniff(file)
+    offset = layout.data_start if start is None else start
+    with open(file, 'rb') as f:
+        f.seek(offset)
+        if layout.kind == 'wide':
+            yield from _iter_wide(f, layout, block_size, offset)
+        else:
+            yield from _iter_long(f, layout, block_size, offset)
+
+
+def iter_spectra(file, block_size=256, layout=None):
+    """逐条返回 (坐标, x, y)"""
+    for block in iter_blocks(file, block_size, layout):
+        for coords, y in zip(block.coords, block.y):
+            yield coords, block.x, y
+
+
+def read_spectrum(file, offset, layout=None):
+    """读取从字节偏移 `offset` 开始的一条光谱，返回 (x, y)"""
+    block = next(iter_blocks(file, 1, layout, start=offset))
+    return block.x, block.y[0]
@@ -0,0 +1,329 @@
+"""本地鉴定服务：只加载一次参考光谱库及其索引，通过 localhost 上的 HTTP 接口提供检索
+
+启动服务：
+    python server.py serve database.db [--port 8765]
+
+接口（POST，请求和响应均为 JSON）：
+- /peaks：{"peaks": [...], "tolerance": 2}，峰值检索，返回匹配的单矿物、2 种和 3 种矿物组合
+- /similarity：{"x": [...], "y": [...], "k": 10, "method": "index" 或 "xcorr"}，全谱相似度检索
+- /process：{"x": [...], "y": [...], "pipeline": [...], "k": 10}，运行处理流水线后做相似度检索
+- GET /health：参考光谱数和公共网格
+
+请求由固定大小的线程池处理。`python server.py bench` 是本地测试客户端，报告吞吐量和 p50/p99 延迟。
+/similarity 和 /process 支持的 method 见 SIMILARITY_METHODS，其他方法（如 GUI 的 hausdorff、two-stage）返回 400。
+"""
+
+import argparse
+import http.client
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from ann_index import load_or_build_index, search_library
+from fingerprint import FingerprintIndex
+from library import SpectralLibrary, make_grid, resample_to_grid
+from pipeline import Pipeline, masked_y
+from utils import find_spectrum_matches
+from xcorr import xcorr_match
+
+
+# 服务支持的全谱相似度方法
+SIMILARITY_METHODS = ('index', 'xcorr')
+
+
+class IdentificationService:
+    """常驻内存的参考光谱库、近似最近邻索引和峰值指纹索引，可被多个线程同时使用"""
+
+    def __init__(self, database_path, config):
+        self.database_path = database_path
+        self.config = config
+        grid = make_grid(config['library grid start'], config['library grid end'], config['library grid step'])
+        self.library = SpectralLibrary.from_database(database_path, grid)
+        self.index = load_or_build_index(self.library, database_path, n_components=config['index components'])
+        self.fingerprints = FingerprintIndex.from_database(database_path,
+                                                           bin_width=config['fingerprint bin width'],
+                                                           spread=config['fingerprint spread'])
+        self.filename_to_name = dict(zip(self.fingerprints.filenames, self.fingerprints.names))
+
+    def health(self):
+        return {'spectra': len(self.library), 'grid': [self.config['library grid start'],
+                                                       self.config['library grid end'],
+                                                       self.config['library grid step']]}
+
+    def peak_search(self, peaks, tolerance):
+        """与 GUI 的峰值检索相同：返回 {'singletons': [...], 'pairs': [...], 'triples': [...]}，元素为矿物名称列表"""
+        peaks = [float(peak) for peak in peaks]
+        tolerance = float(tolerance)
+        rows = None
+        if self.config['fingerprint candidates']:
+            # 不截断候选，结果与逐条查询数据库相同
+            shortlist = self.fingerprints.shortlist(peaks, tol=tolerance,
+                                                    allowed=self.fingerprints.strongest_within(peaks, tolerance))
+            rows = self.fingerprints.rows(shortlist)
+        result = find_spectrum_matches(self.database_path, peaks, tolerance, rows=rows)
+
+        def unique(combos):
+            return sorted({tuple(sorted(self.filename_to_name[f] for f in combo)) for combo in combos})
+
+        return {'singletons': unique(result[1]), 'pairs': unique(result[2]), 'triples': unique(result[3])}
+
+    def similarity(self, x, y, k=None, method='index', include_spectra=False):
+        """全谱相似度检索，返回按得分降序的 [{'filename', 'name', 'score'[, 'offset', 'y']}]"""
+        if method not in SIMILARITY_METHODS:
+            raise ValueError(f'鉴定服务不支持相似度方法 {method}（支持 {", ".join(SIMILARITY_METHODS)}）')
+        k = k or self.config['similarity max results']
+        y = resample_to_grid(np.asarray(x, dtype=float), np.asarray(y, dtype=float), self.library.grid)
+        if method == 'xcorr':
+            scores, offsets = xcorr_match(self.library, y, self.config['xcorr max shift'])
+            indices = np.argsort(scores)[::-1][:k]
+            scores = scores[indices]
+        elif method == 'index':
+            indices, scores = search_library(self.index, self.library, y, k=k,
+                                             n_candidates=self.config['index candidates'],
+                                             n_probe=self.config['index probes'])
+            offsets = None
+        matches = []
+        for i, score in zip(indices, scores):
+            match = {'filename': self.library.filenames[i], 'name': self.library.names[i], 'score': float(score)}
+            if offsets is not None:
+                match['offset'] = float(offsets[i])
+            if include_spectra:
+                match['y'] = self.library.matrix[i].tolist()
+            matches.append(match)
+        return matches
+
+    def process(self, x, y, pipeline=(), k=None, method='index'):
+        """运行处理流水线，返回处理后的光谱、峰值（若有寻峰阶段）和相似度检索结果"""
+        state = Pipeline.from_list(pipeline).run(x, y)
+        y = masked_y(state)
+        result = {'x': state['x'].tolist(), 'y': y.tolist(),
+                  'matches': self.similarity(state['x'], y, k, method)}
+        if 'peaks' in state:
+            result['peaks'] = state['peaks'][0].tolist()
+        return result
+
+
+class PooledHTTPServer(HTTPServer):
+    """用固定大小的线程池处理连接的 HTTP 服务器（ThreadingHTTPServer 为每个连接新建线程，数量没有上限）
+
+    每个保持的连接在处理期间占用一个工作线程，连接数超过工作线程数时，排队的连接要等到某个连接关闭。因此：
+    - 空闲超过 idle_timeout 秒的连接被关闭
+    - 有连接在排队时，每个连接处理完当前请求后即关闭（响应带 Connection: close），客户端重新连接后排在队尾
+    """
+
+    def __init__(self, address, handler, service, workers=8, idle_timeout=5.0):
+        super().__init__(address, handler)
+        self.service = service
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.connections = 0  # 正在处理和排队的连接数
+        self.connections_lock = threading.Lock()
+
+    @property
+    def saturated(self):
+        """是否有连接在等待工作线程"""
+        return self.connections > self.workers
+
+    def process_request(self, request, client_address):
+        with self.connections_lock:
+            self.connections += 1
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self.connections_lock:
+                self.connections -= 1
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 保持连接，客户端可以复用同一个连接
+    # 响应头和响应体分两次写入，保持连接时 Nagle 算法与客户端的延迟确认会使每个响应多等约 40 毫秒
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # 等待下一个请求超时后，handle_one_request 结束这个连接
+        self.timeout = self.server.idle_timeout
+        super().setup()
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        if self.server.saturated:
+            # 让出工作线程给排队的连接（send_header 同时设置 close_connection）
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, self.server.service.health())
+        else:
+            self._send(404, {'error': f'未知的接口：{self.path}'})
+
+    def do_POST(self):
+        service = self.server.service
+        endpoints = {
+            '/peaks': lambda r: service.peak_search(r['peaks'], r['tolerance']),
+            '/similarity': lambda r: service.similarity(r['x'], r['y'], r.get('k'), r.get('method', 'index'),
+                                                        r.get('include_spectra', False)),
+            '/process': lambda r: service.process(r['x'], r['y'], r.get('pipeline', []), r.get('k'),
+                                                  r.get('method', 'index')),
+        }
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if self.path not in endpoints:
+            self._send(404, {'error': f'未知的接口：{self.path}'})
+            return
+        try:
+            result = endpoints[self.path](json.loads(body))
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {'error': f'{type(e).__name__}: {e}'})
+            return
+        except Exception as e:
+            self._send(500, {'error': f'{type(e).__name__}: {e}'})
+            return
+        self._send(200, result)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(service, host='127.0.0.1', port=8765, workers=8, idle_timeout=5.0):
+    server = PooledHTTPServer((host, port), RequestHandler, service, workers=workers, idle_timeout=idle_timeout)
+    print(f'鉴定服务已启动：http://{host}:{server.server_port}（{len(service.library)} 条参考光谱）', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class ServerClient:
+    """鉴定服务的客户端，GUI 配置了 'identification server' 时使用"""
+
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _post(self, endpoint, payload):
+        request = urllib.request.Request(self.url + endpoint, data=json.dumps(payload).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise ValueError(json.loads(e.read()).get('error', str(e))) from None
+
+    def health(self):
+        with urllib.request.urlopen(self.url + '/health', timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def peak_search(self, peaks, tolerance):
+        return self._post('/peaks', {'peaks': list(map(float, peaks)), 'tolerance': tolerance})
+
+    def similarity(self, x, y, k=None, method='index', include_spectra=False):
+        return self._post('/similarity', {'x': np.asarray(x).tolist(), 'y': np.asarray(y).tolist(), 'k': k,
+                                          'method': method, 'include_spectra': include_spectra})
+
+    def process(self, x, y, pipeline=(), k=None, method='index'):
+        return self._post('/process', {'x': np.asarray(x).tolist(), 'y': np.asarray(y).tolist(),
+                                       'pipeline': list(pipeline), 'k': k, 'method': method})
+
+
+def benchmark(url, endpoint='/similarity', n_requests=500, concurrency=8, seed=0):
+    """用 concurrency 个保持连接的客户端线程发送 n_requests 个请求，报告吞吐量和延迟分位数"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(100, 1500, 1400)
+    payloads = []
+    for _ in range(min(n_requests, 50)):
+        centres = rng.uniform(200, 1400, 4)
+        y = np.exp(-((x[:, None] - centres) / 6) ** 2).sum(axis=1) + rng.normal(0, 0.01, len(x))
+        if endpoint == '/peaks':
+            payloads.append({'peaks': np.sort(centres)[:2].round(1).tolist(), 'tolerance': 2})
+        else:
+            payloads.append({'x': x.tolist(), 'y': y.tolist(), 'k': 10,
+                             'pipeline': [{'stage': 'smooth'}, {'stage': 'peaks', 'prominence': 0.5}]})
+    bodies = [json.dumps(payload).encode() for payload in payloads]
+
+    parts = urlsplit(url)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(n_requests))
+
+    def client():
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+        local = []
+        for i in counter:
+            start = time.perf_counter()
+            connection.request('POST', endpoint, body=bodies[i % len(bodies)],
+                               headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            local.append(time.perf_counter() - start)
+            if response.status != 200:
+                with lock:
+                    errors.append(response.status)
+        connection.close()
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    print(f'{endpoint}：{len(latencies)} 个请求，并发 {concurrency}，吞吐量 {len(latencies) / elapsed:.1f} 请求/秒，'
+          f'p50 {np.percentile(latencies, 50):.1f} 毫秒，p99 {np.percentile(latencies, 99):.1f} 毫秒，'
+          f'错误 {len(errors)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地鉴定服务')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help='启动服务')
+    serve_parser.add_argument('database', help='SQLite 光谱数据库路径')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--workers', type=int, default=8)
+    serve_parser.add_argument('--idle-timeout', type=float, default=5.0, help='空闲的保持连接在多少秒后关闭')
+    bench_parser = subparsers.add_parser('bench', help='测量服务的吞吐量和延迟')
+    bench_parser.add_argument('--url', default='http://127.0.0.1:8765')
+    bench_parser.add_argument('--endpoint', default='/similarity', choices=['/peaks', '/similarity', '/process'])
+    bench_parser.add_argument('--requests', type=int, default=500)
+    bench_parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        with open('config.json', 'r') as f:
+            config = json.load(f)
+        start = time.perf_counter()
+        service = IdentificationService(args.database, config)
+        print(f'参考光谱库和索引加载完成，用时 {time.perf_counter() - start:.2f} 秒', flush=True)
+        serve(service, args.host, args.port, args.workers, args.idle_timeout)
+    else:
+        benchmark(args.url, args.endpoint, args.requests, args.concurrency)
@@ -0,0 +1,111 @@
+"""平滑引擎：在每个连续的有效（非 NaN）区间内分别平滑，保持数组的长度和 NaN 的位置不变
+
+裁剪排除的区间（valid 为 False）和 NaN 都不会被当作连续数据跨过，排除区间内的值原样保留。支持三种平滑核：
+- 'savgol'：Savitzky-Golay 多项式平滑（window_length, polyorder）
+- 'whittaker'：Whittaker 平滑器，惩罚二阶差分（lam），预先对带状矩阵做 Cholesky 分解
+- 'median'：滑动中值（window_length），适合去除孤立的尖峰
+
+y 可以是单条光谱 (n_points,) 或批量光谱 (n_spectra, n_points)。NaN 位置相同的光谱分为一组，
+每组的每个区间只需一次向量化计算。
+"""
+
+from functools import lru_cache
+
+import numpy as np
+from scipy.linalg import cho_solve_banded, cholesky_banded
+from scipy.ndimage import correlate1d, median_filter
+from scipy.signal import savgol_coeffs, savgol_filter
+from scipy.sparse import diags
+
+SMOOTHING_METHODS = ('savgol', 'whittaker', 'median')
+
+
+def valid_segments(valid):
+    """返回布尔数组中连续 True 区间的 [(start, stop), ...]"""
+    edges = np.diff(np.concatenate([[0], valid.astype(np.int8), [0]]))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def difference_bands(n_points, lam):
+    """lam * D D^T（D 为二阶差分矩阵）的上三角带状存储，每行对应一条对角线"""
+    D = diags([1., -2., 1.], [0, -1, -2], shape=(n_points, n_points - 2))
+    penalty = (lam * D.dot(D.transpose())).todia()
+    bands = np.zeros((3, n_points))
+    # solveh_banded 的上三角形式：bands[2 - k, j] = A[j - k, j]
+    for k in range(3):
+        bands[2 - k, k:] = penalty.diagonal(k)
+    return bands
+
+
+@lru_cache(maxsize=32)
+def _whittaker_factor(n_points, lam):
+    """(I + lam D D^T) 的带状 Cholesky 分解，按 (长度, lam) 缓存"""
+    bands = difference_bands(n_points, lam)
+    bands[2] += 1
+    return cholesky_banded(bands)
+
+
+@lru_cache(maxsize=32)
+def _savgol_kernel(window, order):
+    """Savitzky-Golay 的卷积系数和两端的拟合矩阵，按 (窗口, 阶数) 缓存
+
+    两端各 window // 2 个点与 savgol_filter(mode='interp') 相同：用首/尾一个窗口的多项式拟合值代替。
+    """
+    half = window // 2
+    fit = np.vander(np.arange(window, dtype=float), order + 1)
+    projection = fit @ np.linalg.pinv(fit)
+    return savgol_coeffs(window, order, use='dot'), projection[:half], projection[window - half:]
+
+
+def _savgol(y, window, order):
+    coeffs, head, tail = _savgol_kernel(window, order)
+    half = window // 2
+    # 中间部分直接卷积，两端的边界模式无关紧要，随后被拟合值覆盖
+    out = correlate1d(y, coeffs, axis=-1, mode='nearest')
+    out[:, :half] = y[:, :window] @ head.T
+    out[:, y.shape[1] - half:] = y[:, -window:] @ tail.T
+    return out
+
+
+def _smooth_segment(y, method, window_length, polyorder, lam):
+    """平滑一个不含 NaN 的区间，y 的形状为 (n_spectra, n_points)"""
+    n_points = y.shape[-1]
+    if method == 'whittaker':
+        if n_points < 3:
+            return y
+        return cho_solve_banded((_whittaker_factor(n_points, float(lam)), False), y.T).T
+    # 区间比窗口短时缩小窗口（保持奇数）
+    window = min(window_length, n_points if n_points % 2 else n_points - 1)
+    if method == 'median':
+        return median_filter(y, size=(1, window), mode='nearest') if window > 1 else y
+    order = min(polyorder, window - 1)
+    if window <= order or window < 2:
+        return y
+    if window % 2 == 0:
+        # 偶数窗口没有中心点，交给 savgol_filter
+        return savgol_filter(y, window, order, axis=-1)
+    return _savgol(y, window, order)
+
+
+def smooth(y, method='savgol', window_length=11, polyorder=3, lam=100.0, valid=None):
+    """按 `method` 平滑单条或批量光谱，返回与 y 形状相同的新数组，NaN 保持原位
+
+    valid 为沿波数轴的布尔数组（所有光谱共用），False 的位置不参与平滑且保持原值。
+    """
+    if method not in SMOOTHING_METHODS:
+        raise ValueError(f'未知的平滑方法：{method}')
+    y = np.asarray(y, dtype=float)
+    rows = np.atleast_2d(y)
+    out = rows.copy()
+    valid = ~np.isnan(rows) if valid is None else ~np.isnan(rows) & valid
+    # NaN 位置相同的光谱一起处理（通常所有光谱的 NaN 位置都相同，无需分组）
+    if (valid == valid[0]).all():
+        patterns, groups = valid[:1], np.zeros(len(rows), dtype=int)
+    else:
+        patterns, groups = np.unique(valid, axis=0, return_inverse=True)
+    for g, pattern in enumerate(patterns):
+        members = np.flatnonzero(groups.ravel() == g)
+        for start, stop in valid_segments(pattern):
+            out[members, start:stop] = _smooth_segment(rows[members, start:stop], method,
+                                                       window_length, polyorder, lam)
+    return out.reshape(y.shape)
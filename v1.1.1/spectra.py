@@ -1,39 +1,162 @@
 """Helper classes for handling and representing Raman spectra"""
 
+import argparse
+
 import numpy as np
 
+from pipeline import SmoothStage
+
+
+def readonly(array):
+    """Return a read-only float view of `array` (no copy if it is already float)"""
+    view = np.asarray(array, dtype=float).view()
+    view.flags.writeable = False
+    return view
+
+
+def merge_intervals(intervals):
+    """Union of closed (start, end) intervals as a sorted tuple of non-overlapping intervals"""
+    merged = []
+    for start, end in sorted((float(min(a, b)), float(max(a, b))) for a, b in intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return tuple(merged)
+
+
 class Spectrum:
-    def __init__(self, x, y):
-        self.x = np.array(x)
-        self.y = np.array(y)
-        self._history = [(x.copy(), y.copy())]
-        self._current = 0
+    """A compact, immutable spectrum shared by the GUI commands and batch code.
+
+    `x` and `y` are read-only arrays. Operations never modify a spectrum in place;
+    they return a new Spectrum that shares every buffer whose data did not change
+    (copy-on-write), or the spectrum itself when the operation is a no-op.
+
+    Cropped regions are recorded in `excluded`, a union of closed x intervals, instead
+    of being overwritten with NaN: y keeps its values there, processing stages skip the
+    excluded points through the `valid` mask, and un-cropping only restores the intervals.
+    """
+    __slots__ = ('x', 'y', 'excluded', '_valid')
+
+    def __init__(self, x, y, excluded=()):
+        self.x = readonly(x)
+        self.y = readonly(y)
+        self.excluded = merge_intervals(excluded)
+        self._valid = None
+
+    def __iter__(self):
+        return iter((self.x, self.y))
+
+    def __len__(self):
+        return len(self.x)
+
+    def copy(self):
+        """Spectra are immutable, so a copy can share both buffers"""
+        return self
+
+    def with_y(self, y):
+        """New spectrum with the same x buffer, the same excluded intervals and new intensities"""
+        return Spectrum(self.x, y, self.excluded)
+
+    def with_excluded(self, excluded):
+        """New spectrum sharing x and y with the given excluded intervals"""
+        return Spectrum(self.x, self.y, excluded)
 
-    def correct_baseline(self, baseline):
-        self.y -= baseline
-        self._add_to_history()
+    @property
+    def valid(self):
+        """Read-only mask of the points outside every excluded interval (None if nothing is excluded)"""
+        if not self.excluded:
+            return None
+        if self._valid is None:
+            valid = np.ones(len(self.x), dtype=bool)
+            for start, end in self.excluded:
+                valid &= (self.x < start) | (self.x > end)
+            valid.flags.writeable = False
+            self._valid = valid
+        return self._valid
+
+    def n_valid(self):
+        """Number of finite points outside the excluded intervals"""
+        finite = ~np.isnan(self.y)
+        if self.valid is not None:
+            finite &= self.valid
+        return int(np.count_nonzero(finite))
+
+    def masked_y(self):
+        """y with NaN in the excluded intervals, for plotting and NaN-aware consumers"""
+        if self.valid is None:
+            return self.y
+        return np.where(self.valid, self.y, np.nan)
+
+    def valid_points(self):
+        """(x, y) of the points outside the excluded intervals"""
+        if self.valid is None:
+            return self.x, self.y
+        return self.x[self.valid], self.y[self.valid]
 
     def crop(self, start, end):
-        mask = (self.x >= start) & (self.x <= end)
-        self.x = self.x[mask]
-        self.y = self.y[mask]
-        self._add_to_history()
-    
-    def undo(self):
-        if self._current > 0:
-            self._current -= 1
-            self._restore()
-
-    def redo(self):
-        if self._current < len(self._history) - 1:
-            self._current += 1
-            self._restore()
-
-    def _add_to_history(self):
-        # Remove any redo data beyond the current pointer
-        self._history = self._history[:self._current+1]
-        self._history.append((self.x.copy(), self.y.copy()))
-        self._current = len(self._history) - 1
-
-    def _restore(self):
-        self.x, self.y = self._history[self._current]
\ No newline at end of file
+        """Exclude the region start <= x <= end; x and y are shared, not copied"""
+        if not ((self.x >= min(start, end)) & (self.x <= max(start, end))).any():
+            return self
+        return self.with_excluded(self.excluded + ((start, end),))
+
+    def subtract(self, baseline):
+        if baseline is None:
+            return self
+        return self.with_y(self.y - baseline)
+
+    def add(self, baseline):
+        if baseline is None:
+            return self
+        return self.with_y(self.y + baseline)
+
+    def apply(self, stage):
+        """Run a pipeline stage that transforms x/y (e.g. smooth) on this spectrum"""
+        state = stage.run({'x': self.x, 'y': self.y, 'valid': self.valid})
+        if state['x'] is self.x and state['y'] is self.y:
+            return self
+        return Spectrum(state['x'], state['y'], self.excluded)
+
+    def smooth(self, method='savgol', window_length=11, polyorder=3, lam=100.0):
+        """Smooth each contiguous valid segment; x and the excluded intervals are unchanged"""
+        return self.apply(SmoothStage(method=method, window_length=window_length, polyorder=polyorder, lam=lam))
+
+
+def benchmark(n_points=100000, repeat=20):
+    """Measure peak bytes allocated per crop/baseline/smooth step, compared with full copies"""
+    # Only the benchmark needs these
+    import tracemalloc
+    from scipy.signal import savgol_filter
+
+    x = np.linspace(100, 1500, n_points)
+    spectrum = Spectrum(x, np.sin(x / 50) + x / 1000)
+    baseline = x / 1000
+
+    def measure(step):
+        tracemalloc.start()
+        for _ in range(repeat):
+            step()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    steps = {
+        'crop (empty region)': (lambda: spectrum.crop(0, 50),
+                                lambda: (x.copy(), spectrum.y.copy())),
+        'crop': (lambda: spectrum.crop(300, 400).valid,
+                 lambda: (x.copy(), spectrum.y.copy(), spectrum.y.copy())),
+        'baseline': (lambda: spectrum.subtract(baseline),
+                     lambda: (x.copy(), spectrum.y.copy(), x.copy(), spectrum.y - baseline)),
+        'smooth': (lambda: spectrum.smooth(),
+                   lambda: (x.copy(), spectrum.y.copy(), savgol_filter(spectrum.y, 11, 3))),
+    }
+    for name, (cow, full_copy) in steps.items():
+        print(f'{name:20s} copy-on-write: {measure(cow) / 1e6:6.2f} MB   full copies: {measure(full_copy) / 1e6:6.2f} MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Peak allocations of copy-on-write spectrum operations')
+    parser.add_argument('--points', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    benchmark(args.points, args.repeat)
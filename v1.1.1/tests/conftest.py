@@ -0,0 +1,6 @@
+"""测试直接导入 v1.1.1 下的模块（与 gui.py 的运行方式相同）"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
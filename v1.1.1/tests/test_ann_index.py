@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from ann_index import SpectralIndex, exact_scores, index_path_for, load_or_build_index, search_library
+from library import SpectralLibrary
+
+
+def make_library(n_spectra=300, n_points=200, seed=0, grid=None):
+    rng = np.random.default_rng(seed)
+    grid = np.linspace(100, 1500, n_points) if grid is None else grid
+    centres = rng.uniform(150, 1450, (n_spectra, 3))
+    matrix = np.exp(-((grid[None, None, :] - centres[:, :, None]) / 20) ** 2).sum(axis=1)
+    matrix += rng.uniform(0, 0.05, matrix.shape)
+    filenames = [f'ref{i}.txt' for i in range(n_spectra)]
+    return SpectralLibrary(filenames, filenames, grid, matrix)
+
+
+def test_exact_scores_match_corrcoef():
+    library = make_library(50)
+    y = library.matrix[7] + np.random.default_rng(1).normal(0, 0.01, library.matrix.shape[1])
+    expected = [np.corrcoef(row, y)[0, 1] for row in library.matrix]
+    # 归一化在 float32 中计算
+    np.testing.assert_allclose(exact_scores(library, y), expected, atol=1e-5)
+
+
+def test_search_probing_every_list_matches_brute_force():
+    library = make_library()
+    index = SpectralIndex.build(library, n_components=16)
+    y = library.matrix[42] + np.random.default_rng(2).normal(0, 0.01, library.matrix.shape[1])
+    matches, scores = search_library(index, library, y, k=10, n_candidates=len(library), n_probe=index.n_lists)
+    expected = np.argsort(exact_scores(library, y))[::-1][:10]
+    np.testing.assert_array_equal(matches, expected)
+    assert matches[0] == 42
+
+
+def test_build_rejects_empty_library():
+    library = SpectralLibrary([], [], np.linspace(100, 1500, 10), np.empty((0, 10)))
+    with pytest.raises(ValueError):
+        SpectralIndex.build(library)
+
+
+def test_index_rebuilt_when_grid_or_components_change(tmp_path):
+    database = tmp_path / 'library.db'
+    database.write_bytes(b'database')
+    library = make_library(100)
+    first = load_or_build_index(library, database, n_components=8)
+    assert index_path_for(database).exists()
+    assert load_or_build_index(library, database, n_components=8).version == first.version
+
+    finer = make_library(100, n_points=300)
+    rebuilt = load_or_build_index(finer, database, n_components=8)
+    assert rebuilt.components.shape[1] == 300
+    assert load_or_build_index(finer, database, n_components=4).components.shape[0] == 4
+
+
+@pytest.mark.parametrize('cropped', [slice(0, 100), slice(60, 140), slice(150, 200)])
+def test_cropped_query_is_ranked_by_its_measured_points(cropped):
+    library = make_library()
+    index = SpectralIndex.build(library, n_components=16)
+    y = library.matrix[42] + np.random.default_rng(3).normal(0, 0.01, library.matrix.shape[1])
+    y[cropped] = np.nan
+    keep = np.isfinite(y)
+    expected = [np.corrcoef(row[keep], y[keep])[0, 1] for row in library.matrix]
+    np.testing.assert_allclose(exact_scores(library, y), expected, atol=1e-5)
+    matches, scores = search_library(index, library, y, k=5, n_candidates=30, n_probe=4)
+    assert matches[0] == 42 and scores[0] > 0.99
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from scipy.signal import savgol_filter
+
+from batch import baseline_als_batch, get_peaks_batch, smooth_batch
+from utils import baseline_als, get_peaks
+
+
+def make_batch(n_spectra=6, n_points=400, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(100, 1500, n_points)
+    centres = rng.uniform(200, 1400, (n_spectra, 4))
+    y = (np.exp(-((x[None, None, :] - centres[:, :, None]) / 8) ** 2).sum(axis=1) +
+         rng.uniform(0.5, 2, (n_spectra, 1)) * (x / 1500) ** 2 + rng.normal(0, 0.02, (n_spectra, n_points)))
+    return x, y
+
+
+def test_baseline_matches_scalar_without_nan():
+    _, y = make_batch()
+    expected = np.array([baseline_als(row, lam=1e4, p=0.05, niter=50) for row in y])
+    np.testing.assert_allclose(baseline_als_batch(y, lam=1e4, p=0.05, niter=50), expected, atol=1e-8)
+
+
+def test_baseline_treats_nan_as_zero_weight():
+    """只在一条光谱中为 NaN 的点留在原位置、权重为 0，与同一位置 valid 为 False 的结果相同（不同于 baseline_als）"""
+    _, y = make_batch(2)
+    y[0, 150:170] = np.nan
+    row = y[0]
+    result = baseline_als_batch(y, lam=1e4, niter=50)[0]
+    excluded = np.ones(len(row), dtype=bool)
+    excluded[150:170] = False
+    reference = baseline_als_batch(np.nan_to_num(row), lam=1e4, niter=50, valid=excluded)[0]
+    assert np.isnan(result[150:170]).all()
+    np.testing.assert_allclose(result[excluded], reference[excluded], atol=1e-10)
+    # baseline_als 删去 NaN 点，两侧的点直接相邻，结果不同
+    assert not np.allclose(result[excluded], baseline_als(row, lam=1e4, niter=50)[excluded])
+
+
+def test_baseline_drops_columns_that_are_nan_everywhere():
+    _, y = make_batch()
+    y[:, :10] = np.nan
+    result = baseline_als_batch(y, lam=1e4, niter=50)
+    assert np.isnan(result[:, :10]).all()
+    np.testing.assert_allclose(result[:, 10:], baseline_als_batch(y[:, 10:], lam=1e4, niter=50), atol=1e-10)
+    np.testing.assert_allclose(result[2], baseline_als(y[2], lam=1e4, niter=50), atol=1e-8, equal_nan=True)
+    # 单条光谱的 NaN 列也是所有光谱都为 NaN 的列，结果与 baseline_als 相同
+    row = y[0].copy()
+    row[150:170] = np.nan
+    np.testing.assert_allclose(baseline_als_batch(row, lam=1e4, niter=50)[0], baseline_als(row, lam=1e4, niter=50),
+                               atol=1e-8, equal_nan=True)
+
+
+def test_smooth_matches_savgol_filter():
+    x, y = make_batch()
+    _, smoothed = smooth_batch(x, y, window_length=11, polyorder=3)
+    np.testing.assert_allclose(smoothed, savgol_filter(y, 11, 3, axis=1), atol=1e-12)
+
+
+@pytest.mark.parametrize('height, prominence', [(None, None), (0.5, None), (None, 0.3), (1.0, 0.5)])
+def test_peaks_match_scalar(height, prominence):
+    x, y = make_batch()
+    y[3] = 0.01 * np.random.default_rng(5).normal(size=y.shape[1])  # 只有噪声的光谱
+    for (peaks_x, peaks_y), row in zip(get_peaks_batch(x, y, height=height, prominence=prominence), y):
+        expected_x, expected_y = get_peaks(x, row, None, 0.5, height, prominence)
+        np.testing.assert_array_equal(peaks_x, expected_x)
+        np.testing.assert_array_equal(peaks_y, expected_y)
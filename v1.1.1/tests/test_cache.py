@@ -0,0 +1,60 @@
+import itertools
+import json
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+import cache
+from cache import SimilarityCache, cache_key
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """每次调用 time.time 都前进一步，使使用时间的顺序确定"""
+    counter = itertools.count()
+    monkeypatch.setattr(cache.time, 'time', lambda: float(next(counter)))
+
+
+def test_key_depends_on_every_part():
+    x, y = np.linspace(100, 1500, 50), np.arange(50.0)
+    key = cache_key(x, y, 'v1', 'index', {'k': 5})
+    assert key == cache_key(list(x), y.astype(np.float32).astype(float), 'v1', 'index', {'k': 5})
+    changed = y.copy()
+    changed[3] += 1e-9
+    for other in (cache_key(x, changed, 'v1', 'index', {'k': 5}), cache_key(x, y, 'v2', 'index', {'k': 5}),
+                  cache_key(x, y, 'v1', 'xcorr', {'k': 5}), cache_key(x, y, 'v1', 'index', {'k': 6})):
+        assert other != key
+
+
+def test_eviction_matches_lru_reference(tmp_path):
+    """随机的 get / put 序列下，缓存内容与 OrderedDict 实现的 LRU 参考模型相同"""
+    rng = np.random.default_rng(0)
+    max_bytes = 400
+    store = SimilarityCache(tmp_path / 'cache.db', max_bytes=max_bytes)
+    reference = OrderedDict()
+    for _ in range(300):
+        key = f'k{rng.integers(12)}'
+        if rng.random() < 0.4:
+            expected = reference.get(key)
+            if expected is not None:
+                reference.move_to_end(key)
+            assert store.get(key) == (None if expected is None else expected[0])
+            continue
+        results = [['ref.txt', 'M', float(v)] for v in rng.random(rng.integers(1, 4))]
+        reference.pop(key, None)
+        reference[key] = (results, len(json.dumps(results, ensure_ascii=False).encode()))
+        total = sum(size for _, size in reference.values())
+        while total > max_bytes:
+            total -= reference.popitem(last=False)[1][1]
+        store.put(key, results)
+        assert store.stats() == (len(reference), sum(size for _, size in reference.values()))
+    for key, (results, _) in list(reference.items()):
+        assert store.get(key) == results
+
+
+def test_results_persist_across_instances(tmp_path):
+    path = tmp_path / 'cache.db'
+    SimilarityCache(path).put('key', [['石英.txt', '石英', 0.98]])
+    assert SimilarityCache(path).get('key') == [['石英.txt', '石英', 0.98]]
+    assert SimilarityCache(path).get('other') is None
@@ -0,0 +1,116 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from commands import Command, CommandHistory, CompressedArray, EstimateBaselineCommand
+
+
+class Target:
+    value = None
+
+
+class SetValueCommand(Command):
+    """把 target.value 从 old 换成 new 的最小命令"""
+    _stored = ('old', 'new')
+
+    def __init__(self, target, new):
+        self.target = target
+        self.old = target.value
+        self.new = new
+
+    def execute(self):
+        self.target.value = self._load('new')
+
+    def undo(self):
+        self.target.value = self._load('old')
+
+
+def make_arrays(n, size=1000, seed=0):
+    """可以压缩的数组（重复的随机整数）"""
+    rng = np.random.default_rng(seed)
+    return [np.repeat(rng.integers(0, 5, size // 10), 10).astype(float) for _ in range(n)]
+
+
+def naive_usage(history):
+    """逐个数组按底层缓冲区去重后求和的参考实现"""
+    buffers = {}
+    for command in history.commands:
+        for value in command.stored_arrays():
+            while isinstance(value, np.ndarray) and isinstance(value.base, np.ndarray):
+                value = value.base
+            buffers[id(value)] = value.nbytes
+    return sum(buffers.values())
+
+
+def test_compressed_array_round_trip():
+    array = make_arrays(1)[0].reshape(10, 100)
+    compressed = CompressedArray(array)
+    assert compressed.nbytes < array.nbytes
+    restored = compressed.restore()
+    np.testing.assert_array_equal(restored, array)
+    assert restored.dtype == array.dtype and restored.flags.writeable
+
+
+def test_shared_arrays_and_views_are_counted_once():
+    target = Target()
+    history = CommandHistory()
+    arrays = make_arrays(3)
+    for array in arrays:
+        history.execute(SetValueCommand(target, array))
+    # 每个数组同时是一条命令的 new 和下一条命令的 old
+    assert history.memory_usage() == sum(array.nbytes for array in arrays) == naive_usage(history)
+    history.execute(SetValueCommand(target, arrays[0][100:200]))
+    assert history.memory_usage() == sum(array.nbytes for array in arrays)
+
+
+def test_budget_compresses_oldest_first_then_drops():
+    target = Target()
+    arrays = make_arrays(6)
+    size = arrays[0].nbytes
+    history = CommandHistory(max_bytes=int(3.5 * size))
+    for array in arrays:
+        history.execute(SetValueCommand(target, array))
+        assert history.memory_usage() == naive_usage(history) <= history.max_bytes
+    report = history.memory_report()
+    assert [compressed for _, _, compressed in report][:2] == [True, True] and not report[-1][2]
+    # 共享的数组只压缩一次：前一条命令的 new 和后一条命令的 old 是同一个压缩对象
+    assert history.commands[0].new is history.commands[1].old
+
+    tight = CommandHistory(max_bytes=size)
+    target = Target()
+    for array in arrays:
+        tight.execute(SetValueCommand(target, np.random.default_rng(1).random(len(array))))
+    assert tight.memory_usage() <= size and len(tight.commands) < len(arrays)
+    assert tight.index == len(tight.commands) - 1
+
+
+def test_undo_and_redo_keep_compressed_commands_compressed():
+    target = Target()
+    arrays = make_arrays(5)
+    history = CommandHistory(max_bytes=int(3.5 * arrays[0].nbytes))
+    for array in arrays:
+        history.execute(SetValueCommand(target, array))
+    usage = history.memory_usage()
+    stored = [command.stored_arrays() for command in history.commands]
+    for _ in arrays:
+        history.undo()
+    assert target.value is None
+    for array in arrays:
+        history.redo()
+        np.testing.assert_array_equal(target.value, array)
+        assert history.memory_usage() == usage
+    # 解压缩的数组不写回命令，已压缩的命令仍持有同一个压缩对象
+    for command, values in zip(history.commands, stored):
+        assert all(a is b for a, b in zip(command.stored_arrays(), values))
+    assert isinstance(history.commands[0].new, CompressedArray)
+
+
+def test_estimate_baseline_only_stores_the_new_baseline():
+    app = MagicMock()
+    app.baseline_data = np.zeros(10)
+    command = EstimateBaselineCommand(app, np.ones(10))
+    assert len(command.stored_arrays()) == 1
+    command.execute()
+    np.testing.assert_array_equal(app.baseline_data, np.ones(10))
+    command.undo()
+    assert app.baseline_data is None
@@ -0,0 +1,66 @@
+import numpy as np
+from scipy.ndimage import median_filter
+
+from despike import SHARPNESS, find_spikes, remove_spikes
+
+
+def make_spectra(n_spectra=5, n_points=800, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(100, 1500, n_points)
+    centres = rng.uniform(200, 1400, (n_spectra, 4))
+    y = (5 * np.exp(-((x[None, None, :] - centres[:, :, None]) / 10) ** 2).sum(axis=1) +
+         rng.normal(0, 0.02, (n_spectra, n_points)))
+    return x, y
+
+
+def scalar_spikes(row, threshold=6.0, window_length=11, max_width=2):
+    """单条不含 NaN 的光谱逐步计算的参考实现"""
+    reference = median_filter(row, size=2 * max_width + 1, mode='nearest')
+    narrow = row - reference
+    wide = row - median_filter(row, size=window_length, mode='nearest')
+    centre = np.median(narrow)
+    mad = np.median(np.abs(narrow - centre))
+    z = 0.6745 * (narrow - centre) / mad if mad > 0 else np.zeros_like(row)
+    return (z > threshold) & (narrow > SHARPNESS * wide), reference
+
+
+def test_batch_matches_scalar_reference():
+    _, y = make_spectra()
+    rng = np.random.default_rng(1)
+    columns = rng.integers(0, y.shape[1], (len(y), 3))
+    y[np.arange(len(y))[:, None], columns] += rng.uniform(3, 10, columns.shape)
+    spikes, reference = find_spikes(y)
+    for row, row_spikes, row_reference in zip(y, spikes, reference):
+        expected_spikes, expected_reference = scalar_spikes(row)
+        np.testing.assert_array_equal(row_spikes, expected_spikes)
+        np.testing.assert_allclose(row_reference, expected_reference)
+    single_spikes, _ = find_spikes(y[2])
+    np.testing.assert_array_equal(single_spikes, spikes[2])
+
+
+def test_spikes_are_removed_but_raman_peaks_are_kept():
+    _, y = make_spectra()
+    clean = y.copy()
+    y[0, 100] += 8
+    y[1, 400:402] += [6, 4]
+    cleaned, spikes = remove_spikes(y)
+    assert spikes[0, 100] and spikes[1, 400:402].all()
+    # 拉曼峰顶（宽度约 14 点）不被当作尖峰
+    assert not (spikes & ~np.isin(np.arange(y.shape[1]), [100, 400, 401])[None, :] & (clean > 1)).any()
+    # 替换值在噪声水平之内，被误判的噪声点也只是换成了局部中值
+    assert np.abs(cleaned - clean).max() < 0.2
+    smooth = np.exp(-((np.arange(200) - 80) / 10) ** 2)
+    unchanged, no_spikes = remove_spikes(smooth)
+    assert unchanged is smooth and not no_spikes.any()
+
+
+def test_excluded_points_and_nan_are_never_spikes():
+    _, y = make_spectra(2)
+    y[:, 300] += 10
+    y[:, 500] += 10
+    valid = np.ones(y.shape[1], dtype=bool)
+    valid[290:310] = False
+    y[1, 520:530] = np.nan
+    spikes, _ = find_spikes(y, valid=valid)
+    assert not spikes[:, 290:310].any() and not spikes[1, 520:530].any()
+    assert spikes[:, 500].all()
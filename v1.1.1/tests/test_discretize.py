@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from discretize import reinterpolate
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_local_reinterpolation_matches_full_interp(seed):
+    """随机拖动节点（包括拖到与相邻节点重合、拖动首末节点）后，局部更新的基线与整条重新插值的相同"""
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(80, 1520, 900)  # 无序的光谱横坐标，超出首末节点的点按端点值延伸
+    x[:40] = np.repeat(x[:20], 2)
+    nodes_x = np.arange(100, 1500, 10.0)
+    nodes_y = rng.random(len(nodes_x))
+    x[40:60] = nodes_x[rng.integers(0, len(nodes_x), 20)]  # 恰好落在节点上的点
+    order = np.argsort(x, kind='stable')
+    sorted_x = x[order]
+    baseline = np.interp(x, nodes_x, nodes_y)
+    for _ in range(300):
+        index = int(rng.choice([0, len(nodes_x) - 1, rng.integers(len(nodes_x))]))
+        low = nodes_x[index - 1] if index > 0 else 50.0
+        high = nodes_x[index + 1] if index < len(nodes_x) - 1 else 1550.0
+        # 与拖动时相同：节点不能越过相邻的节点，常常停在相邻节点上
+        nodes_x[index] = rng.choice([low, high, rng.uniform(low, high)])
+        nodes_y[index] = rng.random()
+        points = reinterpolate(baseline, x, order, sorted_x, nodes_x, nodes_y, index)
+        np.testing.assert_array_equal(baseline, np.interp(x, nodes_x, nodes_y))
+        if 0 < index < len(nodes_x) - 1:
+            assert ((x[points] >= nodes_x[index - 1]) & (x[points] <= nodes_x[index + 1])).all()
@@ -0,0 +1,66 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from fingerprint import FingerprintIndex, popcount
+from utils import fetch_filename_and_peaks_filtered, find_spectrum_matches
+
+
+@pytest.fixture
+def database(tmp_path):
+    """多条参考光谱的最强峰落在同一个未知峰的容差范围内（超过任何截断上限）"""
+    rng = np.random.default_rng(0)
+    rows = []
+    for i in range(600):
+        peaks = np.sort(rng.uniform(150, 1450, rng.integers(2, 6))).round(1)
+        if i % 2 == 0:
+            peaks[0] = round(500 + rng.uniform(-1.5, 1.5), 1)
+        strongest = float(peaks[0] if i % 2 == 0 else peaks[-1])
+        rows.append((f'R{i:04d}', f'M{i}', str(peaks.tolist()), strongest))
+    path = tmp_path / 'library.db'
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE Spectra (filename TEXT, names TEXT, peaks TEXT, strongest_peak REAL)")
+    conn.executemany("INSERT INTO Spectra VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_popcount_matches_unpackbits():
+    bits = np.random.default_rng(1).integers(0, 256, (20, 13), dtype=np.uint8)
+    np.testing.assert_array_equal(popcount(bits), np.unpackbits(bits, axis=1).sum(axis=1))
+
+
+@pytest.mark.parametrize('tol', [0.5, 2, 5])
+def test_strongest_within_matches_sql_filter(database, tol):
+    index = FingerprintIndex.from_database(database)
+    peaks = [500.0, 812.3, 1200.0]
+    expected = {filename for filename, _ in fetch_filename_and_peaks_filtered(database, peaks, tol)}
+    assert {index.filenames[i] for i in np.flatnonzero(index.strongest_within(peaks, tol))} == expected
+
+
+def test_uncapped_shortlist_keeps_every_exact_candidate(database):
+    index = FingerprintIndex.from_database(database)
+    peaks, tol = [500.0, 812.3], 2
+    allowed = index.strongest_within(peaks, tol)
+    assert allowed.sum() > 300
+    shortlist = index.shortlist(peaks, tol=tol, allowed=allowed)
+    assert set(shortlist) == set(np.flatnonzero(allowed))
+    # 截断只在显式给出 n_candidates 时发生
+    capped = index.shortlist(peaks, 50, tol=tol, allowed=allowed)
+    assert len(capped) == 50 and set(capped) <= set(shortlist)
+
+
+def test_peak_search_with_fingerprint_rows_matches_database_rows(database):
+    index = FingerprintIndex.from_database(database)
+    conn = sqlite3.connect(database)
+    peaks = [float(p) for p in eval(conn.execute("SELECT peaks FROM Spectra WHERE filename = 'R0001'").fetchone()[0])]
+    conn.close()
+    tol = 2
+    rows = index.rows(index.shortlist(peaks, tol=tol, allowed=index.strongest_within(peaks, tol)))
+    with_fingerprint = find_spectrum_matches(database, peaks, tol, rows=rows)
+    without = find_spectrum_matches(database, peaks, tol)
+    assert ['R0001'] in without[1]
+    for r in (1, 2, 3):
+        assert sorted(map(sorted, with_fingerprint[r])) == sorted(map(sorted, without[r]))
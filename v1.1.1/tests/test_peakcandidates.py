@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+from scipy.signal import find_peaks
+
+from peakcandidates import PeakCandidates, _thresholds, library_peak_count, noise_level, tune
+from peakfit import fit_peaks
+
+
+def make_spectrum(seed=0, n=2000):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(100, 1500, n)
+    centres = rng.uniform(150, 1450, 15)
+    heights = rng.uniform(0.5, 10, 15)
+    y = (heights * np.exp(-((x[:, None] - centres) / 6) ** 2)).sum(axis=1) + rng.normal(0, 0.05, n)
+    return x, y
+
+
+@pytest.mark.parametrize('height', [None, 0.5, (0.5, 5.0)])
+@pytest.mark.parametrize('prominence', [None, 0.1, 1.0, (0.2, 3.0)])
+@pytest.mark.parametrize('width', [None, 2, (3, 40)])
+@pytest.mark.parametrize('rel_height', [0.5, 1.0])
+def test_select_matches_find_peaks(height, prominence, width, rel_height):
+    x, y = make_spectrum()
+    candidates = PeakCandidates(x, y)
+    expected, _ = find_peaks(y, height=height, prominence=prominence, width=width, rel_height=rel_height)
+    np.testing.assert_array_equal(candidates.select(width, rel_height, height, prominence), expected)
+
+
+def test_select_with_excluded_points_matches_segments():
+    x, y = make_spectrum(1)
+    valid = np.ones(len(y), dtype=bool)
+    valid[600:900] = False
+    candidates = PeakCandidates(x, y, valid)
+    expected = np.concatenate([find_peaks(y[:600], prominence=0.3, width=2)[0],
+                               find_peaks(y[900:], prominence=0.3, width=2)[0] + 900])
+    np.testing.assert_array_equal(candidates.select(width=2, prominence=0.3), expected)
+
+
+def test_select_refined_matches_parabolic_fit():
+    x, y = make_spectrum(2)
+    candidates = PeakCandidates(x, y)
+    indices = candidates.select(prominence=0.5)
+    refined = candidates.select_refined(prominence=0.5)
+    fit = fit_peaks(x, y, indices, 'parabolic')
+    for got, expected in zip(refined, fit):
+        np.testing.assert_allclose(got, expected)
+
+
+def test_empty_spectrum_has_no_candidates():
+    candidates = PeakCandidates(np.arange(5.0), np.zeros(5))
+    assert len(candidates) == 0
+    assert len(candidates.select(prominence=1)) == 0
+
+
+@pytest.mark.parametrize('objective, target', [('count', 10), ('noise', None), ('density', 25)])
+def test_tune_parameters_reproduce_count_with_find_peaks(objective, target):
+    x, y = make_spectrum(3)
+    result = tune(PeakCandidates(x, y), objective, target, steps=8)
+    params = {key: value for key, value in result.params.items() if value is not None}
+    assert len(find_peaks(y, **params)[0]) == result.count
+    assert result.n_evaluated == 3 * 8 ** 3
+
+
+def brute_force_tune(x, y, objective, target, noise_factor=5.0, rel_heights=(0.5, 0.75, 1.0), steps=6):
+    """在与 tune 相同的网格上逐个参数组合调用 find_peaks 的参考实现，返回每个组合的 (得分, 显著性之和)"""
+    candidates = PeakCandidates(x, y)
+    sigma = noise_level(y) if target is None else target
+    keys = []
+    for rel_height in rel_heights:
+        for h in _thresholds(candidates.heights, steps, log=False):
+            for p in _thresholds(candidates.prominences, steps, log=True):
+                for w in _thresholds(candidates.widths(rel_height), steps, log=True):
+                    peaks, properties = find_peaks(y, height=None if np.isneginf(h) else h,
+                                                   prominence=(None, None) if np.isneginf(p) else p,
+                                                   width=None if np.isneginf(w) else w, rel_height=rel_height)
+                    prominences = properties['prominences']
+                    if objective == 'noise':
+                        n_significant = (candidates.prominences >= noise_factor * sigma).sum()
+                        hits = (prominences >= noise_factor * sigma).sum()
+                        total = len(peaks) + n_significant
+                        score = 2 * hits / total if total else 1.0
+                    else:
+                        score = -abs(len(peaks) - target)
+                    keys.append((score, prominences.sum()))
+    return keys
+
+
+def strength_of(y, params):
+    params = {key: value for key, value in params.items() if value is not None}
+    _, properties = find_peaks(y, prominence=params.pop('prominence', (None, None)), **params)
+    return properties['prominences'].sum()
+
+
+@pytest.mark.parametrize('objective', ['noise', 'density'])
+def test_tune_matches_brute_force_grid_search(objective):
+    x, y = make_spectrum(6, n=1000)
+    target = None
+    if objective == 'density':
+        rng = np.random.default_rng(7)
+        library = [rng.uniform(50, 1600, rng.integers(5, 30)) for _ in range(40)]
+        target = library_peak_count(library, x.min(), x.max())
+    result = tune(PeakCandidates(x, y), objective, target, steps=6)
+    keys = brute_force_tune(x, y, objective, target)
+    best_score = max(score for score, _ in keys)
+    best_strength = max(strength for score, strength in keys if score == best_score)
+    assert result.score == pytest.approx(best_score)
+    # 得分相同的组合中选出显著性之和最大的
+    assert strength_of(y, result.params) == pytest.approx(best_strength)
+    assert result.n_evaluated == len(keys)
+
+
+def test_tune_breaks_ties_by_total_prominence():
+    """一个窄的强峰和一个宽的弱峰，目标为 1 个峰：按高度或按宽度筛选都只剩一个峰，保留较强的那个"""
+    x = np.linspace(0, 100, 1001)
+    y = 3 * np.exp(-((x - 30) / 1) ** 2) + 1 * np.exp(-((x - 70) / 6) ** 2)
+    keys = brute_force_tune(x, y, 'count', 1)
+    assert len({strength for score, strength in keys if score == 0}) > 1
+    result = tune(PeakCandidates(x, y), 'count', 1, steps=6)
+    params = {key: value for key, value in result.params.items() if value is not None}
+    np.testing.assert_array_equal(find_peaks(y, **params)[0], [300])
+    assert strength_of(y, result.params) == pytest.approx(max(s for score, s in keys if score == 0))
+
+
+def test_tune_count_reaches_target():
+    x, y = make_spectrum(4)
+    assert tune(PeakCandidates(x, y), 'count', 15).count == 15
+
+
+def test_noise_level_estimates_gaussian_noise():
+    rng = np.random.default_rng(5)
+    assert noise_level(rng.normal(0, 0.2, 20000)) == pytest.approx(0.2, rel=0.05)
+
+
+def test_library_peak_count_counts_peaks_in_range():
+    peaks = [np.array([200.0, 300.0, 2000.0]), np.array([150.0, 160.0, 170.0]), np.array([])]
+    assert library_peak_count(peaks, 100, 1500) == 2
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from scipy.signal import find_peaks, peak_widths
+
+from peakcandidates import PeakCandidates
+from peakfit import fit_peaks, parabolic
+
+
+def lorentzian(x, centres, widths, heights):
+    u = 2 * (x[:, None] - np.asarray(centres)) / np.asarray(widths)
+    return (np.asarray(heights) / (1 + u ** 2)).sum(axis=1)
+
+
+def test_parabolic_recovers_vertex_of_sampled_parabolas():
+    x = np.linspace(0, 100, 201)[::-1]  # 降序的 x
+    y = np.zeros_like(x)
+    centres = [20.1, 55.37, 80.8]
+    peaks = []
+    for centre, height in zip(centres, [3, 1, 2]):
+        i = np.argmin(np.abs(x - centre))
+        y[i - 1:i + 2] = height - (x[i - 1:i + 2] - centre) ** 2
+        peaks.append(i)
+    fit = parabolic(x, y, peaks)
+    np.testing.assert_allclose(fit.position, centres, atol=1e-10)
+    np.testing.assert_allclose(fit.height, [3, 1, 2], atol=1e-10)
+
+
+def test_width_matches_peak_widths_in_x_units():
+    x = np.linspace(100, 1500, 1401)
+    y = lorentzian(x, [300, 700, 1200], [8, 12, 20], [1, 2, 3])
+    peaks = find_peaks(y)[0]
+    fit = parabolic(x, y, peaks)
+    np.testing.assert_allclose(fit.width, peak_widths(y, peaks)[0] * (x[1] - x[0]), rtol=1e-10)
+    np.testing.assert_allclose(fit.width, [8, 12, 20], rtol=0.02)
+
+
+@pytest.mark.parametrize('use_nan', [True, False])
+def test_width_is_measured_within_the_peak_segment(use_nan):
+    """排除区间紧邻峰的一侧：宽度只在峰所在的区间内计算，与 PeakCandidates.widths 一致"""
+    x = np.linspace(100, 1500, 1401)
+    y = lorentzian(x, [500, 900], [30, 10], [2, 1]) - 0.5
+    gap = (x > 520) & (x < 600)
+    valid = None
+    if use_nan:
+        y[gap] = np.nan
+    else:
+        valid = ~gap
+    peaks = np.array([400, 800])
+    fit = parabolic(x, y, peaks, valid)
+    stop = np.argmax(gap)
+    expected = peak_widths(y[:stop], [400])[0][0]
+    assert fit.width[0] == pytest.approx(expected * (x[1] - x[0]))
+    candidates = PeakCandidates(x, y, valid)
+    np.testing.assert_allclose(candidates.refined.width, candidates.widths(0.5) * (x[1] - x[0]), rtol=1e-10)
+
+
+def test_joint_fit_separates_overlapping_peaks():
+    x = np.linspace(100, 1500, 1401)
+    centres = [600, 609, 1100]
+    y = lorentzian(x, centres, [8, 8, 10], [3, 2, 1])
+    peaks = find_peaks(y, prominence=0.1)[0]
+    assert len(peaks) == 3
+    for profile in ('lorentzian', 'voigt'):
+        fit = fit_peaks(x, y, peaks, profile)
+        np.testing.assert_allclose(fit.position, centres, atol=0.05)
+    assert np.abs(parabolic(x, y, peaks).position[:2] - centres[:2]).max() > 0.1
+    with pytest.raises(ValueError):
+        fit_peaks(x, y, peaks, 'gauss')
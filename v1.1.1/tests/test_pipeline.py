@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from scipy.signal import find_peaks, savgol_filter
+
+from pipeline import BaselineStage, PeaksStage, Pipeline, masked_y
+from utils import baseline_als, get_peaks
+
+SPECS = [{'stage': 'smooth', 'window_length': 11, 'polyorder': 3},
+         {'stage': 'baseline', 'lam': 1e4, 'p': 0.05, 'niter': 50},
+         {'stage': 'peaks', 'height': 0.3, 'prominence': 0.2}]
+
+
+def make_spectra(n_spectra=4, n_points=500, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(100, 1500, n_points)
+    centres = rng.uniform(200, 1400, (n_spectra, 5))
+    y = (np.exp(-((x[None, None, :] - centres[:, :, None]) / 8) ** 2).sum(axis=1) +
+         (x / 1500) ** 2 + rng.normal(0, 0.01, (n_spectra, n_points)))
+    return x, y
+
+
+def scalar(x, row):
+    """逐步调用标量函数的参考实现"""
+    smoothed = savgol_filter(row, 11, 3)
+    corrected = smoothed - baseline_als(smoothed, lam=1e4, p=0.05, niter=50)
+    return corrected, get_peaks(x, corrected, None, 0.5, 0.3, 0.2)
+
+
+def test_single_and_batch_match_scalar_functions():
+    x, y = make_spectra()
+    pipeline = Pipeline.from_list(SPECS)
+    batch = Pipeline.from_list(SPECS).run(x, y)
+    for row, y_batch, (peaks_x, peaks_y) in zip(y, batch['y'], batch['peaks']):
+        expected_y, (expected_x, expected_peaks_y) = scalar(x, row)
+        single = pipeline.run(x, row)
+        np.testing.assert_allclose(single['y'], expected_y, atol=1e-8)
+        np.testing.assert_allclose(y_batch, expected_y, atol=1e-8)
+        np.testing.assert_array_equal(single['peaks'][0], expected_x)
+        np.testing.assert_array_equal(peaks_x, expected_x)
+        np.testing.assert_allclose(peaks_y, expected_peaks_y, atol=1e-8)
+
+
+def test_crop_excludes_interval_from_peaks():
+    x, y = make_spectra(1)
+    row = y[0]
+    result = Pipeline.from_list([{'stage': 'crop', 'start': 600, 'end': 800}, SPECS[2]]).run(x, row)
+    valid = (x < 600) | (x > 800)
+    np.testing.assert_array_equal(result['valid'], valid)
+    np.testing.assert_array_equal(result['y'], row)
+    assert np.isnan(masked_y(result)[~valid]).all()
+    expected = np.concatenate([find_peaks(row[start:stop], height=0.3, prominence=0.2)[0] + start
+                               for start, stop in [(0, np.argmin(valid)), (np.flatnonzero(x > 800)[0], len(x))]])
+    np.testing.assert_array_equal(result['peaks'][0], x[expected])
+
+
+@pytest.mark.filterwarnings('ignore:some peaks have a width of 0')
+@pytest.mark.parametrize('rel_height', [0, 0.25, 1, 1.5])
+def test_any_non_negative_rel_height_is_passed_to_find_peaks(rel_height):
+    x, y = make_spectra(1)
+    stage = PeaksStage(width=3, rel_height=rel_height)
+    peaks = find_peaks(y[0], width=3, rel_height=rel_height)[0]
+    np.testing.assert_array_equal(stage.find(x, y[0])[0], x[peaks])
+
+
+@pytest.mark.parametrize('params', [{'rel_height': -0.1}, {'rel_height': 'a'}, {'refine': 'gauss'}, {'size': 3}])
+def test_invalid_peak_parameters_are_rejected(params):
+    with pytest.raises(ValueError):
+        PeaksStage(**params)
+
+
+def test_unchanged_stages_are_reused_and_json_round_trips():
+    x, y = make_spectra()
+    pipeline = Pipeline.from_list(SPECS)
+    first = pipeline.run(x, y)
+    pipeline.stages[-1] = PeaksStage(height=0.5)
+    second = pipeline.run(x, y)
+    assert second['baseline'] is first['baseline']
+    assert Pipeline.from_json(pipeline.to_json()).to_list() == pipeline.to_list()
+    with pytest.raises(ValueError):
+        BaselineStage(p=1)
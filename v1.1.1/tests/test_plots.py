@@ -0,0 +1,135 @@
+"""plot1 的常驻图形项、曲线的绘制设置和峰值标签布局（在 QT_QPA_PLATFORM=offscreen 下运行，不需要显示器）"""
+
+import json
+import os
+from pathlib import Path
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+import pyqtgraph as pg
+import pytest
+from PyQt6.QtGui import QTransform
+from PyQt6.QtWidgets import QApplication
+
+from plots import PeakLabelLayer, curve_pen, set_curve
+
+SETTINGS = {'plot downsampling': True, 'plot clip to view': True, 'plot pen width': 3, 'plot thin pen points': 1000}
+
+
+@pytest.fixture(scope='module')
+def qapp():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def window(qapp, tmp_path, monkeypatch):
+    """在临时目录中创建主窗口，配置与仓库相同（不使用相似度缓存）"""
+    import gui
+    config = json.loads((Path(gui.__file__).parent / 'config.json').read_text(encoding='utf-8'))
+    config['similarity cache path'] = ''
+    (tmp_path / 'config.json').write_text(json.dumps(config), encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    window = gui.MainApp()
+    window.unknown_spectrum_path = tmp_path / 'spectrum.txt'
+    yield window
+    window.close()
+
+
+def shown_curve(item):
+    x, y = item.getOriginalDataset()
+    return (np.empty(0), np.empty(0)) if x is None else (x, y)
+
+
+def test_curves_follow_undo_and_redo(window, qapp):
+    from commands import LoadSpectrumCommand
+    x = np.linspace(100, 1500, 500)
+    first, second = np.sin(x / 50), np.cos(x / 80)
+    items = list(window.plot1.plotItem.items)
+    refreshes = []
+    refresh = window.refresh_plot1
+    window.refresh_plot1 = lambda: (refreshes.append(1), refresh())
+
+    window.command_history.execute(LoadSpectrumCommand(window, x, first))
+    window.command_history.execute(LoadSpectrumCommand(window, x, second))
+    qapp.processEvents()
+    assert len(refreshes) == 1  # 同一轮事件循环中的请求合并为一次重绘
+    np.testing.assert_array_equal(shown_curve(window.spectrum_plot)[1], second)
+
+    history = window.command_history
+    for step, expected in ((history.undo, first), (history.undo, None), (history.redo, first),
+                           (history.redo, second)):
+        step()
+        qapp.processEvents()
+        _, y = shown_curve(window.spectrum_plot)
+        if expected is None:
+            assert window.spectrum is None and len(y) == 0
+        else:
+            np.testing.assert_array_equal(y, expected)
+        # 图形项一直保留，只更新数据
+        assert list(window.plot1.plotItem.items) == items
+    assert len(refreshes) == 5
+
+
+@pytest.mark.parametrize('clip', [True, False])
+def test_descending_curves_are_drawn_ascending(qapp, clip):
+    x = np.linspace(1500, 100, 300)
+    y = np.sin(x / 40)
+    settings = dict(SETTINGS, **{'plot clip to view': clip})
+    item = pg.PlotDataItem()
+    set_curve(item, x, y, 'k', settings)
+    shown_x, shown_y = item.getOriginalDataset()
+    if clip:
+        # 裁剪到视图要求 x 升序：降序的数据反转为视图，乱序的数据排序
+        np.testing.assert_array_equal(shown_x, x[::-1])
+        np.testing.assert_array_equal(shown_y, y[::-1])
+        assert np.shares_memory(shown_x, x)
+        shuffled = np.random.default_rng(0).permutation(len(x))
+        set_curve(item, x[shuffled], y[shuffled], 'k', settings)
+        shown_x, shown_y = item.getOriginalDataset()
+        np.testing.assert_array_equal(shown_x, x[::-1])
+        np.testing.assert_array_equal(shown_y, y[::-1])
+    else:
+        np.testing.assert_array_equal(shown_x, x)
+    set_curve(item, None, None, 'k', settings)
+    assert len(shown_curve(item)[0]) == 0
+
+
+def test_pen_is_thin_above_threshold(qapp):
+    assert curve_pen('k', 1000, SETTINGS).width() == 3
+    assert curve_pen('k', 1001, SETTINGS).width() == 1
+    assert curve_pen('k', 10 ** 6, dict(SETTINGS, **{'plot thin pen points': 0})).width() == 3
+
+
+def label_boxes(layer, transform):
+    """每个标签在屏幕上的 (左, 右, 上, 下)"""
+    px = transform.m11() * layer.x + transform.m21() * layer.y + transform.dx()
+    py = transform.m12() * layer.x + transform.m22() * layer.y + transform.dy()
+    return np.column_stack([px, px + layer.sizes[:, 1], py - layer.sizes[:, 0], py])
+
+
+def overlaps(a, b):
+    return a[0] < b[1] and a[1] > b[0] and a[2] < b[3] and a[3] > b[2]
+
+
+@pytest.mark.parametrize('view', [(300, 1300), (700, 900)])
+def test_visible_labels_never_overlap(qapp, view):
+    rng = np.random.default_rng(0)
+    layer = PeakLabelLayer()
+    layer.setData(np.sort(rng.uniform(100, 1500, 400)), rng.uniform(0, 10, 400))
+    width, height = 800, 400
+    # 数据坐标 view × [0, 12] 映射到 800 × 400 像素（y 轴向上）
+    scale = width / (view[1] - view[0])
+    transform = QTransform(scale, 0, 0, -height / 12, -view[0] * scale, height)
+    shown = layer.layout(transform, width, height)
+    boxes = label_boxes(layer, transform)
+    visible = (boxes[:, 1] >= 0) & (boxes[:, 0] <= width) & (boxes[:, 3] >= 0) & (boxes[:, 2] <= height)
+    assert 0 < len(shown) < visible.sum()
+    for n, i in enumerate(shown):
+        assert visible[i]
+        assert not any(overlaps(boxes[i], boxes[j]) for j in shown[:n])
+    # 没有显示的可见标签都与一个不低于它的已显示标签重叠（较高的峰优先）
+    for i in np.flatnonzero(visible):
+        if i not in shown:
+            assert any(overlaps(boxes[i], boxes[j]) and layer.y[j] >= layer.y[i] for j in shown)
+    assert layer.layout(transform, width, height) is shown  # 变换不变时使用缓存的布局
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from library import SpectralLibrary, resample_to_grid
+from pipeline import Pipeline
+from ramanmap import RamanMap
+
+SPECS = [{'stage': 'smooth', 'window_length': 7, 'polyorder': 2},
+         {'stage': 'baseline', 'lam': 1e4, 'niter': 10},
+         {'stage': 'peaks', 'prominence': 0.5}]
+
+
+def make_map(path, shape=(3, 4), missing=(1, 6, 7), seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(100, 1500, 400)
+    raman_map = RamanMap.create(path, x, shape)
+    centres = rng.uniform(200, 1400, (len(raman_map), 3))
+    y = 5 * np.exp(-((x[None, None, :] - centres[:, :, None]) / 15) ** 2).sum(axis=1) + x / 1000
+    y += rng.normal(0, 0.02, y.shape)
+    measured = np.setdiff1d(np.arange(len(raman_map)), missing)
+    raman_map.cube[measured] = y[measured]
+    raman_map.cube.flush()
+    return raman_map, measured
+
+
+def test_process_matches_pipeline_and_skips_missing_pixels(tmp_path):
+    raman_map, measured = make_map(tmp_path / 'map')
+    result = raman_map.process(SPECS, tmp_path / 'out', bands=[(800, 50)], chunk_size=5, workers=1)
+    peak_count = result.image('peak count').ravel()
+    band = result.image('band 800').ravel()
+    for pixel in range(len(raman_map)):
+        if pixel not in measured:
+            assert np.isnan(result.cube[pixel]).all()
+            assert np.isnan(peak_count[pixel]) and np.isnan(band[pixel])
+            continue
+        state = Pipeline.from_list(SPECS).run(raman_map.x, np.asarray(raman_map.cube[pixel], dtype=float))
+        np.testing.assert_allclose(result.cube[pixel], state['y'], rtol=1e-4, atol=1e-4)
+        assert peak_count[pixel] == len(state['peaks'][0])
+
+
+def test_process_rejects_map_without_measured_pixels(tmp_path):
+    raman_map = RamanMap.create(tmp_path / 'map', np.linspace(100, 1500, 50), (2, 2))
+    with pytest.raises(ValueError):
+        raman_map.process(SPECS, tmp_path / 'out', workers=1)
+
+
+def test_identify_matches_per_pixel_correlation(tmp_path):
+    raman_map, measured = make_map(tmp_path / 'map')
+    grid = np.linspace(150, 1450, 300)
+    rng = np.random.default_rng(1)
+    matrix = np.vstack([resample_to_grid(raman_map.x, np.asarray(raman_map.cube[pixel], dtype=float), grid)
+                        for pixel in measured[:4]] + [rng.uniform(0, 1, (6, len(grid)))])
+    filenames = [f'ref{i}.txt' for i in range(len(matrix))]
+    library = SpectralLibrary(filenames, filenames, grid, matrix)
+
+    best, score = raman_map.identify(library, chunk_size=5, workers=2)
+    best, score = best.ravel(), score.ravel()
+    for pixel in range(len(raman_map)):
+        if pixel not in measured:
+            assert best[pixel] == -1 and np.isnan(score[pixel])
+            continue
+        y = resample_to_grid(raman_map.x, np.asarray(raman_map.cube[pixel], dtype=float), grid)
+        keep = np.isfinite(y)
+        expected = [np.corrcoef(row[keep], y[keep])[0, 1] for row in matrix]
+        assert best[pixel] == np.argmax(expected)
+        assert score[pixel] == pytest.approx(max(expected), abs=1e-4)
+    np.testing.assert_array_equal(best[measured[:4]], np.arange(4))
+
+
+def test_identify_ignores_unmeasured_points_and_repeated_wavenumbers(tmp_path):
+    """像素只有部分波段有数据、x 轴中有重复的波数时，像素与其来源参考光谱的相关系数仍为 1"""
+    x = np.linspace(100, 1500, 300)
+    x = np.sort(np.concatenate([x, x[[50, 200]]]))
+    raman_map = RamanMap.create(tmp_path / 'map', x, (1, 3))
+    grid = np.linspace(50, 1550, 400)
+    rng = np.random.default_rng(2)
+    centres = rng.uniform(150, 1450, (3, 3))
+    y = np.exp(-((x[None, None, :] - centres[:, :, None]) / 15) ** 2).sum(axis=1) + 0.1
+    raman_map.cube[:] = y
+    raman_map.cube[1, 150:] = np.nan
+    raman_map.cube.flush()
+    matrix = np.vstack([np.interp(grid, x, row, left=0, right=0) for row in y] + [rng.uniform(0, 1, (4, len(grid)))])
+    library = SpectralLibrary([f'ref{i}' for i in range(len(matrix))], list(range(len(matrix))), grid, matrix)
+
+    best, score = raman_map.identify(library, workers=1)
+    np.testing.assert_array_equal(best.ravel(), [0, 1, 2])
+    np.testing.assert_allclose(score.ravel(), 1.0, atol=1e-4)
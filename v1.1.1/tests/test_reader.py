@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from reader import iter_blocks, iter_spectra, read_spectrum, sniff
+
+
+def make_spectra(n_spectra=7, n_points=40, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(1500, 100, n_points).round(2)  # 仪器常按降序导出
+    coords = np.column_stack([np.arange(n_spectra) % 3 * 1.5, np.arange(n_spectra) // 3 * 2.0])
+    return x, coords, rng.uniform(0, 100, (n_spectra, n_points)).round(3)
+
+
+def write_long(path, x, coords, y, header=None, delimiter=' '):
+    with open(path, 'w') as f:
+        if header:
+            f.write(header + '\n')
+        for c, row in zip(coords, y):
+            for xi, yi in zip(x, row):
+                f.write(delimiter.join(f'{v:g}' for v in (*c, xi, yi)) + '\n')
+
+
+def test_wide_layout_matches_loadtxt(tmp_path):
+    x, coords, y = make_spectra()
+    path = tmp_path / 'wide.txt'
+    with open(path, 'w') as f:
+        f.write('# 面扫描导出\n')
+        f.write('\t\t' + '\t'.join(f'{v:g}' for v in x) + '\n')
+        for c, row in zip(coords, y):
+            f.write('\t'.join(f'{v:g}' for v in (*c, *row)) + '\n')
+    layout = sniff(path)
+    assert (layout.kind, layout.n_coords, layout.is_multi) == ('wide', 2, True)
+    blocks = list(iter_blocks(path, block_size=3))
+    assert [len(block.y) for block in blocks] == [3, 3, 1]
+    order = np.argsort(x)
+    np.testing.assert_array_equal(blocks[0].x, x[order])
+    np.testing.assert_array_equal(np.vstack([block.y for block in blocks]), y[:, order])
+    np.testing.assert_array_equal(np.vstack([block.coords for block in blocks]), coords)
+    offset = blocks[1].offsets[1]
+    np.testing.assert_array_equal(read_spectrum(path, offset, layout)[1], y[4, order])
+
+
+@pytest.mark.parametrize('header, delimiter', [(None, ' '), ('X,Y,Wave,Intensity', ',')])
+def test_long_layout_matches_reference(tmp_path, header, delimiter):
+    x, coords, y = make_spectra()
+    path = tmp_path / 'long.csv'
+    write_long(path, x, coords, y, header, delimiter)
+    layout = sniff(path)
+    assert (layout.kind, layout.n_coords) == ('long', 2)
+    spectra = list(iter_spectra(path, block_size=2, layout=layout))
+    order = np.argsort(x)
+    assert len(spectra) == len(y)
+    for (c, spectrum_x, spectrum_y), expected_c, expected_y in zip(spectra, coords, y):
+        np.testing.assert_array_equal(c, expected_c)
+        np.testing.assert_array_equal(spectrum_x, x[order])
+        np.testing.assert_array_equal(spectrum_y, expected_y[order])
+
+
+def test_time_series_with_one_coordinate_column(tmp_path):
+    x, _, y = make_spectra(4)
+    path = tmp_path / 'series.txt'
+    write_long(path, x, np.arange(4)[:, None] * 0.5, y)
+    layout = sniff(path)
+    assert (layout.kind, layout.n_coords) == ('long', 1)
+    assert len(list(iter_spectra(path, layout=layout))) == 4
+
+
+@pytest.mark.parametrize('columns', [3, 4])
+def test_single_spectrum_with_extra_columns_is_not_multi(tmp_path, columns):
+    """x、y 之外还有其他列（如误差、第二通道）的单光谱：第一列单调且不重复，不是长格式"""
+    rng = np.random.default_rng(1)
+    x = np.linspace(100, 1500, 200)
+    data = np.column_stack([x, *rng.uniform(0, 10, (columns - 1, len(x)))])
+    path = tmp_path / 'single.txt'
+    np.savetxt(path, data, fmt='%.4f')
+    layout = sniff(path)
+    assert layout.n_coords == 0 and not layout.is_multi
+
+
+def test_plain_two_column_file(tmp_path):
+    path = tmp_path / 'plain.txt'
+    np.savetxt(path, np.column_stack([np.linspace(100, 1500, 50), np.ones(50)]), delimiter=', ')
+    layout = sniff(path)
+    assert (layout.kind, layout.n_coords, layout.delimiter, layout.is_multi) == ('long', 0, ',', False)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from library import resample_to_grid
+from resample import Resampler, resample, resample_many
+
+
+def interp(x, y, target, left=0.0, right=0.0):
+    """逐条光谱的 np.interp 参考实现（None 表示取端点的值）"""
+    order = np.argsort(x, kind='stable')
+    x, y = np.asarray(x, dtype=float)[order], np.asarray(y, dtype=float)[order]
+    return np.interp(target, x, y, left=y[0] if left is None else left, right=y[-1] if right is None else right)
+
+
+@pytest.mark.parametrize('left, right', [(0.0, 0.0), (None, None), (-1.0, np.nan)])
+def test_resampler_matches_np_interp(left, right):
+    rng = np.random.default_rng(0)
+    x = rng.uniform(100, 1500, 300)  # 无序的源网格
+    x[10] = 1500.0
+    target = np.concatenate([np.linspace(50, 1600, 400), x[:20]])  # 超出范围的点和恰好落在源点上的点
+    y = rng.random((5, len(x)))
+    np.testing.assert_allclose(resample(x, y, target, left, right),
+                               [interp(x, row, target, left, right) for row in y], atol=1e-12)
+
+
+def test_nan_only_affects_neighbouring_targets():
+    x = np.linspace(100, 1500, 200)
+    y = np.sin(x / 80)
+    y[50:53] = np.nan
+    target = np.linspace(90, 1510, 700)
+    np.testing.assert_allclose(Resampler(x, target).apply(y), interp(x, y, target), atol=1e-12, equal_nan=True)
+    np.testing.assert_allclose(resample_to_grid(x[::-1], y[::-1], target), interp(x, y, target, np.nan, np.nan),
+                               atol=1e-12, equal_nan=True)
+
+
+def test_unmeasured_and_cropped_grid_points_are_nan():
+    x = np.linspace(100, 1500, 200)
+    y = np.ones(len(x))
+    y[-5:] = np.nan
+    grid = np.arange(50, 1601, 10.0)
+    out = resample_to_grid(x, y, grid)
+    assert np.isnan(out[grid < 100]).all()
+    assert np.isnan(out[grid > 1460]).all()
+    assert (out[(grid >= 100) & (grid <= 1460)] == 1).all()
+
+
+def test_resample_many_matches_np_interp():
+    rng = np.random.default_rng(1)
+    grids = [np.sort(rng.uniform(100, 1500, n)) for n in (300, 250, 1, 1)]
+    grids[3] = grids[2]  # 两条光谱共用只有一个点的网格
+    xs = [grids[i % 2] for i in range(6)] + [grids[1][::-1], grids[2], grids[3]]
+    ys = [rng.random(len(x)) for x in xs]
+    target = np.linspace(50, 1600, 500)
+    for left, right in [(0.0, 0.0), (None, None)]:
+        expected = [interp(x, y, target, left, right) for x, y in zip(xs, ys)]
+        np.testing.assert_allclose(resample_many(xs, ys, target, left, right), expected, atol=1e-12)
+        keys = [len(x) for x in xs]  # 调用方给出的键：长度相同的网格在这里也确实相同
+        keys[6] = 'reversed'
+        np.testing.assert_allclose(resample_many(xs, ys, target, left, right, keys=keys), expected, atol=1e-12)
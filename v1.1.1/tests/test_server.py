@@ -0,0 +1,93 @@
+import http.client
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from ann_index import SpectralIndex, search_library
+from library import SpectralLibrary, resample_to_grid
+from server import IdentificationService, PooledHTTPServer, RequestHandler, ServerClient
+from xcorr import xcorr_match
+
+CONFIG = {'library grid start': 100, 'library grid end': 1500, 'library grid step': 5,
+          'similarity max results': 5, 'index candidates': 50, 'index probes': 4, 'xcorr max shift': 10}
+
+
+def make_service():
+    """不读数据库，直接用合成的参考光谱库构造服务"""
+    rng = np.random.default_rng(0)
+    grid = np.arange(100, 1501, 5.0)
+    centres = rng.uniform(150, 1450, (40, 3))
+    matrix = np.exp(-((grid[None, None, :] - centres[:, :, None]) / 10) ** 2).sum(axis=1)
+    filenames = [f'ref{i}.txt' for i in range(len(matrix))]
+    service = IdentificationService.__new__(IdentificationService)
+    service.config = CONFIG
+    service.library = SpectralLibrary(filenames, [f'M{i}' for i in range(len(matrix))], grid, matrix)
+    service.index = SpectralIndex.build(service.library, n_components=8)
+    return service
+
+
+@pytest.fixture
+def server():
+    server = PooledHTTPServer(('127.0.0.1', 0), RequestHandler, make_service(), workers=1, idle_timeout=0.5)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_similarity_matches_direct_search():
+    service = make_service()
+    x = np.linspace(100, 1500, 700)
+    y = resample_to_grid(service.library.grid, service.library.matrix[3], x)
+    grid_y = resample_to_grid(x, y, service.library.grid)
+
+    indices, scores = search_library(service.index, service.library, grid_y, k=5, n_candidates=50, n_probe=4)
+    matches = service.similarity(x, y, k=5, method='index')
+    assert [m['filename'] for m in matches] == [service.library.filenames[i] for i in indices]
+    np.testing.assert_allclose([m['score'] for m in matches], scores)
+
+    scores, offsets = xcorr_match(service.library, grid_y, CONFIG['xcorr max shift'])
+    matches = service.similarity(x, y, k=5, method='xcorr')
+    assert [m['filename'] for m in matches] == [service.library.filenames[i] for i in np.argsort(scores)[::-1][:5]]
+    assert matches[0]['filename'] == 'ref3.txt'
+
+
+@pytest.mark.parametrize('method', ['hausdorff', 'two-stage'])
+def test_unsupported_method_is_rejected(server, method):
+    client = ServerClient(f'http://127.0.0.1:{server.server_port}')
+    with pytest.raises(ValueError, match=method):
+        client.similarity(np.linspace(100, 1500, 50), np.ones(50), method=method)
+
+
+def test_idle_keep_alive_connection_is_closed(server):
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=5)
+    connection.request('GET', '/health')
+    assert connection.getresponse().read()
+    time.sleep(1.0)
+    # 唯一的工作线程已被释放，另一个连接可以立即得到服务
+    other = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=2)
+    other.request('GET', '/health')
+    assert other.getresponse().status == 200
+    other.close()
+    connection.close()
+
+
+def test_queued_connection_is_served_while_another_stays_open(server):
+    first = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=5)
+    first.request('GET', '/health')
+    first.getresponse().read()
+    # first 仍然保持连接并占用唯一的工作线程；second 排队后，first 的下一个响应带 Connection: close
+    second = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=5)
+    second.connect()
+    time.sleep(0.1)
+    first.request('GET', '/health')
+    response = first.getresponse()
+    response.read()
+    assert response.getheader('Connection') == 'close'
+    second.request('GET', '/health')
+    assert second.getresponse().status == 200
+    first.close()
+    second.close()
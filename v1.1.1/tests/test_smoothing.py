@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from scipy.ndimage import median_filter
+from scipy.signal import savgol_filter
+from scipy.sparse import diags, identity
+from scipy.sparse.linalg import spsolve
+
+from smoothing import smooth, valid_segments
+
+
+def make_spectra(n_spectra=4, n_points=300, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(100, 1500, n_points)
+    return np.sin(x / 50)[None, :] + rng.normal(0, 0.1, (n_spectra, n_points))
+
+
+def whittaker(y, lam):
+    D = diags([1., -2., 1.], [0, -1, -2], shape=(len(y), len(y) - 2))
+    return spsolve((identity(len(y)) + lam * D.dot(D.transpose())).tocsc(), y)
+
+
+def reference(row, method, window_length=11, polyorder=3, lam=100.0):
+    """逐个有效区间调用 scipy 的标量实现"""
+    out = row.copy()
+    for start, stop in valid_segments(~np.isnan(row)):
+        segment = row[start:stop]
+        n = len(segment)
+        window = min(window_length, n if n % 2 else n - 1)
+        if method == 'whittaker':
+            out[start:stop] = whittaker(segment, lam) if n >= 3 else segment
+        elif method == 'median':
+            out[start:stop] = median_filter(segment, size=window, mode='nearest') if window > 1 else segment
+        elif window > min(polyorder, window - 1) and window >= 2:
+            out[start:stop] = savgol_filter(segment, window, min(polyorder, window - 1))
+    return out
+
+
+@pytest.mark.parametrize('window_length, polyorder', [(11, 3), (5, 2), (21, 4), (10, 3)])
+def test_savgol_matches_savgol_filter(window_length, polyorder):
+    y = make_spectra()
+    np.testing.assert_allclose(smooth(y, 'savgol', window_length, polyorder),
+                               savgol_filter(y, window_length, polyorder, axis=-1), atol=1e-10)
+    np.testing.assert_allclose(smooth(y[0], 'savgol', window_length, polyorder),
+                               savgol_filter(y[0], window_length, polyorder), atol=1e-10)
+
+
+@pytest.mark.parametrize('method', ['savgol', 'whittaker', 'median'])
+def test_nan_gaps_are_smoothed_per_segment(method):
+    y = make_spectra()
+    y[:, 100:120] = np.nan
+    y[:, 290:] = np.nan
+    y[2, 5:7] = np.nan  # 只有一条光谱有的短缺口，以及短于窗口的区间
+    result = smooth(y, method)
+    for row, smoothed in zip(y, result):
+        np.testing.assert_allclose(smoothed, reference(row, method), atol=1e-8, equal_nan=True)
+
+
+def test_excluded_intervals_keep_their_values():
+    y = make_spectra()
+    valid = np.ones(y.shape[1], dtype=bool)
+    valid[150:200] = False
+    result = smooth(y, 'savgol', valid=valid)
+    np.testing.assert_array_equal(result[:, 150:200], y[:, 150:200])
+    masked = np.where(valid, y, np.nan)
+    for row, smoothed in zip(masked, result):
+        np.testing.assert_allclose(smoothed[valid], reference(row, 'savgol')[valid], atol=1e-10)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from spectra import Spectrum, merge_intervals, readonly
+
+
+def make_spectrum(n=500):
+    x = np.linspace(100, 1500, n)
+    return Spectrum(x, np.sin(x / 50) + x / 1000)
+
+
+def test_arrays_are_read_only_views():
+    x = np.linspace(100, 1500, 50)
+    spectrum = Spectrum(x, np.ones(50))
+    assert np.shares_memory(spectrum.x, x) and x.flags.writeable
+    for array in (spectrum.x, spectrum.y, spectrum.crop(200, 300).valid):
+        with pytest.raises(ValueError):
+            array[0] = 0
+    # 整数输入转换为浮点数（只有这时才拷贝）
+    converted = readonly(np.arange(5))
+    assert converted.dtype == float and not converted.flags.writeable
+
+
+def test_no_op_operations_return_the_same_spectrum():
+    spectrum = make_spectrum()
+    assert spectrum.copy() is spectrum
+    assert spectrum.crop(0, 50) is spectrum
+    assert spectrum.crop(1600, 1550) is spectrum
+    assert spectrum.subtract(None) is spectrum and spectrum.add(None) is spectrum
+    assert spectrum.masked_y() is spectrum.y and spectrum.valid is None
+
+
+def test_operations_share_unchanged_buffers():
+    spectrum = make_spectrum()
+    cropped = spectrum.crop(400, 300)
+    assert np.shares_memory(cropped.x, spectrum.x) and np.shares_memory(cropped.y, spectrum.y)
+    assert cropped.excluded == ((300.0, 400.0),) and spectrum.excluded == ()
+    inside = (spectrum.x >= 300) & (spectrum.x <= 400)
+    np.testing.assert_array_equal(cropped.valid, ~inside)
+    assert np.isnan(cropped.masked_y()[inside]).all() and not np.isnan(spectrum.y).any()
+
+    baseline = spectrum.x / 1000
+    corrected = cropped.subtract(baseline)
+    assert np.shares_memory(corrected.x, spectrum.x) and corrected.excluded == cropped.excluded
+    assert not np.shares_memory(corrected.y, spectrum.y)
+    np.testing.assert_allclose(corrected.add(baseline).y, spectrum.y)
+
+    smoothed = cropped.smooth()
+    assert np.shares_memory(smoothed.x, spectrum.x) and smoothed.excluded == cropped.excluded
+    # 裁剪的区间内保留原来的强度
+    np.testing.assert_array_equal(smoothed.y[inside], spectrum.y[inside])
+
+
+def test_excluded_intervals_are_merged():
+    assert merge_intervals([(5, 3), (1, 2), (2.5, 4), (10, 12)]) == ((1.0, 2.0), (2.5, 5.0), (10.0, 12.0))
+    spectrum = make_spectrum().crop(300, 400).crop(350, 500).crop(1200, 1100)
+    assert spectrum.excluded == ((300.0, 500.0), (1100.0, 1200.0))
+    assert spectrum.n_valid() == np.count_nonzero(spectrum.valid)
+    x, y = spectrum.valid_points()
+    assert len(x) == len(y) == spectrum.n_valid() and not ((x >= 300) & (x <= 500)).any()
@@ -0,0 +1,89 @@
+import sqlite3
+
+import numpy as np
+import pytest
+from scipy.optimize import nnls
+
+from library import SpectralLibrary, make_grid, parse_vector
+from unmix import peak_scores, top_candidates, unmix_spectrum
+
+
+def make_library(n_spectra=60, seed=0):
+    rng = np.random.default_rng(seed)
+    grid = make_grid(100, 1500, 2)
+    centres = rng.uniform(150, 1450, (n_spectra, 4))
+    matrix = np.exp(-((grid[None, None, :] - centres[:, :, None]) / 6) ** 2).sum(axis=1)
+    matrix /= matrix.max(axis=1, keepdims=True)
+    return SpectralLibrary([f'ref{i}.txt' for i in range(n_spectra)], [f'M{i}' for i in range(n_spectra)],
+                           grid, matrix)
+
+
+def test_parse_vector_matches_eval():
+    for text in ('[1.0, 2.5, -3e-2]', '(4, 5)', '[ 7.25 ]'):
+        np.testing.assert_array_equal(parse_vector(text), np.array(eval(text), dtype=float))
+    assert len(parse_vector('[]')) == 0
+
+
+def test_from_database_matches_np_interp(tmp_path):
+    rng = np.random.default_rng(2)
+    grid = make_grid(100, 1500, 5)
+    shared = np.linspace(80, 1480, 300)
+    rows, expected = [], {}
+    for i in range(8):
+        x = shared if i < 5 else np.sort(rng.uniform(200, 1600, 250))[::-1]
+        y = rng.random(len(x)) + 0.1
+        rows.append((f'ref{i}', f'M{i}', str(x.tolist()), str(y.tolist())))
+        order = np.argsort(x)
+        reference = np.interp(grid, x[order], y[order], left=0.0, right=0.0)
+        expected[f'ref{i}'] = reference / reference.max()
+    rows.append(('zero', 'Z', str(shared.tolist()), str(np.zeros(300).tolist())))
+    rows.append(('broken', 'B', '[1.0, 2.0, 3.0]', '[1.0]'))
+    path = tmp_path / 'library.db'
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE Spectra (filename TEXT, names TEXT, data_x TEXT, data_y TEXT)")
+    conn.executemany("INSERT INTO Spectra VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+    library = SpectralLibrary.from_database(path, grid)
+    assert library.filenames == list(expected)
+    np.testing.assert_allclose(library.matrix, np.array(list(expected.values())), atol=1e-12)
+    subset = library.subset(library.indices_of(['ref6', 'missing', 'ref1']))
+    assert subset.filenames == ['ref6', 'ref1']
+
+
+def test_peak_scores_match_loop():
+    library = make_library()
+    peak_idx = np.array([10, 200, 201, 650])
+    tol, min_height = 2, 0.1
+    window = np.unique(np.clip(np.concatenate([peak_idx + s for s in range(-tol, tol + 1)]), 0, len(library.grid) - 1))
+    expected = [row[window].sum() / row.sum() * np.mean(row[peak_idx] > min_height) for row in library.matrix]
+    np.testing.assert_allclose(peak_scores(library, peak_idx, tol, min_height), expected)
+    np.testing.assert_array_equal(peak_scores(library, np.array([], dtype=int)), np.zeros(len(library)))
+
+
+def test_top_candidates_matches_argsort():
+    scores = np.random.default_rng(3).random(40)
+    np.testing.assert_array_equal(top_candidates(scores, 5), np.argsort(scores)[::-1][:5])
+    assert not set(top_candidates(scores, 5, exclude=[int(np.argmax(scores))])) & {int(np.argmax(scores))}
+
+
+def test_unmix_matches_full_library_nnls():
+    library = make_library()
+    truth = {3: 0.6, 17: 0.3, 42: 0.1}
+    y = sum(weight * library.matrix[i] for i, weight in truth.items())
+    y[500:520] = np.nan
+    results, residual = unmix_spectrum(library, y)
+    assert residual < 1e-6
+
+    # 参考：在整个光谱库上直接求解 NNLS
+    valid = ~np.isnan(y)
+    coef, _ = nnls(library.matrix[:, valid].T, y[valid])
+    contributions = coef * library.matrix[:, valid].sum(axis=1)
+    expected = {library.filenames[i]: 100 * contributions[i] / contributions.sum() for i in np.flatnonzero(coef > 1e-9)}
+    # 数值误差量级的组分（丰度约 1e-16 %）不参与比较
+    significant = [(filename, abundance) for filename, _, abundance in results if abundance > 1e-9]
+    assert [filename for filename, _ in significant] == sorted(expected, key=expected.get, reverse=True)
+    for filename, abundance in significant:
+        assert abundance == pytest.approx(expected[filename], abs=1e-6)
+    assert unmix_spectrum(library, np.full(len(library.grid), np.nan)) == ([], 1.0)
@@ -0,0 +1,108 @@
+import threading
+
+import numpy as np
+
+from ann_index import SpectralIndex, search_library
+from library import SpectralLibrary, resample_to_grid
+import watcher
+from watcher import FolderWatcher, Identifier, ProcessedStore
+
+
+def write_spectrum(path, seed):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(100, 1500, 700)
+    y = np.exp(-((x[:, None] - rng.uniform(200, 1400, 3)) / 8) ** 2).sum(axis=1) + rng.normal(0, 0.01, len(x))
+    np.savetxt(path, np.column_stack([x, y]), fmt='%.5f')
+    return x, y
+
+
+def run_once(watcher, timeout=30):
+    """运行一轮；工作线程出错时 queue.join() 会挂起，因此带超时"""
+    thread = threading.Thread(target=watcher.run, kwargs={'once': True}, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'watcher.run 没有结束'
+
+
+def test_identifier_matches_direct_search(tmp_path):
+    x, y = write_spectrum(tmp_path / 'unknown.txt', 0)
+    grid = np.linspace(100, 1500, 300)
+    rng = np.random.default_rng(1)
+    matrix = np.vstack([resample_to_grid(x, y, grid), rng.uniform(0, 1, (30, len(grid)))])
+    filenames = [f'ref{i}.txt' for i in range(len(matrix))]
+    library = SpectralLibrary(filenames, [f'M{i}' for i in range(len(matrix))], grid, matrix)
+    index = SpectralIndex.build(library, n_components=8)
+
+    result = Identifier(library, index, k=3)(tmp_path / 'unknown.txt')
+    indices, scores = search_library(index, library, resample_to_grid(x, y, grid), k=3)
+    assert [match[0] for match in result['matches']] == [filenames[i] for i in indices]
+    np.testing.assert_allclose([match[2] for match in result['matches']], scores, atol=1e-4)
+    assert result['matches'][0][0] == 'ref0.txt'
+
+
+def test_worker_survives_errors_and_prunes_queue(tmp_path):
+    folder = tmp_path / 'watch'
+    folder.mkdir()
+    for i in range(6):
+        write_spectrum(folder / f's{i}.txt', i)
+    (folder / 'copy.txt').write_bytes((folder / 's0.txt').read_bytes())
+
+    def identify(path):
+        name = path.rsplit('/', 1)[-1]
+        if name == 's1.txt':
+            raise ValueError('bad file')
+        if name == 's2.txt':
+            return {'matches': [], 'unserializable': object()}  # store.finish 出错
+        return {'matches': []}
+
+    store = ProcessedStore(tmp_path / 'processed.db')
+    watcher = FolderWatcher(folder, identify, store, workers=2, settle_time=0)
+    run_once(watcher)
+    assert watcher.stats == {'processed': 4, 'duplicate': 1, 'failed': 2}
+    # 已记录到 store 的文件（包括重复文件）不再留在 queued 中；未能记录的文件保留，避免重复处理
+    assert [path.rsplit('/', 1)[-1] for path in watcher.queued] == ['s2.txt']
+    assert watcher.scan() == []
+
+    (folder / 's3.txt').unlink()
+    (folder / 's2.txt').unlink()
+    watcher.scan()
+    assert watcher.queued == {}
+    store.close()
+
+
+def test_duplicates_are_not_rehashed_after_restart(tmp_path, monkeypatch):
+    folder = tmp_path / 'watch'
+    folder.mkdir()
+    write_spectrum(folder / 'a.txt', 0)
+    (folder / 'b.txt').write_bytes((folder / 'a.txt').read_bytes())
+    hashed = []
+    original = watcher.file_sha256
+    monkeypatch.setattr(watcher, 'file_sha256', lambda path: hashed.append(path) or original(path))
+
+    store = ProcessedStore(tmp_path / 'processed.db')
+    first = FolderWatcher(folder, lambda path: {'matches': []}, store, workers=2, settle_time=0)
+    run_once(first)
+    assert first.stats == {'processed': 1, 'duplicate': 1, 'failed': 0} and len(hashed) == 2
+    store.close()
+
+    # 重启后两个路径都由 store.known 跳过，不再计算哈希
+    store = ProcessedStore(tmp_path / 'processed.db')
+    second = FolderWatcher(folder, lambda path: {'matches': []}, store, workers=2, settle_time=0)
+    assert second.scan() == [] and len(hashed) == 2
+    # 修改过的重复文件重新检查
+    with open(folder / 'b.txt', 'a') as f:
+        f.write('\n')
+    assert [path.rsplit('/', 1)[-1] for path, *_ in second.scan()] == ['b.txt']
+    store.close()
+
+
+def test_duplicates_of_interrupted_files_are_rechecked(tmp_path):
+    store = ProcessedStore(tmp_path / 'processed.db')
+    assert store.claim('abc', 'a.txt', 10, 1.0)
+    assert not store.claim('abc', 'b.txt', 10, 2.0)
+    assert store.known('b.txt', 10, 2.0) and not store.known('b.txt', 10, 3.0)
+    store.close()
+    # 上次退出时 a.txt 还在处理中：两者都需要重新处理
+    store = ProcessedStore(tmp_path / 'processed.db')
+    assert not store.known('a.txt', 10, 1.0) and not store.known('b.txt', 10, 2.0)
+    store.close()
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from library import SpectralLibrary, make_grid, resample_to_grid
+from xcorr import MIN_OVERLAP, masked_pearson, normalize_rows, xcorr_match
+
+
+def make_library(n_spectra=25, seed=0):
+    rng = np.random.default_rng(seed)
+    grid = make_grid(100, 1500, 2)
+    centres = rng.uniform(150, 1450, (n_spectra, 4))
+    matrix = np.exp(-((grid[None, None, :] - centres[:, :, None]) / 8) ** 2).sum(axis=1)
+    return SpectralLibrary([f'ref{i}.txt' for i in range(n_spectra)], [f'M{i}' for i in range(n_spectra)],
+                           grid, matrix / matrix.max(axis=1, keepdims=True))
+
+
+def pearson(a, b):
+    keep = np.isfinite(a) & np.isfinite(b)
+    return np.corrcoef(a[keep], b[keep])[0, 1] if keep.sum() >= 3 else -np.inf
+
+
+def direct_xcorr(library, y, max_lag):
+    """逐条参考光谱、逐个延迟在重叠部分上计算 u[i + k] 与 r[i] 的皮尔逊相关系数的参考实现"""
+    n = len(y)
+    min_overlap = max(3, MIN_OVERLAP * np.isfinite(y).sum())
+    scores, lags = [], []
+    for row in library.matrix:
+        corr = []
+        for k in range(-max_lag, max_lag + 1):
+            a, b = y[max(k, 0):n + min(k, 0)], row[max(-k, 0):n - max(k, 0)]
+            overlap = (np.isfinite(a) & np.isfinite(b)).sum()
+            corr.append(pearson(a, b) if overlap >= min_overlap else -np.inf)
+        scores.append(max(corr))
+        lags.append(int(np.argmax(corr)) - max_lag)
+    return np.array(scores), np.array(lags)
+
+
+def test_normalize_rows_ignores_nan():
+    rng = np.random.default_rng(2)
+    row = rng.random(50)
+    cropped = row.copy()
+    cropped[10:30] = np.nan
+    normalized = normalize_rows(cropped)[0]
+    assert (normalized[10:30] == 0).all()
+    keep = np.isfinite(cropped)
+    expected = (row[keep] - row[keep].mean()) / np.linalg.norm(row[keep] - row[keep].mean())
+    np.testing.assert_allclose(normalized[keep], expected, atol=1e-6)
+
+
+@pytest.mark.parametrize('chunk_size', [1000, 7])
+def test_matches_direct_cross_correlation(chunk_size):
+    library = make_library()
+    rng = np.random.default_rng(1)
+    y = np.roll(library.matrix[4], 6) + rng.normal(0, 0.01, len(library.grid))
+    y[300:320] = np.nan
+    scores, offsets = xcorr_match(library, y, max_shift=20, chunk_size=chunk_size)
+    expected_scores, expected_lags = direct_xcorr(library, y, max_lag=10)
+    np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+    np.testing.assert_array_equal(offsets, expected_lags * 2.0)
+    assert np.argmax(scores) == 4 and offsets[4] == 12.0
+
+
+@pytest.mark.parametrize('crop', ['half', 'narrow range'])
+def test_cropped_unknown_scores_one_against_its_source(crop):
+    library = make_library()
+    source = library.matrix[9]
+    if crop == 'half':
+        y = source.copy()
+        y[:len(y) // 2] = np.nan
+    else:
+        # 测量范围比库的网格窄的光谱，网格上超出范围的点为 NaN
+        x = np.linspace(600, 1200, 400)
+        y = resample_to_grid(x, np.interp(x, library.grid, source), library.grid)
+    scores, offsets = xcorr_match(library, y, max_shift=10)
+    assert np.argmax(scores) == 9 and scores[9] == pytest.approx(1.0, abs=1e-4) and offsets[9] == 0
+    pearson_scores = masked_pearson(library.matrix, y)[0]
+    assert np.argmax(pearson_scores) == 9 and pearson_scores[9] == pytest.approx(1.0, abs=1e-4)
+
+
+def test_masked_pearson_matches_corrcoef_per_pattern():
+    library = make_library()
+    rng = np.random.default_rng(3)
+    queries = library.matrix[:6] + rng.normal(0, 0.05, (6, len(library.grid)))
+    queries[1, :100] = np.nan
+    queries[2, 400:] = np.nan
+    queries[3, :100] = np.nan
+    queries[5] = np.nan
+    cache = {}
+    scores = masked_pearson(library.matrix, queries, cache)
+    assert len(cache) == 3
+    for query, row_scores in zip(queries[:5], scores):
+        expected = [pearson(query, reference) for reference in library.matrix]
+        np.testing.assert_allclose(row_scores, expected, atol=1e-5)
+    assert (scores[5] == 0).all()
+    np.testing.assert_array_equal(masked_pearson(library.matrix, queries, cache), scores)
+
+
+def test_shift_is_limited_to_the_library_length():
+    library = make_library(3)
+    scores, offsets = xcorr_match(library, library.matrix[1], max_shift=1e6)
+    assert scores[1] == pytest.approx(1.0, abs=1e-5) and offsets[1] == 0
+    assert (np.abs(offsets) <= (len(library.grid) - 1) * 2.0).all()
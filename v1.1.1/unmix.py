@@ -0,0 +1,110 @@
+"""全谱解混：将未知光谱拟合为参考光谱的非负线性组合"""
+
+import numpy as np
+from scipy.optimize import nnls
+from scipy.signal import find_peaks
+
+
+def peak_indices_on_grid(grid, y, peaks_x=None):
+    """返回峰值在网格上的索引；若未提供峰值位置，则在网格光谱上自动检测"""
+    if peaks_x is not None and len(peaks_x):
+        idx = np.searchsorted(grid, peaks_x)
+        return np.unique(np.clip(idx, 0, len(grid) - 1))
+    filled = np.nan_to_num(y)
+    if not filled.any():
+        return np.array([], dtype=int)
+    idx, _ = find_peaks(filled, prominence=0.05 * np.max(np.abs(filled)))
+    return idx
+
+
+def peak_scores(library, peak_idx, tol=1, min_height=0.1):
+    """基于峰值的打分，只需对光谱库矩阵做列 gather 即可一次性为整个库打分
+
+    得分为两项之积：参考光谱中落在未知峰位（±tol 个网格点）附近的面积占比，
+    以及未知峰中在参考光谱上强度超过 `min_height` 的比例。
+    """
+    if len(peak_idx) == 0:
+        return np.zeros(len(library))
+    mask = np.zeros(library.matrix.shape[1], dtype=bool)
+    for shift in range(-tol, tol + 1):
+        mask[np.clip(peak_idx + shift, 0, len(mask) - 1)] = True
+    explained = library.matrix[:, mask].sum(axis=1) / library.matrix.sum(axis=1)
+    coverage = (library.matrix[:, peak_idx] > min_height).mean(axis=1)
+    return explained * coverage
+
+
+def top_candidates(scores, n, exclude=()):
+    """返回得分最高的 n 个索引（按得分降序），跳过 `exclude` 中的索引"""
+    scores = scores.copy()
+    scores[list(exclude)] = -np.inf
+    n = min(n, len(scores) - len(exclude))
+    if n <= 0:
+        return np.array([], dtype=int)
+    candidates = np.argpartition(scores, -n)[-n:]
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def unmix_spectrum(library, y, peaks_x=None, n_candidates=50, max_components=5, n_rounds=3):
+    """将重采样到 `library.grid` 上的未知光谱 `y` 分解为参考光谱的非负组合
+
+    先用峰值预筛选出少量候选参考光谱，在候选集上求解 NNLS；随后根据残差中仍未解释的峰
+    补充新的候选并重新求解（共 `n_rounds` 轮），使方程组始终保持很小的规模。
+
+    Parameters:
+    - library: SpectralLibrary
+    - y: 未知光谱在 library.grid 上的强度（NaN 表示被裁剪的点）
+    - peaks_x: 未知光谱的峰值位置，用于第一轮预筛选
+    - n_candidates: 第一轮参与 NNLS 求解的候选参考光谱数
+    - max_components: 结果中保留的最大组分数
+    - n_rounds: 预筛选 + 求解的轮数
+
+    Returns:
+    - 按丰度从高到低排列的 (filename, name, abundance) 列表，abundance 为百分比
+    - 拟合的相对残差
+    """
+    valid = ~np.isnan(y)
+    scale = np.max(np.abs(y[valid])) if valid.any() else 0
+    if scale == 0 or len(library) == 0:
+        return [], 1.0
+    y_norm = np.where(valid, y, 0) / scale
+
+    candidates = top_candidates(peak_scores(library, peak_indices_on_grid(library.grid, y, peaks_x)),
+                                n_candidates)
+    for round_ in range(n_rounds):
+        A = library.matrix[candidates][:, valid].T
+        coef, rnorm = nnls(A, y_norm[valid])
+        if round_ == n_rounds - 1:
+            break
+        # 在残差中寻找尚未被解释的峰，补充候选
+        residual = y_norm.copy()
+        residual[valid] -= A @ coef
+        residual[~valid] = np.nan
+        residual_peaks = peak_indices_on_grid(library.grid, np.clip(residual, 0, None))
+        if len(residual_peaks) == 0:
+            break
+        extra = top_candidates(peak_scores(library, residual_peaks), n_candidates // 2, exclude=candidates)
+        if len(extra) == 0:
+            break
+        candidates = np.concatenate([candidates[coef > 0], extra])
+
+    # 只保留最重要的组分并重新拟合，使丰度之和与残差对应同一组分集合
+    keep = np.flatnonzero(coef > 0)
+    keep = keep[np.argsort(coef[keep])[::-1][:max_components]]
+    if len(keep) == 0:
+        return [], 1.0
+    coef, rnorm = nnls(A[:, keep], y_norm[valid])
+
+    # 以各组分对总信号的贡献（积分面积）计算丰度
+    contributions = coef * A[:, keep].sum(axis=0)
+    total = contributions.sum()
+    if total <= 0:
+        return [], 1.0
+    abundances = 100 * contributions / total
+    results = []
+    for i in np.argsort(abundances)[::-1]:
+        if abundances[i] <= 0:
+            continue
+        ref = candidates[keep[i]]
+        results.append((library.filenames[ref], library.names[ref], abundances[i]))
+    residual = rnorm / np.linalg.norm(y_norm[valid])
+    return results, residual
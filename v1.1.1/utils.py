@@ -39,6 +39,23 @@ def fetch_filename_and_peaks_filtered(database_path, peaks_set, tol):
     
     return matching_rows
 
+def fetch_spectra_by_filename(database_path, filenames, chunk_size=500):
+    """Fetch (filename, data_x, data_y) rows for the given filenames only"""
+    conn = sqlite3.connect(database_path)
+    cursor = conn.cursor()
+    
+    # Query in chunks to stay below SQLite's limit on bound parameters
+    rows = []
+    for start in range(0, len(filenames), chunk_size):
+        chunk = filenames[start:start + chunk_size]
+        placeholders = ", ".join("?" * len(chunk))
+        cursor.execute(f"SELECT filename, data_x, data_y FROM Spectra WHERE filename IN ({placeholders})", chunk)
+        rows += cursor.fetchall()
+    
+    conn.close()
+    
+    return rows
+
 def peaks_within_tolerance(known_peaks, unknown_peak, tol):
     """Check if the unknown peak is within tolerance of any of the known peaks."""
     for peak in known_peaks:
@@ -53,7 +70,7 @@ def check_peak_superset(db_peaks, unknown_peaks, tol):
             return False
     return True
 
-def find_spectrum_matches(database_path, unknown_peaks, tol):
+def find_spectrum_matches(database_path, unknown_peaks, tol, rows=None):
     """
     Find potential mineral combinations in the database that match the unknown spectrum.
     
@@ -61,14 +78,17 @@ def find_spectrum_matches(database_path, unknown_peaks, tol):
     - database_path: path to the SQLite database
     - unknown_peaks: list of peaks from the unknown spectrum
     - tol: the tolerance
+    - rows: optional pre-filtered (filename, peaks) rows, e.g. a fingerprint shortlist;
+      if None, candidates are fetched from the database
     
     Returns:
     - List of combinations (filename sets) that match the unknown spectrum
     """
     
-    rows = fetch_filename_and_peaks_filtered(database_path, unknown_peaks, tol)
+    if rows is None:
+        rows = fetch_filename_and_peaks_filtered(database_path, unknown_peaks, tol)
     filenames = [row[0] for row in rows]
-    db_peak_sets = [set(eval(row[1])) for row in rows]
+    db_peak_sets = [set(eval(row[1])) if isinstance(row[1], str) else set(row[1]) for row in rows]
     
     potential_matches = {1: [], 2: [], 3: []}
     
@@ -166,7 +186,11 @@ def baseline_als(y, lam=1e5, p=0.05, niter=1000):
         W.setdiag(w)
         Z = W + D
         z_valid = spsolve(csc_matrix(Z), w*y_valid)
-        w = p * (y_valid > z_valid) + (1-p) * (y_valid < z_valid)
+        w_new = p * (y_valid > z_valid) + (1-p) * (y_valid < z_valid)
+        # 权重不再变化时基线已收敛，继续迭代只会得到相同的结果
+        if np.array_equal(w_new, w):
+            break
+        w = w_new
     
     z = np.empty_like(y)
     z[:] = np.nan
@@ -0,0 +1,337 @@
+"""监视文件夹：光谱仪不断写入新的 .txt / .csv 文件时，自动对其运行处理流水线并与光谱库比对
+
+- 轮询目录（不依赖 inotify 等平台相关的库），文件的修改时间超过 settle_time 秒后才认为已写完
+- 有界的工作队列和固定数量的工作线程：突发大量文件时扫描线程会阻塞等待，内存占用有上限
+- 以文件内容的 sha256 去重，处理记录保存在 SQLite 中，重启后不会重复处理
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from ann_index import load_or_build_index, search_library
+from library import SpectralLibrary, make_grid, resample_to_grid
+from pipeline import Pipeline, masked_y
+from reader import iter_blocks, sniff
+from utils import get_xy_from_file
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """按块计算文件内容的 sha256"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ProcessedStore:
+    """已处理文件的持久记录，多个工作线程共享一个连接（由锁保护）"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS Processed (
+                    sha256 TEXT PRIMARY KEY, path TEXT, size INTEGER, mtime REAL,
+                    status TEXT, result TEXT, processed_at REAL)""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS processed_path ON Processed (path)")
+            # 内容与已登记文件相同的其他路径，指向登记了该内容的 sha256
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS Duplicates (
+                    path TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha256 TEXT)""")
+            # 上次退出时正在处理的文件需要重新处理，其重复文件也一并重新检查
+            self.conn.execute("DELETE FROM Processed WHERE status = 'processing'")
+            self.conn.execute("DELETE FROM Duplicates WHERE sha256 NOT IN (SELECT sha256 FROM Processed)")
+
+    def known(self, path, size, mtime):
+        """同一路径、大小和修改时间的文件是否已经记录过（包括内容重复的文件，无需计算哈希）"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM Processed WHERE path = ? AND size = ? AND mtime = ? "
+                "UNION ALL SELECT 1 FROM Duplicates WHERE path = ? AND size = ? AND mtime = ?",
+                (str(path), size, mtime) * 2).fetchone()
+        return row is not None
+
+    def claim(self, sha256, path, size, mtime):
+        """登记开始处理；内容相同的文件已被登记过时把该路径记为重复并返回 False"""
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO Processed VALUES (?, ?, ?, ?, 'processing', NULL, NULL)",
+                (sha256, str(path), size, mtime))
+            if cursor.rowcount == 1:
+                return True
+            self.conn.execute("INSERT OR REPLACE INTO Duplicates VALUES (?, ?, ?, ?)",
+                              (str(path), size, mtime, sha256))
+        return False
+
+    def finish(self, sha256, status, result):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE Processed SET status = ?, result = ?, processed_at = ? WHERE sha256 = ?",
+                              (status, json.dumps(result, ensure_ascii=False), time.time(), sha256))
+
+    def counts(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM Processed GROUP BY status"))
+
+    def close(self):
+        self.conn.close()
+
+
+class Identifier:
+    """对一个光谱文件运行处理流水线并在光谱库中检索，可被多个线程同时调用
+
+    Pipeline 会缓存中间结果，因此每个线程使用自己的 Pipeline 实例。
+    """
+
+    def __init__(self, library, index, specs=(), k=5, n_candidates=200, n_probe=8):
+        self.library = library
+        self.index = index
+        self.specs = list(specs)
+        self.k = k
+        self.n_candidates = n_candidates
+        self.n_probe = n_probe
+        self._local = threading.local()
+
+    def pipeline(self):
+        if not hasattr(self._local, 'pipeline'):
+            self._local.pipeline = Pipeline.from_list(self.specs)
+        return self._local.pipeline
+
+    def matches(self, x, y, k):
+        y = resample_to_grid(x, y, self.library.grid)
+        indices, scores = search_library(self.index, self.library, y, k=k,
+                                         n_candidates=self.n_candidates, n_probe=self.n_probe)
+        return [[self.library.filenames[i], self.library.names[i], round(float(s), 4)]
+                for i, s in zip(indices, scores)]
+
+    def __call__(self, path):
+        layout = sniff(path)
+        if not layout.is_multi:
+            state = self.pipeline().run(*get_xy_from_file(Path(path)))
+            result = {'matches': self.matches(state['x'], masked_y(state), self.k)}
+            if 'peaks' in state:
+                result['peaks'] = np.round(state['peaks'][0], 2).tolist()
+            return result
+        # 多光谱文件：逐块处理，每条光谱只保留最佳匹配
+        spectra = []
+        for block in iter_blocks(path, layout=layout):
+            state = self.pipeline().run(block.x, block.y)
+            for coords, y in zip(block.coords, masked_y(state)):
+                matches = self.matches(state['x'], y, 1)
+                spectra.append({'coords': coords.tolist(), 'match': matches[0] if matches else None})
+        return {'spectra': spectra}
+
+
+class FolderWatcher:
+    """轮询目录并把新文件交给工作线程处理
+
+    Parameters:
+    - folder: 监视的目录
+    - identify: 可调用对象 identify(path) -> 可序列化为 JSON 的结果
+    - store: ProcessedStore
+    - workers: 工作线程数
+    - queue_size: 工作队列容量
+    - poll_interval: 两次扫描的间隔（秒）
+    - settle_time: 文件修改时间超过该秒数后才开始处理，避免读到写了一半的文件
+    """
+
+    def __init__(self, folder, identify, store, workers=4, queue_size=256, poll_interval=1.0,
+                 settle_time=1.0, extensions=('.txt', '.csv')):
+        self.folder = Path(folder)
+        self.identify = identify
+        self.store = store
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.extensions = extensions
+        # 已入队或正在处理的文件：路径 -> 入队时的 (大小, 修改时间)
+        # 记录到 store 后移除（之后由 store.known 跳过），已从目录中移走的文件在扫描时移除
+        self.queued = {}
+        self.queued_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.stats = {'processed': 0, 'duplicate': 0, 'failed': 0}
+        self.stats_lock = threading.Lock()
+
+    def scan(self):
+        """返回已写完且尚未处理的文件"""
+        now = time.time()
+        ready = []
+        seen = set()
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith(self.extensions):
+                    continue
+                seen.add(entry.path)
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime)
+                if now - stat.st_mtime < self.settle_time:
+                    continue
+                with self.queued_lock:
+                    if self.queued.get(entry.path) == signature:
+                        continue
+                if self.store.known(entry.path, *signature):
+                    continue
+                with self.queued_lock:
+                    self.queued[entry.path] = signature
+                ready.append((entry.path, *signature))
+        # 已从目录中移走的文件不再需要记录
+        with self.queued_lock:
+            for path in set(self.queued) - seen:
+                del self.queued[path]
+        return ready
+
+    def _forget(self, path, size, mtime):
+        """文件已记录到 store 后从 queued 中移除"""
+        with self.queued_lock:
+            if self.queued.get(path) == (size, mtime):
+                del self.queued[path]
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            try:
+                self._process(*item)
+            except Exception as e:
+                # 任何意外错误都只影响这一个文件，工作线程继续运行，queue.join() 不会挂起
+                self._count('failed')
+                print(f'处理出错：{item[0]}：{type(e).__name__}: {e}', flush=True)
+            finally:
+                self.queue.task_done()
+
+    def _process(self, path, size, mtime):
+        try:
+            sha256 = file_sha256(path)
+        except OSError as e:
+            # 文件在处理前被移走或删除
+            self._count('failed')
+            print(f'无法读取：{path}：{e}', flush=True)
+            return
+        if not self.store.claim(sha256, path, size, mtime):
+            # 内容相同的文件已处理过：该路径已记为重复，之后由 store.known 跳过
+            self._forget(path, size, mtime)
+            self._count('duplicate')
+            return
+        try:
+            result = self.identify(path)
+        except Exception as e:
+            self.store.finish(sha256, 'failed', {'error': str(e)})
+            self._forget(path, size, mtime)
+            self._count('failed')
+            print(f'处理失败：{path}：{e}', flush=True)
+            return
+        self.store.finish(sha256, 'done', result)
+        self._forget(path, size, mtime)
+        self._count('processed')
+        if 'matches' in result:
+            best = result['matches'][0][1] if result['matches'] else '无匹配'
+        else:
+            best = '多光谱文件'
+        print(f'已处理：{path} -> {best}', flush=True)
+
+    def run(self, once=False):
+        """开始监视，直到 stop() 被调用；once 为 True 时只处理当前已有的文件"""
+        threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while not self.stop_event.is_set():
+                for item in self.scan():
+                    # 队列已满时在此阻塞，直到工作线程腾出空间
+                    while not self.stop_event.is_set():
+                        try:
+                            self.queue.put(item, timeout=self.poll_interval)
+                            break
+                        except queue.Full:
+                            continue
+                if once:
+                    break
+                self.stop_event.wait(self.poll_interval)
+        finally:
+            self.queue.join()
+            for _ in threads:
+                self.queue.put(None)
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def benchmark(folder, identify, n_files=500, workers=4, seed=0):
+    """向空目录中一次写入 n_files 个光谱文件，测量全部处理完所需的时间"""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    x = np.linspace(100, 1500, 1400)
+    for i in range(n_files):
+        centres = rng.uniform(200, 1400, 4)
+        y = np.exp(-((x[:, None] - centres) / 6) ** 2).sum(axis=1) + rng.normal(0, 0.01, len(x))
+        np.savetxt(folder / f'burst_{i:05d}.txt', np.column_stack([x[::-1], y[::-1]]), fmt='%.4f')
+    # 再写入一份内容相同的副本，检验去重
+    (folder / 'burst_copy.txt').write_bytes((folder / 'burst_00000.txt').read_bytes())
+    time.sleep(0.1)
+
+    store = ProcessedStore(folder / 'processed.db')
+    watcher = FolderWatcher(folder, identify, store, workers=workers, settle_time=0)
+    start = time.perf_counter()
+    watcher.run(once=True)
+    elapsed = time.perf_counter() - start
+    print(f'{n_files + 1} 个文件，{workers} 个工作线程：用时 {elapsed:.2f} 秒，'
+          f'{(n_files + 1) / elapsed:.1f} 个文件/秒，{watcher.stats}')
+    store.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='监视文件夹，自动处理并鉴定新写入的光谱文件')
+    parser.add_argument('folder', help='监视的目录')
+    parser.add_argument('database', help='SQLite 光谱数据库路径')
+    parser.add_argument('--pipeline', help='处理流水线 JSON 文件')
+    parser.add_argument('--store', help='处理记录数据库，默认为监视目录下的 processed.db')
+    parser.add_argument('--benchmark', type=int, metavar='N', help='向 folder 写入 N 个文件并测量处理速度')
+    args = parser.parse_args()
+
+    with open('config.json', 'r') as f:
+        config = json.load(f)
+    grid = make_grid(config['library grid start'], config['library grid end'], config['library grid step'])
+    library = SpectralLibrary.from_database(args.database, grid)
+    index = load_or_build_index(library, args.database, n_components=config['index components'])
+    specs = []
+    if args.pipeline:
+        with open(args.pipeline, 'r') as f:
+            specs = Pipeline.from_json(f.read()).to_list()
+    identify = Identifier(library, index, specs, n_candidates=config['index candidates'],
+                          n_probe=config['index probes'])
+
+    if args.benchmark:
+        benchmark(args.folder, identify, n_files=args.benchmark, workers=config['watch workers'])
+    else:
+        store = ProcessedStore(args.store or Path(args.folder) / 'processed.db')
+        watcher = FolderWatcher(args.folder, identify, store, workers=config['watch workers'],
+                                queue_size=config['watch queue size'],
+                                poll_interval=config['watch poll interval'],
+                                settle_time=config['watch settle time'])
+        print(f'正在监视 {args.folder}，按 Ctrl+C 退出', flush=True)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            watcher.stop()
+        print(store.counts())
+        store.close()
@@ -0,0 +1,127 @@
+"""频域互相关匹配：一次性计算未知光谱与整个参考光谱库的归一化互相关，容忍波数标定漂移
+
+NaN（被裁剪的点、测量范围之外的点）不参与计算：均值和范数只在有限的点上计算，
+每个延迟的相关系数只在两条光谱都有数据的重叠部分上归一化。
+"""
+
+import numpy as np
+from scipy import fft
+
+# 重叠部分少于未知光谱有效点数的这一比例时，该延迟不参与比较（点数太少时相关系数没有意义）
+MIN_OVERLAP = 0.5
+
+
+def normalize_rows(matrix):
+    """逐行去均值并归一化为单位范数；均值和范数只在有限的点上计算，NaN 的位置为 0"""
+    matrix = np.atleast_2d(matrix).astype(np.float32)
+    finite = np.isfinite(matrix)
+    if finite.all():
+        matrix = matrix - matrix.mean(axis=1, keepdims=True)
+    else:
+        counts = finite.sum(axis=1, keepdims=True)
+        matrix = np.where(finite, matrix, 0)
+        mean = matrix.sum(axis=1, keepdims=True) / np.maximum(counts, 1)
+        matrix = np.where(finite, matrix - mean, 0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def masked_pearson(matrix, queries, cache=None):
+    """每条查询光谱与 matrix 每一行的皮尔逊相关系数，返回 (n_queries, n_rows)
+
+    只在查询光谱的有限点上比较：参考光谱也只在这些点上去均值和归一化，
+    因此裁剪过或测量范围较窄的光谱与其来源光谱的相关系数仍为 1。有效点相同的查询一起计算，
+    有效点少于两个的查询得分为 0。
+    cache 为 dict 时，按有效点的模式缓存归一化后的参考矩阵（如面扫描的各个像素块）。
+    """
+    queries = np.atleast_2d(queries)
+    finite = np.isfinite(queries)
+    scores = np.zeros((len(queries), len(matrix)), dtype=np.float32)
+    if (finite == finite[0]).all():
+        patterns, groups = finite[:1], np.zeros(len(queries), dtype=int)
+    else:
+        patterns, groups = np.unique(finite, axis=0, return_inverse=True)
+    for g, pattern in enumerate(patterns):
+        if pattern.sum() < 2:
+            continue
+        rows = np.flatnonzero(groups.ravel() == g)
+        key = pattern.tobytes()
+        references = None if cache is None else cache.get(key)
+        if references is None:
+            references = normalize_rows(matrix if pattern.all() else matrix[:, pattern])
+            if cache is not None:
+                cache[key] = references
+        scores[rows] = normalize_rows(queries[rows][:, pattern]) @ references.T
+    return scores
+
+
+def xcorr_match(library, y, max_shift, chunk_size=1000):
+    """计算未知光谱与库中每条参考光谱在 ±max_shift（cm^-1）窗口内的最大归一化互相关
+
+    每个延迟的相关系数是两条光谱在重叠部分（都不为 NaN 的点）上的皮尔逊相关系数。
+    重叠部分的点数、和与平方和都是有效点掩码、强度和强度平方之间的互相关，
+    所有参考光谱分块在频域中一次批量计算。
+
+    Parameters:
+    - library: SpectralLibrary，参考光谱已重采样到 library.grid
+    - y: 未知光谱在 library.grid 上的强度（NaN 表示被裁剪或未测量的点）
+    - max_shift: 允许的最大波数偏移（cm^-1）
+    - chunk_size: 每次参与 FFT 的参考光谱数，用于限制内存占用
+
+    Returns:
+    - scores: 每条参考光谱的最大归一化互相关，范围 [-1, 1]（没有足够的重叠或强度恒定时为 0）
+    - offsets: 取得最大值时未知光谱相对参考光谱的波数偏移（cm^-1）
+    """
+    n_points = len(library.grid)
+    step = library.grid[1] - library.grid[0]
+    max_lag = min(int(round(max_shift / step)), n_points - 1)
+    # 线性（非循环）互相关所需的 FFT 长度
+    n_fft = fft.next_fast_len(n_points + max_lag)
+    lags = np.arange(-max_lag, max_lag + 1)
+
+    # 只需要 ±max_lag 处的互相关：未知光谱的频谱与只含这些延迟的实数逆 DFT 合并成一个矩阵，
+    # 每块参考光谱的频谱（实部、虚部交错存放）与它相乘一次就得到所有延迟，无需完整的 irfft
+    frequencies = np.arange(n_fft // 2 + 1)
+    weights = np.where((frequencies == 0) | (2 * frequencies == n_fft), 1.0, 2.0) / n_fft
+    phase = 2 * np.pi * np.outer(frequencies, lags) / n_fft
+    cos, sin = weights[:, None] * np.cos(phase), -weights[:, None] * np.sin(phase)
+
+    def kernel(a):
+        """矩阵 K，使 B 的频谱与 K 相乘得到 corr[k] = sum_i a[i + k] * b[i]"""
+        A = fft.rfft(a.astype(float), n=n_fft)[:, None]
+        K = np.empty((2 * len(frequencies), len(lags)), dtype=np.float32)
+        K[0::2] = A.real * cos + A.imag * sin
+        K[1::2] = A.imag * cos - A.real * sin
+        return K
+
+    def correlate(b, kernels):
+        B = fft.rfft(np.atleast_2d(b), n=n_fft, axis=-1).astype(np.complex64)
+        return np.split(B.view(np.float32) @ np.hstack(kernels), len(kernels), axis=1)
+
+    # 先在各自的有效点上去均值、归一化，使重叠部分的和与平方和的数值都在 1 附近，减小相消误差
+    u = normalize_rows(y)[0]
+    mu = np.isfinite(y).astype(np.float32)
+    U, U2, MU = kernel(u), kernel(u ** 2), kernel(mu)
+    min_overlap = max(3, MIN_OVERLAP * mu.sum())
+
+    scores = np.zeros(len(library), dtype=np.float32)
+    offsets = np.zeros(len(library))
+    for start in range(0, len(library), chunk_size):
+        rows = library.matrix[start:start + chunk_size]
+        r = normalize_rows(rows)
+        mr = np.isfinite(rows)
+        # 参考光谱通常没有 NaN，所有行共用同一个掩码
+        n, su, suu = correlate(mr[0] if mr.all() else mr, [MU, U, U2])
+        sr, sur = correlate(r, [MU, U])
+        srr, = correlate(r ** 2, [MU])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            covariance = sur - su * sr / n
+            variance = (suu - su ** 2 / n) * (srr - sr ** 2 / n)
+            corr = covariance / np.sqrt(variance)
+        corr = np.where((np.broadcast_to(n, corr.shape) >= min_overlap - 0.5) & (variance > 1e-12), corr, -np.inf)
+        best = corr.argmax(axis=1)
+        value = corr[np.arange(len(rows)), best]
+        scores[start:start + chunk_size] = np.where(np.isfinite(value), np.clip(value, -1, 1), 0)
+        offsets[start:start + chunk_size] = lags[best] * step
+    return scores, offsets